@@ -1,9 +1,61 @@
-"""Defines the etl module package."""
-from config import Config
-from connection import Connection
-from create_tables import SchemaPipeline
-from etl import ETLPipeline
-from s3 import S3Loader
-from sql_queries import *
-
-__all__ = ('Config', 'Connection', 'SchemaPipeline', 'ETLPipeline', 'S3Loader',)
+"""Defines the etl module package.
+
+The public names are imported from their modules on first access,
+so importing the package does not load boto3, pandas or the database
+connectors until a class that needs them is used.
+"""
+import importlib
+
+# public name to the module defining it
+MODULES = {
+    'AsyncRunner': 'async_runner',
+    'DiskCache': 'cache', 'ObjectCache': 'cache',
+    'Checkpoint': 'checkpoint',
+    'FileCompactor': 'compaction',
+    'Config': 'config',
+    'Connection': 'connection',
+    'CopyLoader': 'copy_loader',
+    'SchemaPipeline': 'create_tables',
+    'PostgresConnection': 'dialect',
+    'ETLPipeline': 'etl',
+    'DataGenerator': 'generator',
+    'IncrementalPipeline': 'incremental',
+    'IndexEntry': 'index', 'PrefixIndex': 'index',
+    'TableMaintenance': 'maintenance',
+    'MetricsRecorder': 'metrics',
+    'SchemaMigration': 'migrate',
+    'CopyPlanner': 'planner',
+    'ConnectionPool': 'pool',
+    'QueryCache': 'result_cache',
+    'S3Loader': 's3',
+    'DagScheduler': 'scheduler', 'Step': 'scheduler',
+    'Schema': 'schema', 'STAGING_EVENTS_SCHEMA': 'schema',
+    'STAGING_SONGS_SCHEMA': 'schema',
+    'DimensionUpsert': 'upsert',
+}
+
+__all__ = ('Config', 'Connection', 'ConnectionPool', 'SchemaPipeline',
+           'ETLPipeline', 'S3Loader', 'IncrementalPipeline',
+           'DiskCache', 'ObjectCache', 'IndexEntry', 'PrefixIndex',
+           'Schema', 'STAGING_EVENTS_SCHEMA', 'STAGING_SONGS_SCHEMA',
+           'DagScheduler', 'Step', 'DimensionUpsert', 'MetricsRecorder',
+           'PostgresConnection', 'DataGenerator', 'CopyLoader',
+           'SchemaMigration', 'CopyPlanner', 'FileCompactor',
+           'Checkpoint', 'AsyncRunner', 'QueryCache', 'TableMaintenance',)
+
+
+def __getattr__(name):
+    """Imports a public name, or a sql_queries statement, on first access."""
+    module = importlib.import_module(MODULES.get(name, 'sql_queries'))
+    try:
+        value = getattr(module, name)
+    except AttributeError:
+        raise AttributeError(
+            f'module {__name__!r} has no attribute {name!r}') from None
+
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(MODULES))
@@ -0,0 +1,375 @@
+"""Defines the AsyncRunner class to drive pipeline statements from asyncio.
+
+The database connectors are blocking, so each statement runs on a
+pooled connection in a worker thread and the event loop only awaits
+it. Every statement has a deadline: when it passes, the statement is
+cancelled on the server with pg_cancel_backend from a control session,
+and a failed statement cancels its running siblings the same way. The
+progress events are streamed through an asyncio queue, so one
+orchestrator process can drive and watch many pipelines at once.
+"""
+
+# sys libs
+import asyncio
+import argparse
+import threading
+import collections
+from timeit import default_timer as timer
+from concurrent.futures import ThreadPoolExecutor
+# config libs
+from config import Config
+# SQL libs
+from connection import Connection
+from pool import ConnectionPool
+from scheduler import validate
+from sql_queries import SELECT_BACKEND_PID, SELECT_CANCEL_BACKEND
+from sql_queries import DROP_TABLE_STAGING_PLAYS
+
+# seconds between the cancels of a statement that is still running
+CANCEL_INTERVAL = 1.0
+
+# progress event: status is started, finished, failed, timeout
+# or cancelled, error is the exception of the failed steps
+Event = collections.namedtuple('Event', ['step', 'status', 'seconds',
+                                         'error'])
+
+
+class AsyncRunner:
+    """This class defines the asyncio dependency-aware statement runner.
+
+    Like the DagScheduler, a step starts as soon as the steps writing
+    its source tables have finished, and the first error stops the
+    run. Cancelling the run task cancels the running statements too.
+
+    Usage example:
+
+    runner = AsyncRunner(connection, pool, max_workers=4, timeout=600)
+    task = asyncio.create_task(runner.run(pipeline.steps()))
+    async for event in runner.progress():
+        print(event.step, event.status)
+    times = await task
+
+    Usage example as python script with redshift connection:
+
+    python -m async_runner --redshift --parallel 4 --timeout 600
+    """
+
+    def __init__(self, connection, pool, max_workers=4, timeout=None,
+                 timeouts=None):
+        """Creates the AsyncRunner object.
+
+        Args:
+            connection: The control connection adapter wrapper that
+                sends the server side cancels.
+            pool: The ConnectionPool object of the statements.
+            max_workers: The maximum number of concurrent statements.
+            timeout: The default statement deadline in seconds.
+                If None, the statements have no deadline.
+            timeouts: An optional dict of step name to its deadline
+                in seconds, overriding timeout.
+        """
+        self.connection = connection
+        self.pool = pool
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self.events = asyncio.Queue()
+        self.lock = threading.Lock()
+        self.control = threading.Lock()
+        # step name to the backend process id of its session
+        self.pids = {}
+        self.cancelled = set()
+
+    def __event(self, step, status, seconds=0.0, error=None):
+        """Queues a progress event."""
+        self.events.put_nowait(Event(step, status, seconds, error))
+
+    async def progress(self):
+        """Streams the progress events until the run ends.
+
+        Yields:
+            An Event object per step state change.
+        """
+        while True:
+            event = await self.events.get()
+            if event is None:
+                return
+            yield event
+
+    def __execute(self, step):
+        """Runs one step on a pooled connection in a worker thread.
+
+        Args:
+            step: The Step object.
+        """
+        with self.pool.connection() as connection:
+            pid = connection.query(SELECT_BACKEND_PID)[0][0]
+            with self.lock:
+                if step.name in self.cancelled:
+                    raise RuntimeError(f'step {step.name} cancelled')
+                self.pids[step.name] = pid
+
+            try:
+                # a deadline may have passed while the pid was registered
+                with self.lock:
+                    if step.name in self.cancelled:
+                        raise RuntimeError(f'step {step.name} cancelled')
+                connection.execute(step.query, commit=True)
+            finally:
+                with self.lock:
+                    del self.pids[step.name]
+
+    def __cancel_backend(self, name):
+        """Cancels the statement of a step on the server.
+
+        The steps still waiting for a connection are flagged, so
+        they do not start.
+
+        Args:
+            name: The step name.
+        """
+        with self.lock:
+            self.cancelled.add(name)
+            pid = self.pids.get(name)
+
+        if pid is None:
+            return
+
+        # the control connection is shared by the cancelling threads
+        with self.control:
+            try:
+                self.connection.query(SELECT_CANCEL_BACKEND, (pid,))
+            finally:
+                self.connection.rollback()
+
+    async def __cancel(self, loop, executor, names):
+        """Cancels the statements of the steps and waits for the cancels.
+
+        Args:
+            loop: The running event loop.
+            executor: The worker threads executor.
+            names: The step names.
+        """
+        await asyncio.gather(*(loop.run_in_executor(
+            executor, self.__cancel_backend, name) for name in names))
+
+    async def __cancel_step(self, loop, executor, name, future):
+        """Cancels the statement of a step until its worker returns.
+
+        A cancel sent between the pid lookup and the statement start
+        reaches an idle session and does nothing, so it is sent again
+        every CANCEL_INTERVAL seconds while the statement runs.
+
+        Args:
+            loop: The running event loop.
+            executor: The worker threads executor.
+            name: The step name.
+            future: The worker future of the step.
+        """
+        while not future.done():
+            await self.__cancel(loop, executor, [name])
+            await asyncio.wait([future], timeout=CANCEL_INTERVAL)
+
+        await asyncio.gather(future, return_exceptions=True)
+
+    async def __run_step(self, loop, executor, step):
+        """Runs one step with its deadline and queues its events.
+
+        Args:
+            loop: The running event loop.
+            executor: The worker threads executor.
+            step: The Step object.
+
+        Returns:
+            The step execution time in seconds.
+
+        Raises:
+            TimeoutError: If the step passed its deadline.
+        """
+        timeout = self.timeouts.get(step.name, self.timeout)
+        self.__event(step.name, 'started')
+        start = timer()
+
+        future = loop.run_in_executor(executor, self.__execute, step)
+        try:
+            # the shield keeps the worker future until it is cancelled
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            await self.__cancel_step(loop, executor, step.name, future)
+            error = TimeoutError(f'step {step.name} exceeded its '
+                                 f'{timeout} seconds deadline')
+            self.__event(step.name, 'timeout', timer() - start, error)
+            raise error from None
+        except asyncio.CancelledError:
+            await self.__cancel_step(loop, executor, step.name, future)
+            self.__event(step.name, 'cancelled', timer() - start)
+            raise
+        except Exception as error:
+            status = 'cancelled' if step.name in self.cancelled else 'failed'
+            self.__event(step.name, status, timer() - start, error)
+            raise
+
+        seconds = timer() - start
+        self.__event(step.name, 'finished', seconds)
+        return seconds
+
+    async def run(self, steps):
+        """Runs the steps respecting their dependencies.
+
+        Args:
+            steps: A list of Step objects.
+
+        Returns:
+            A dict of step name to execution time in seconds,
+            in completion order.
+
+        Raises:
+            The exception of the first failed step.
+        """
+        validate(steps)
+        self.cancelled.clear()
+        loop = asyncio.get_running_loop()
+
+        names = {step.name for step in steps}
+        waiting = list(steps)
+        done = set()
+        times = {}
+        running = {}
+
+        # one more thread sends the cancels while all steps are running
+        executor = ThreadPoolExecutor(max_workers=self.max_workers + 1)
+        try:
+            while waiting or running:
+
+                # start the steps whose source tables are loaded
+                for step in list(waiting):
+                    if len(running) == self.max_workers:
+                        break
+                    if set(step.depends) & names <= done:
+                        waiting.remove(step)
+                        task = asyncio.ensure_future(
+                            self.__run_step(loop, executor, step))
+                        running[task] = step
+
+                finished, _ = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in finished:
+                    step = running.pop(task)
+                    error = task.exception()
+
+                    if error is not None:
+                        # the running steps cancel their statements
+                        for other in running:
+                            other.cancel()
+                        await asyncio.gather(*running,
+                                             return_exceptions=True)
+                        raise error
+
+                    times[step.name] = task.result()
+                    done.add(step.name)
+        except asyncio.CancelledError:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+            raise
+        finally:
+            # the worker threads are done, do not block the event loop
+            executor.shutdown(wait=False)
+            self.events.put_nowait(None)
+
+        return times
+
+
+async def drive(runner, steps):
+    """Runs the steps and prints their progress events.
+
+    Args:
+        runner: The AsyncRunner object.
+        steps: A list of Step objects.
+
+    Returns:
+        A dict of step name to execution time in seconds.
+    """
+    task = asyncio.ensure_future(runner.run(steps))
+    async for event in runner.progress():
+        if event.status == 'started':
+            print(f'INFO: {event.step} started')
+            continue
+        error = f': {event.error}' if event.error is not None else ''
+        print(f'INFO: {event.step} {event.status} after '
+              f'{round(event.seconds, 2)} seconds{error}')
+    return await task
+
+
+def main(redshift, parallel=4, timeout=None, materialize=False):
+    """The async_runner.py script entry point.
+
+    Args:
+        redshift: If True uses the Redshift connector API,
+            otherwise use the default Psycopg2 adapter.
+        parallel: The maximum number of concurrent statements.
+        timeout: The statement deadline in seconds.
+        materialize: If True, the inserts read a materialized
+            staging join.
+    """
+    # the pipeline steps import the COPY statements on first use
+    # pylint: disable=import-outside-toplevel
+    from etl import ETLPipeline
+
+    config = Config()
+    connection = Connection(redshift=redshift, config=config)
+    pool = ConnectionPool(redshift=redshift, min_size=0,
+                          max_size=parallel, config=config)
+    pipeline = ETLPipeline(connection, pool=pool, max_workers=parallel,
+                           materialize=materialize)
+
+    print('-----------------------------------------------------')
+    print('AWS Redshift Async ETL Pipeline')
+    print('-----------------------------------------------------')
+
+    runner = AsyncRunner(connection, pool, max_workers=parallel,
+                         timeout=timeout)
+    start = timer()
+    try:
+        if materialize:
+            connection.execute(DROP_TABLE_STAGING_PLAYS, commit=True)
+        asyncio.run(drive(runner, pipeline.steps()))
+        if materialize:
+            connection.execute(DROP_TABLE_STAGING_PLAYS, commit=True)
+        # the cached query results of the previous loads are stale
+        connection.bump_generation()
+    finally:
+        pool.close()
+        connection.close()
+
+    print(f'Pipeline time: {round(timer() - start, 2)} seconds')
+
+
+if __name__ == '__main__':
+    # create the command line parser
+    parser = argparse.ArgumentParser(
+        description='AWS Redshift Async ETL Pipeline')
+
+    # set the command line arguments
+    parser.add_argument('--redshift',
+                        help='Set the redshift connector - default: pyscopg2',
+                        type=bool,
+                        default=False)
+    parser.add_argument('--parallel',
+                        help='Max concurrent statements - default: 4',
+                        type=int,
+                        default=4)
+    parser.add_argument('--timeout',
+                        help='Statement deadline in seconds - default: none',
+                        type=float,
+                        default=None)
+    parser.add_argument('--materialize',
+                        help='Share one materialized staging join',
+                        action='store_true')
+
+    # parse the command line arguments
+    args = parser.parse_args()
+
+    # run the pipeline
+    main(args.redshift, args.parallel, args.timeout, args.materialize)
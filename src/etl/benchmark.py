@@ -0,0 +1,487 @@
+"""Defines the benchmark script to measure the pipeline components
+against local stand-ins instead of the shared udacity-dend bucket.
+
+The S3 benchmarks run against the S3 compatible endpoint set in the
+dwh.cfg file (e.g. a local MinIO server). If no endpoint is set,
+a moto server is started in the background.
+
+The pipeline benchmarks generate a synthetic dataset, upload it to the
+S3 stand-in and run the SchemaPipeline, the staging load through the
+S3Loader and the ETLPipeline inserts on the PostgreSQL server set in the
+[POSTGRES] section of the dwh.cfg file. The phase results can be saved
+and compared to a baseline run.
+
+The startup benchmark times a fresh interpreter importing the pipeline
+scripts and lists the heavy libraries each import loads.
+
+Usage example as python script:
+
+python -m benchmark --objects 100 1000 10000 --max-workers 16
+
+python -m benchmark --objects --events 100000 1000000 --skew 1.2 \\
+    --output bench.json --baseline baseline.json
+
+python -m benchmark --objects --startup
+"""
+
+# sys libs
+import argparse
+import io
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer as timer
+# config libs
+from config import Config
+# AWS libs
+from s3 import S3Loader
+# data libs
+import pandas as pd
+from generator import DataGenerator
+from schema import STAGING_EVENTS_SCHEMA, STAGING_SONGS_SCHEMA
+# SQL libs
+from copy_loader import CopyLoader
+from create_tables import SchemaPipeline
+from dialect import PostgresConnection
+from etl import ETLPipeline
+from metrics import MetricsRecorder
+
+BENCH_BUCKET = 'sparkify-bench'
+
+# connection options copied from the [POSTGRES] section
+POSTGRES_OPTIONS = ('ENDPOINT', 'PORT', 'DATABASE', 'USER', 'PASSWORD')
+
+# libraries the startup benchmark looks for
+HEAVY_MODULES = ('boto3', 'pandas', 'pyarrow', 'psycopg2', 'redshift_connector')
+
+# modules imported by the startup benchmark
+STARTUP_MODULES = ('create_tables', 'etl', 'sql_queries')
+
+
+def start_s3_stand_in(config, port=5000):
+    """Points the config to a moto server if no S3 endpoint is set.
+
+    The moto server runs in a child process, so it does not compete
+    with the benchmark threads for the interpreter lock.
+
+    Args:
+        config: The dwh.cfg file wrapper object.
+        port: The moto server port.
+
+    Returns:
+        The moto server process or None when an endpoint is already set.
+    """
+    if config.get('S3', 'ENDPOINT', fallback=None):
+        return None
+
+    server = subprocess.Popen([sys.executable, '-m', 'moto.server',
+                               '-p', str(port)],
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+
+    # wait until the server accepts connections
+    for _ in range(100):
+        try:
+            socket.create_connection(('localhost', port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+
+    config.set('S3', 'ENDPOINT', f'http://localhost:{port}')
+
+    return server
+
+
+def create_bucket(loader):
+    """Creates the bench bucket if it does not exist.
+
+    Args:
+        loader: The S3Loader object.
+    """
+    region = loader.client.meta.region_name
+    try:
+        loader.client.create_bucket(
+            Bucket=BENCH_BUCKET,
+            CreateBucketConfiguration={'LocationConstraint': region})
+    except loader.client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+
+
+def seed_objects(loader, prefix, count, max_workers=32):
+    """Uploads small single record json objects to the bench bucket.
+
+    Args:
+        loader: The S3Loader object.
+        prefix: The object key prefix.
+        count: The number of objects to upload.
+        max_workers: The number of upload threads.
+
+    Returns:
+        The S3 path of the uploaded objects.
+    """
+    create_bucket(loader)
+
+    def put(index):
+        record = {'song_id': f'SO{index:08d}', 'title': f'Song {index}',
+                  'duration': 200.5, 'year': 2000, 'num_songs': 1}
+        loader.client.put_object(Bucket=BENCH_BUCKET,
+                                 Key=f'{prefix}/{index:08d}.json',
+                                 Body=json.dumps(record).encode('utf-8'))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(put, range(count)))
+
+    return f's3://{BENCH_BUCKET}/{prefix}'
+
+
+def bench_load_data(loader, bucket_path, count, max_workers):
+    """Measures the S3Loader.load_data wall time.
+
+    Args:
+        loader: The S3Loader object.
+        bucket_path: The S3 path of the seeded objects.
+        count: The number of objects to load.
+        max_workers: The S3Loader.load_data max_workers argument.
+
+    Returns:
+        The elapsed time in seconds.
+    """
+    start = timer()
+    data = loader.load_data(bucket_path, count, max_workers=max_workers)
+    elapsed = timer() - start
+
+    assert len(data) == count, 'unexpected number of loaded records'
+
+    return elapsed
+
+
+def synthetic_log_lines(rows, seed=42):
+    """Builds json lines shaped like the log_data events.
+
+    Args:
+        rows: The number of events.
+        seed: The random generator seed.
+
+    Returns:
+        The json lines as bytes.
+    """
+    rand = random.Random(seed)
+    pages = ['NextSong'] * 8 + ['Home', 'Logout', 'Login', 'Settings']
+
+    lines = []
+    for index in range(rows):
+        user = rand.randint(1, 100)
+        lines.append(json.dumps({
+            'artist': f'Artist {rand.randint(1, 5000)}',
+            'auth': rand.choice(['Logged In', 'Logged Out']),
+            'firstName': f'First {user}',
+            'gender': 'F' if user % 2 else 'M',
+            'itemInSession': index % 100,
+            'lastName': f'Last {user}',
+            'length': round(rand.uniform(60, 600), 5),
+            'level': rand.choice(['free', 'paid']),
+            'location': f'City {user % 30}, ST',
+            'method': rand.choice(['PUT', 'GET']),
+            'page': rand.choice(pages),
+            'registration': 1540000000000.0 + user,
+            'sessionId': rand.randint(1, 1000),
+            'song': f'Song {rand.randint(1, 20000)}',
+            'status': rand.choice([200, 307, 404]),
+            'ts': 1541105830796 + index * 1000,
+            'userAgent': 'Mozilla/5.0',
+            'userId': str(user)}))
+
+    return '\n'.join(lines).encode('utf-8')
+
+
+def bench_schema_memory(rows):
+    """Compares the DataFrame memory with and without the events schema.
+
+    Args:
+        rows: The number of synthetic events.
+
+    Returns:
+        A (inferred_bytes, typed_bytes) tuple.
+    """
+    body = synthetic_log_lines(rows)
+
+    inferred = pd.read_json(io.BytesIO(body), lines=True)
+    typed = STAGING_EVENTS_SCHEMA.apply(
+        pd.read_json(io.BytesIO(body), lines=True))
+
+    return (int(inferred.memory_usage(deep=True).sum()),
+            int(typed.memory_usage(deep=True).sum()))
+
+
+def bench_startup(module, runs=5):
+    """Measures the import time of a module in a fresh interpreter.
+
+    Args:
+        module: The module name. E.g. create_tables
+        runs: The number of interpreter runs, the median is kept.
+
+    Returns:
+        A (seconds, heavy_modules) tuple, the seconds exclude the bare
+        interpreter startup, heavy_modules lists the HEAVY_MODULES
+        loaded by the import.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+
+    def median_run(code):
+        times = []
+        for _ in range(runs):
+            start = timer()
+            subprocess.run([sys.executable, '-c', code], cwd=directory,
+                           check=True, stdout=subprocess.DEVNULL)
+            times.append(timer() - start)
+        return sorted(times)[len(times) // 2]
+
+    seconds = median_run(f'import {module}') - median_run('pass')
+
+    loaded = subprocess.run(
+        [sys.executable, '-c',
+         f'import sys, {module}; print(*(name for name in '
+         f'{HEAVY_MODULES!r} if name in sys.modules))'],
+        cwd=directory, check=True, capture_output=True, text=True)
+
+    return seconds, loaded.stdout.split()
+
+
+def postgres_config(config):
+    """Points the database options to the PostgreSQL stand-in.
+
+    Args:
+        config: The dwh.cfg file wrapper object.
+
+    Returns:
+        The same Config object.
+    """
+    for option in POSTGRES_OPTIONS:
+        config.set('REDSHIFT', option, config.get('POSTGRES', option))
+    return config
+
+
+def bench_pipeline(config, loader, events, skew, max_workers):
+    """Measures the pipeline phases on a synthetic dataset.
+
+    Args:
+        config: The dwh.cfg file wrapper object pointing to the
+            PostgreSQL and the S3 stand-ins.
+        loader: The S3Loader object.
+        events: The number of synthetic events.
+        skew: The Zipf exponent of the song popularity.
+        max_workers: The S3Loader thread pool size.
+
+    Returns:
+        A dict of phase name to a dict with the seconds and rows
+        of the phase, and the per statement metrics.
+    """
+    phases = {}
+    generator = DataGenerator(events, skew=skew)
+    bucket_path = f's3://{BENCH_BUCKET}/sparkify_{events}'
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = timer()
+        stats = generator.write(directory)
+        phases['generate'] = {'seconds': timer() - start,
+                              'rows': stats['events'] + stats['songs']}
+
+        create_bucket(loader)
+        start = timer()
+        files = generator.upload(loader, directory, bucket_path)
+        phases['upload'] = {'seconds': timer() - start, 'rows': files}
+
+    metrics = MetricsRecorder('benchmark')
+    connection = PostgresConnection(config=config, metrics=metrics)
+
+    try:
+        start = timer()
+        SchemaPipeline(connection).run()
+        phases['schema'] = {'seconds': timer() - start, 'rows': 0}
+
+        copy_loader = CopyLoader(connection, loader,
+                                 max_workers=max_workers)
+        for table, prefix, schema in (
+                ('staging_events', 'log_data', STAGING_EVENTS_SCHEMA),
+                ('staging_songs', 'song_data', STAGING_SONGS_SCHEMA)):
+            start = timer()
+            rows, _ = copy_loader.copy(
+                table, list(schema.dtypes), loader.iter_frames(
+                    f'{bucket_path}/{prefix}', max_workers=max_workers,
+                    schema=schema))
+            phases[f'load {table}'] = {'seconds': timer() - start,
+                                       'rows': rows}
+
+        start = timer()
+        ETLPipeline(connection).insert()
+        phases['insert'] = {'seconds': timer() - start,
+                            'rows': sum(metric['rows'] or 0 for metric in
+                                        metrics.report()['statements']
+                                        if metric['label'].startswith(
+                                            'insert'))}
+    finally:
+        connection.close()
+
+    return {'phases': phases, 'statements': metrics.report()['statements']}
+
+
+def compare(results, baseline):
+    """Prints the phase time changes against a baseline run.
+
+    Args:
+        results: The dict of events to bench_pipeline results.
+        baseline: The dict of a previous run.
+    """
+    for events, result in results.items():
+        previous = baseline.get(events)
+        if previous is None:
+            print(f'{events} events: no baseline')
+            continue
+
+        for phase, current in result['phases'].items():
+            before = previous['phases'].get(phase)
+            if not before or not before['seconds']:
+                continue
+            change = 100 * (current['seconds'] / before['seconds'] - 1)
+            print(f'{events} events {phase}: {round(before["seconds"], 2)} '
+                  f'-> {round(current["seconds"], 2)} seconds '
+                  f'({change:+.1f}%)')
+
+
+def main(objects, max_workers, log_rows, events=(), skew=1.0, output=None,
+         baseline=None, startup=False):
+    """The benchmark.py script entry point.
+
+    Args:
+        objects: A list with the number of objects of each run.
+        max_workers: The thread pool size of the concurrent runs.
+        log_rows: The number of synthetic events of the schema run.
+        events: A list with the number of events of each pipeline run.
+        skew: The Zipf exponent of the synthetic song popularity.
+        output: An optional json file path the pipeline results
+            are written to.
+        baseline: An optional json file path of a previous output
+            the pipeline results are compared to.
+        startup: If True the import time of the pipeline scripts
+            is measured first.
+    """
+    if startup:
+        print('-----------------------------------------------------')
+        print('Startup Benchmark')
+        print('-----------------------------------------------------')
+
+        for module in STARTUP_MODULES:
+            seconds, loaded = bench_startup(module)
+            print(f'import {module}: {round(seconds * 1000)} ms, '
+                  f"heavy modules: {', '.join(loaded) or 'none'}")
+
+    print('-----------------------------------------------------')
+    print('Schema Memory Benchmark')
+    print('-----------------------------------------------------')
+
+    inferred, typed = bench_schema_memory(log_rows)
+    print(f'{log_rows} events: '
+          f'inferred dtypes {round(inferred / 2**20, 1)} MiB, '
+          f'schema dtypes {round(typed / 2**20, 1)} MiB, '
+          f'saving {round(100 * (1 - typed / inferred))}%')
+
+    config = Config()
+    server = start_s3_stand_in(config)
+    loader = S3Loader(config)
+
+    print('-----------------------------------------------------')
+    print('S3Loader Benchmark')
+    print('-----------------------------------------------------')
+
+    try:
+        for count in objects:
+            bucket_path = seed_objects(loader, f'bench_{count}', count)
+
+            serial = bench_load_data(loader, bucket_path, count, None)
+            threaded = bench_load_data(loader, bucket_path, count,
+                                       max_workers)
+
+            print(f'{count} objects: serial {round(serial, 2)} seconds, '
+                  f'{max_workers} workers {round(threaded, 2)} seconds, '
+                  f'speedup {round(serial / threaded, 1)}x')
+
+        if events:
+            print('-----------------------------------------------------')
+            print('Pipeline Benchmark')
+            print('-----------------------------------------------------')
+
+            postgres_config(config)
+            results = {}
+            for count in events:
+                results[str(count)] = bench_pipeline(config, loader, count,
+                                                     skew, max_workers)
+                for phase, result in results[str(count)]['phases'].items():
+                    rate = result['rows'] / result['seconds'] \
+                        if result['seconds'] else 0
+                    print(f'{count} events {phase}: '
+                          f'{round(result["seconds"], 2)} seconds, '
+                          f'{round(rate)} rows/s')
+
+            if baseline and os.path.exists(baseline):
+                with open(baseline, encoding='utf-8') as file:
+                    compare(results, json.load(file))
+
+            if output:
+                with open(output, 'w', encoding='utf-8') as file:
+                    json.dump(results, file, indent=2)
+    finally:
+        if server is not None:
+            server.terminate()
+
+
+if __name__ == '__main__':
+    # create the command line parser
+    parser = argparse.ArgumentParser(
+        description='Sparkify Pipeline Benchmark')
+
+    # set the command line arguments
+    parser.add_argument('--objects',
+                        help='Number of objects of each run',
+                        type=int,
+                        nargs='*',
+                        default=[100, 1000, 10000])
+    parser.add_argument('--max-workers',
+                        help='Thread pool size - default: 16',
+                        type=int,
+                        default=16)
+    parser.add_argument('--log-rows',
+                        help='Synthetic events of the schema run',
+                        type=int,
+                        default=100000)
+    parser.add_argument('--events',
+                        help='Synthetic events of each pipeline run',
+                        type=int,
+                        nargs='*',
+                        default=[])
+    parser.add_argument('--skew',
+                        help='Zipf exponent of the song popularity '
+                             '- default: 1.0',
+                        type=float,
+                        default=1.0)
+    parser.add_argument('--output',
+                        help='Json file of the pipeline results',
+                        default=None)
+    parser.add_argument('--baseline',
+                        help='Json file of the baseline pipeline results',
+                        default=None)
+    parser.add_argument('--startup',
+                        help='Measure the import time of the pipeline scripts',
+                        action='store_true')
+
+    # parse the command line arguments
+    args = parser.parse_args()
+
+    # run the benchmark
+    main(args.objects, args.max_workers, args.log_rows, args.events,
+         args.skew, args.output, args.baseline, args.startup)
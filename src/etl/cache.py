@@ -0,0 +1,277 @@
+"""Defines the local disk cache classes used to avoid repeated downloads.
+
+The DiskCache class stores one file per entry under a cache directory,
+keeps the total size under a cap and evicts the least recently used
+entries first. The ObjectCache class keys the entries by the S3 bucket,
+object key and ETag, so a changed object is never served from the cache.
+"""
+
+# sys libs
+import io
+import os
+import mmap
+import hashlib
+import tempfile
+import threading
+import collections
+
+# default cache size cap: 1 GiB
+MAX_BYTES = 1024 ** 3
+
+
+class DiskCache:
+    """This class defines a size capped LRU cache of local files.
+
+    The entries recency survives restarts because reads update the
+    file modification time, which is used to rebuild the LRU order.
+
+    Usage example:
+
+    cache = DiskCache('/tmp/cache', max_bytes=512 * 1024 ** 2)
+    cache.put_bytes('name', b'data')
+    path = cache.get_path('name')
+    """
+
+    def __init__(self, directory, max_bytes=MAX_BYTES):
+        """Creates the DiskCache object and indexes the cached files.
+
+        Args:
+            directory: The local cache directory path.
+            max_bytes: The maximum total size of the cached files.
+        """
+        os.makedirs(directory, exist_ok=True)
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.size = 0
+
+        self.__scan()
+
+    def __scan(self):
+        """Indexes the cached files from the oldest to the newest."""
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith('.'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.size += size
+
+    def __evict(self):
+        """Removes the least recently used files until the cap is met.
+
+        Must be called with the lock held.
+        """
+        while self.size > self.max_bytes and self.entries:
+            name, size = self.entries.popitem(last=False)
+            self.size -= size
+            self.__remove(name)
+
+    def __remove(self, name):
+        """Deletes a cached file ignoring the already removed ones.
+
+        Args:
+            name: The cache entry name.
+        """
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def path(self, name):
+        """Returns the local file path of a cache entry.
+
+        Args:
+            name: The cache entry name.
+        """
+        return os.path.join(self.directory, name)
+
+    def get_path(self, name):
+        """Looks up a cache entry and marks it as recently used.
+
+        Args:
+            name: The cache entry name.
+
+        Returns:
+            The local file path or None on a cache miss.
+        """
+        with self.lock:
+            if name not in self.entries:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(name)
+
+        path = self.path(name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # removed behind the index, unless put again meanwhile
+            with self.lock:
+                self.misses += 1
+                if name in self.entries and not os.path.exists(path):
+                    self.size -= self.entries.pop(name)
+            return None
+
+        with self.lock:
+            self.hits += 1
+
+        return path
+
+    def put_bytes(self, name, data):
+        """Stores a cache entry and evicts the old entries if needed.
+
+        The file is written to a temporary file and then renamed,
+        so readers never see a partial entry. An entry larger than
+        max_bytes is not cached, and a previous entry of the same
+        name is removed.
+
+        Args:
+            name: The cache entry name.
+            data: The entry content as bytes.
+
+        Returns:
+            The local file path of the entry, or None if it was not
+            cached. Callers must keep their own copy of the data then.
+        """
+        if len(data) > self.max_bytes:
+            self.invalidate(lambda entry: entry == name)
+            return None
+
+        fd, temp = tempfile.mkstemp(dir=self.directory, prefix='.')
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(temp, self.path(name))
+
+        with self.lock:
+            self.size -= self.entries.pop(name, 0)
+            self.entries[name] = len(data)
+            self.size += len(data)
+            self.__evict()
+
+        return self.path(name)
+
+    def invalidate(self, predicate=None):
+        """Removes the cache entries matching a predicate.
+
+        Args:
+            predicate: A function (name) -> bool.
+              If None, all entries are removed.
+
+        Returns:
+            The number of removed entries.
+        """
+        with self.lock:
+            names = [name for name in self.entries
+                     if predicate is None or predicate(name)]
+
+            for name in names:
+                self.size -= self.entries.pop(name)
+                self.__remove(name)
+
+        return len(names)
+
+    def clear(self):
+        """Removes all cache entries and resets the counters."""
+        self.invalidate()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """Returns the cache statistics.
+
+        Returns:
+            A dict with the hits, misses, entries and bytes counters.
+        """
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self.entries), 'bytes': self.size}
+
+
+class ObjectCache(DiskCache):
+    """This class defines an S3 object cache keyed by bucket, key and ETag.
+
+    The S3Loader reads the cached objects through memory-mapped files.
+
+    Usage example:
+
+    cache = ObjectCache('/tmp/s3-cache')
+    loader = S3Loader(config, cache=cache)
+    """
+
+    @staticmethod
+    def __prefix(bucket, key):
+        """Returns the entry name prefix shared by all object versions.
+
+        Args:
+            bucket: The S3 bucket name.
+            key: The S3 object key.
+        """
+        return hashlib.sha256(f'{bucket}/{key}'.encode('utf-8')).hexdigest()
+
+    def name(self, bucket, key, etag):
+        """Returns the cache entry name of an object version.
+
+        Args:
+            bucket: The S3 bucket name.
+            key: The S3 object key.
+            etag: The S3 object ETag.
+        """
+        return f'{self.__prefix(bucket, key)}-{etag.strip(chr(34))}'
+
+    def open(self, bucket, key, etag):
+        """Opens a cached object as a read-only memory-mapped file.
+
+        Args:
+            bucket: The S3 bucket name.
+            key: The S3 object key.
+            etag: The S3 object ETag.
+
+        Returns:
+            A file-like object or None on a cache miss.
+        """
+        path = self.get_path(self.name(bucket, key, etag))
+        if path is None:
+            return None
+
+        try:
+            with open(path, 'rb') as file:
+                # empty files cannot be memory-mapped
+                if os.fstat(file.fileno()).st_size == 0:
+                    return io.BytesIO()
+
+                return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            # evicted by another thread after the lookup
+            return None
+
+    def put(self, bucket, key, etag, data):
+        """Stores an object version in the cache.
+
+        Args:
+            bucket: The S3 bucket name.
+            key: The S3 object key.
+            etag: The S3 object ETag.
+            data: The object content as bytes.
+        """
+        self.put_bytes(self.name(bucket, key, etag), data)
+
+    def invalidate_object(self, bucket, key):
+        """Removes all cached versions of an S3 object.
+
+        Args:
+            bucket: The S3 bucket name.
+            key: The S3 object key.
+
+        Returns:
+            The number of removed entries.
+        """
+        prefix = self.__prefix(bucket, key) + '-'
+        return self.invalidate(lambda name: name.startswith(prefix))
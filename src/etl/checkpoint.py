@@ -0,0 +1,193 @@
+"""Defines the Checkpoint class to resume a failed pipeline run.
+
+Each completed step is recorded in the etl_checkpoint table with its
+row count, in the same transaction as the step statement. A resumed
+run skips the recorded steps and redoes only the failed one, whose
+statement was rolled back, so a rerun never duplicates the rows of
+the COPYs and inserts that already succeeded.
+
+The transient connection drops are retried on a new connection with
+an exponential backoff. After a drop during the commit the step is
+looked up in etl_checkpoint before it is executed again.
+"""
+
+# sys libs
+import time
+import random
+import threading
+from timeit import default_timer as timer
+# metrics libs
+from metrics import statement_label
+# SQL libs
+from sql_queries import SELECT_ETL_CHECKPOINT, SELECT_ETL_CHECKPOINT_STEP
+from sql_queries import INSERT_ETL_CHECKPOINT, DELETE_ETL_CHECKPOINT
+
+# default retry policy of the transient connection errors
+RETRIES = 3
+DELAY = 1.0
+MAX_DELAY = 60.0
+
+
+class Checkpoint:
+    """This class defines the step checkpoints of a pipeline run.
+
+    The recorded steps are kept until the next run that does not
+    resume, which clears them.
+
+    Usage example:
+
+    checkpoint = Checkpoint(connection, resume=True)
+    checkpoint.start()
+    for step in steps:
+        if not checkpoint.done(step.name):
+            checkpoint.execute(connection, step)
+    """
+
+    def __init__(self, connection, resume=False, retries=RETRIES,
+                 delay=DELAY, max_delay=MAX_DELAY):
+        """Creates the Checkpoint object.
+
+        Args:
+            connection: The connection adapter wrapper used to read
+                and clear the checkpoints.
+            resume: If True the steps of the previous run are kept,
+                otherwise they are cleared by start.
+            retries: The number of retries of a step after a
+                transient connection error.
+            delay: The seconds before the first retry, doubled
+                after each retry.
+            max_delay: The maximum seconds between two retries.
+        """
+        self.connection = connection
+        self.resume = resume
+        self.retries = retries
+        self.delay = delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.completed = {}
+
+    def start(self):
+        """Reads or clears the steps recorded by the previous run.
+
+        Returns:
+            A dict of completed step name to its row count.
+        """
+        if self.resume:
+            rows = self.retry(self.connection, 'checkpoint',
+                              lambda: self.connection.query(
+                                  SELECT_ETL_CHECKPOINT))
+        else:
+            rows = []
+            self.retry(self.connection, 'checkpoint',
+                       lambda: self.connection.execute(DELETE_ETL_CHECKPOINT,
+                                                       commit=True))
+
+        with self.lock:
+            self.completed = dict(rows)
+            return dict(self.completed)
+
+    def done(self, name):
+        """True if the step was recorded as completed."""
+        with self.lock:
+            return name in self.completed
+
+    def retry(self, connection, label, function):
+        """Calls a function, retrying it on transient connection errors.
+
+        The connection is reopened before each retry and the delay
+        between retries doubles up to max_delay, with random jitter
+        so concurrent steps do not reconnect at the same time. The
+        statements of each attempt are recorded in the connection
+        metrics with the attempt retry number.
+
+        Args:
+            connection: The connection adapter wrapper used by function.
+            label: The statement label printed on a retry.
+            function: The callable without arguments.
+
+        Returns:
+            The function return value.
+
+        Raises:
+            The last transient error once the retries are exhausted,
+            or any other error at once.
+        """
+        failures = 0
+        try:
+            while True:
+                try:
+                    if failures:
+                        connection.reconnect()
+                    # the statements of the attempt record its number
+                    connection.retries = failures
+                    return function()
+                except connection.transient_errors as error:
+                    if failures == self.retries:
+                        raise
+
+                    delay = min(self.max_delay, self.delay * 2 ** failures)
+                    failures += 1
+                    print(f'INFO: {label} failed on a dropped connection '
+                          f'({str(error).strip()}), retry {failures} '
+                          f'of {self.retries}...')
+                    time.sleep(random.uniform(delay / 2, delay))
+        finally:
+            connection.retries = 0
+
+    def record(self, connection, name, function, label=None):
+        """Runs a step function and records it in the same transaction.
+
+        Args:
+            connection: The connection adapter wrapper.
+            name: The step name.
+            function: A callable without arguments that runs the step
+                statements without committing them and returns the
+                row count or None.
+            label: The statement label printed on a retry.
+                Defaults to the step name.
+
+        Returns:
+            The step row count.
+        """
+        attempts = []
+
+        def attempt():
+            # the commit of a dropped connection may have succeeded
+            if attempts:
+                rows = connection.query(SELECT_ETL_CHECKPOINT_STEP, (name,))
+                if rows:
+                    return rows[0][0]
+            attempts.append(name)
+
+            start = timer()
+            with connection.transaction():
+                count = function()
+                connection.execute(INSERT_ETL_CHECKPOINT,
+                                   params=(name, count, timer() - start))
+            return count
+
+        count = self.retry(connection, label or name, attempt)
+        with self.lock:
+            self.completed[name] = count
+
+        return count
+
+    def execute(self, connection, step):
+        """Executes a step query and records it in the same transaction.
+
+        It has the DagScheduler runner signature.
+
+        Args:
+            connection: The connection adapter wrapper.
+            step: The Step object.
+
+        Returns:
+            The number of rows written by the statement or None.
+        """
+        def run():
+            connection.execute(step.query)
+            count = connection.cursor.rowcount
+            return count if count is not None and count >= 0 else None
+
+        return self.record(connection, step.name, run,
+                           statement_label(step.query))
@@ -0,0 +1,344 @@
+"""Defines the FileCompactor class to coalesce small json files before COPY.
+
+The song_data prefix holds tens of thousands of single record json
+files, and a COPY spends most of each slice time on the per file
+overhead instead of scanning bytes. The compactor streams the small
+objects through the S3Loader, concatenates them into gzip compressed
+json lines files and writes the COPY manifest of the compacted set.
+The file count is a multiple of the cluster slice count, so every
+slice loads the same share.
+
+Set the manifest path as the [S3] SONG_DATA_MANIFEST option and the
+COPY_STAGING_SONGS statement loads the compacted files instead.
+"""
+
+# sys libs
+import gzip
+import math
+import argparse
+import tempfile
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer as timer
+# config libs
+from config import Config
+# AWS libs
+from s3 import S3Loader
+from index import IndexEntry, list_entries
+from manifest import build_manifest, write_manifest
+# SQL libs
+from connection import Connection
+from sql_queries import SELECT_SLICE_COUNT
+
+# uncompressed bytes of each compacted file
+TARGET_BYTES = 64 * 2**20
+
+
+def file_count(total_bytes, slices, target_bytes=TARGET_BYTES):
+    """Computes the number of compacted files.
+
+    Args:
+        total_bytes: The size of the small files.
+        slices: The number of cluster slices.
+        target_bytes: The uncompressed size of each compacted file.
+
+    Returns:
+        The smallest multiple of slices whose files are not
+        larger than target_bytes.
+    """
+    return max(1, math.ceil(total_bytes / target_bytes / slices)) * slices
+
+
+def split_entries(entries, count):
+    """Splits the files into groups of balanced byte size.
+
+    The groups are contiguous in the entries order, so each compacted
+    file keeps neighbouring keys together. Each file goes to the group
+    of its byte offset, moved to the next group when the previous one
+    would stay empty or too few files would be left for the others.
+
+    Args:
+        entries: A list of IndexEntry objects.
+        count: The number of groups.
+
+    Returns:
+        A list of exactly min(count, len(entries)) non empty lists
+        of IndexEntry objects.
+    """
+    count = min(count, len(entries))
+    total = sum(entry.size for entry in entries) or 1
+    groups = [[] for _ in range(count)]
+
+    done = 0
+    group = 0
+    for index, entry in enumerate(entries):
+        target = min(count - 1, done * count // total)
+        # the first file opens group 0, a group is never skipped and
+        # each later group keeps at least one of the remaining files
+        lowest = max(group, count - len(entries) + index)
+        group = min(max(target, lowest), group + 1 if index else 0)
+        groups[group].append(entry)
+        done += entry.size
+
+    return groups
+
+
+class FileCompactor:
+    """This class defines the small file compaction stage.
+
+    Only the slice count is read from the database, a compaction of
+    a given slice count needs no connection.
+
+    Code usage example:
+
+    config = Config()
+    compactor = FileCompactor(S3Loader(config), Connection())
+    manifest = compactor.compact(config.get('S3', 'SONG_DATA'),
+                                 's3://bucket/compacted/song_data')
+
+    Usage example as python script with redshift connection:
+
+    python -m compaction --redshift
+    """
+
+    def __init__(self, loader, connection=None, target_bytes=TARGET_BYTES,
+                 max_workers=32, level=6):
+        """Creates the FileCompactor object.
+
+        Args:
+            loader: The S3Loader object used to read the small files
+                and write the compacted files.
+            connection: An optional connection adapter wrapper used to
+                read the cluster slice count.
+            target_bytes: The uncompressed size of each compacted file.
+            max_workers: The number of threads fetching the small files.
+            level: The gzip compression level.
+        """
+        self.loader = loader
+        self.connection = connection
+        self.target_bytes = target_bytes
+        self.max_workers = max_workers
+        self.level = level
+
+    def slices(self):
+        """Reads the number of cluster slices.
+
+        Returns:
+            The stv_slices row count, 1 without a Redshift connection.
+        """
+        if self.connection is None or not self.connection.is_redshift:
+            return 1
+        return self.connection.query(SELECT_SLICE_COUNT)[0][0]
+
+    def plan(self, entries, slices=None):
+        """Groups the small files into the compacted files.
+
+        Args:
+            entries: A list of IndexEntry objects.
+            slices: The number of cluster slices. If None, it is
+                read from the database.
+
+        Returns:
+            A list of lists of IndexEntry objects, one per compacted file.
+            Their count is a multiple of slices, unless there are fewer
+            small files than slices, then each file is kept alone.
+        """
+        slices = slices or self.slices()
+        count = file_count(sum(entry.size for entry in entries), slices,
+                           self.target_bytes)
+
+        # a compacted file holds at least one small file
+        if count > len(entries):
+            count = len(entries) // slices * slices
+            if not count:
+                count = len(entries)
+                print(f'INFO: {count} files are fewer than the {slices} '
+                      'slices, some slices load no compacted file.')
+
+        return split_entries(entries, count)
+
+    def __upload(self, file, bucket, key):
+        """Uploads a compacted file and closes it.
+
+        Args:
+            file: The temporary file object.
+            bucket: The destination bucket name.
+            key: The destination object key.
+
+        Returns:
+            The IndexEntry object of the uploaded file.
+        """
+        with file:
+            size = file.tell()
+            file.seek(0)
+            self.loader.client.upload_fileobj(file, bucket, key)
+        return IndexEntry(key, size, '', 0)
+
+    def compact(self, source, destination, slices=None):
+        """Compacts the json files of an S3 prefix.
+
+        Args:
+            source: The S3 prefix path. E.g. s3://udacity-dend/song_data
+            destination: The S3 folder of the compacted files.
+            slices: The number of cluster slices. If None, it is
+                read from the database.
+
+        Returns:
+            A (manifest, files) tuple, the manifest S3 path and the
+            IndexEntry objects of the compacted files.
+
+        Raises:
+            ValueError: If the source prefix holds no json files,
+                since a COPY from an empty manifest fails.
+        """
+        path = source.split('/')
+        bucket, prefix = path[2], '/'.join(path[3:])
+        entries = [entry for entry in
+                   list_entries(self.loader.client, bucket, prefix)
+                   if entry.key.endswith('.json')]
+        if not entries:
+            raise ValueError(f'no json files found under {source}')
+
+        groups = self.plan(entries, slices)
+
+        path = destination.rstrip('/').split('/')
+        target, folder = path[2], '/'.join(path[3:])
+
+        bodies = self.loader.iter_objects(
+            bucket, (entry.key for group in groups for entry in group),
+            self.max_workers)
+
+        # the upload of a file overlaps the compression of the next one
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = []
+            for index, group in enumerate(groups):
+                file = tempfile.TemporaryFile()
+                with gzip.GzipFile(fileobj=file, mode='wb',
+                                   compresslevel=self.level, mtime=0) as gz:
+                    for _ in group:
+                        body = next(bodies)[1].strip()
+                        if body:
+                            gz.write(body)
+                            gz.write(b'\n')
+
+                futures.append(executor.submit(
+                    self.__upload, file, target,
+                    f'{folder}/part-{index:05d}.json.gz'))
+
+            files = [future.result() for future in futures]
+
+        manifest = write_manifest(build_manifest(target, files),
+                                  f'{destination.rstrip("/")}/manifest.json',
+                                  self.loader)
+
+        return manifest, files
+
+    def run(self, source, destination, slices=None):
+        """Compacts the small files and print statistics.
+
+        Args:
+            source: The S3 prefix path.
+            destination: The S3 folder of the compacted files.
+            slices: The number of cluster slices.
+
+        Returns:
+            The manifest S3 path.
+        """
+        # HEADER: print the pipeline header
+        print('-----------------------------------------------------')
+        print('AWS Redshift Small File Compaction')
+        print('-----------------------------------------------------')
+
+        print(f'INFO: Compacting {source}...')
+        start = timer()
+        manifest, files = self.compact(source, destination, slices)
+        compact_time = timer() - start
+        print(f'INFO: Manifest written to {manifest}')
+
+        # STATS: print the time statistics
+        print('-----------------------------------------------------')
+        print('Compaction Statistics')
+        print('-----------------------------------------------------')
+        print(f'Compacted files: {len(files)}')
+        print(f'Compressed bytes: {sum(file.size for file in files)}')
+        print(f'Compaction time: {round(compact_time, 2)} seconds')
+
+        return manifest
+
+
+def main(redshift, source=None, destination=None, slices=None,
+         target_mb=TARGET_BYTES // 2**20, max_workers=32):
+    """The compaction.py script entry point.
+
+    Args:
+        redshift: If True uses the Redshift connector API,
+            otherwise use the default Psycopg2 adapter.
+        source: The S3 prefix path. Defaults to the song data.
+        destination: The S3 folder of the compacted files.
+            Defaults to a new folder under the STAGING S3 path.
+        slices: The number of cluster slices. If None, it is read
+            from the database.
+        target_mb: The uncompressed size of each compacted file in MiB.
+        max_workers: The number of threads fetching the small files.
+    """
+    config = Config()
+    if destination is None:
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        destination = f"{config.get('S3', 'STAGING')}/compacted/" \
+                      f"song_data-{stamp}"
+
+    # the connection is only needed to read the slice count
+    connection = None
+    if slices is None:
+        connection = Connection(redshift=redshift, config=config)
+
+    # run the compaction
+    compactor = FileCompactor(S3Loader(config), connection,
+                              target_bytes=target_mb * 2**20,
+                              max_workers=max_workers)
+    manifest = compactor.run(source or config.get('S3', 'SONG_DATA'),
+                             destination, slices)
+    if connection is not None:
+        connection.close()
+
+    print(f'INFO: Set [S3] SONG_DATA_MANIFEST={manifest} to COPY '
+          'the compacted files.')
+
+
+if __name__ == '__main__':
+    # create the command line parser
+    parser = argparse.ArgumentParser(
+        description='AWS Redshift Small File Compaction')
+
+    # set the command line arguments
+    parser.add_argument('--redshift',
+                        help='Set the redshift connector - default: pyscopg2',
+                        type=bool,
+                        default=False)
+    parser.add_argument('--source',
+                        help='S3 prefix of the small files '
+                             '- default: SONG_DATA',
+                        default=None)
+    parser.add_argument('--destination',
+                        help='S3 folder of the compacted files '
+                             '- default: STAGING/compacted',
+                        default=None)
+    parser.add_argument('--slices',
+                        help='Cluster slice count - default: stv_slices',
+                        type=int,
+                        default=None)
+    parser.add_argument('--target-mb',
+                        help='Uncompressed MiB per file - default: 64',
+                        type=int,
+                        default=TARGET_BYTES // 2**20)
+    parser.add_argument('--max-workers',
+                        help='Fetching threads - default: 32',
+                        type=int,
+                        default=32)
+
+    # parse the command line arguments
+    args = parser.parse_args()
+
+    # run the compaction
+    main(args.redshift, args.source, args.destination, args.slices,
+         args.target_mb, args.max_workers)
@@ -1,6 +1,8 @@
 """Defines a Config class to read the AWS configuration from dwh.cfg file.
 
 Check the dwh.cfg.template file configuration sections and options.
+Any option can be overridden by a DWH_<SECTION>_<OPTION> environment
+variable. E.g. DWH_REDSHIFT_PASSWORD
 """
 # sys libs
 import os
@@ -11,28 +13,57 @@ import configparser
 DIR = os.path.dirname(os.path.abspath(__file__)) 
 INI_PATH = os.path.join(DIR, 'dwh.cfg')
 
+# environment variable prefix of the option overrides
+ENV_PREFIX = 'DWH_'
+
 class Config:
     """This class defines a wrapper for ConfigParser.
 
     Use the dwh.cfg.template file as a reference to configure
     the application according to your AWS account settings.
 
+    The dwh.cfg file is parsed once per process, every Config()
+    call returns the same object. Values changed with set are seen
+    by all its users.
+
     Usage example:
 
     config = Config()
     config.get('REDSHIFT', 'USER')
     """
 
+    # the shared Config object
+    __instance = None
+
+    def __new__(cls):
+        """Returns the shared Config object."""
+        if cls.__instance is None:
+            cls.__instance = super().__new__(cls)
+        return cls.__instance
+
     def __init__(self):
         """Creates a Config object from dwh.cfg file.
 
-        Config values will be UTF-8 encoded.
+        Config values will be UTF-8 encoded. The file is only
+        parsed by the first call, then the environment variable
+        overrides are applied.
         """
+        if hasattr(self, 'parser'):
+            return
+
+        parser = configparser.ConfigParser()
+        with open(INI_PATH, encoding='utf-8') as file:
+            parser.read_file(file)
+        self.parser = parser
 
-        self.parser = configparser.ConfigParser()
-        self.parser.read_file(open(INI_PATH, encoding='utf-8'))
+        for name, value in os.environ.items():
+            if not name.startswith(ENV_PREFIX):
+                continue
+            section, _, option = name[len(ENV_PREFIX):].partition('_')
+            if option:
+                self.set(section, option, value)
 
-    def get(self, section, option):
+    def get(self, section, option, **kwargs):
         """Reads a config option value from a section.
 
         Retrieves an option value pertaining to the given section
@@ -43,6 +74,8 @@ class Config:
               E.g. REDSHIFT
             option: The section config option name.
               E.g. PORT
+            fallback: Optional keyword argument with the value returned
+              when the option is missing from the dwh.cfg file.
 
         Returns:
             A value to the given section and option.
@@ -50,4 +83,21 @@ class Config:
 
             value = config.get('REDSHIFT', 'PORT')
         """
-        return self.parser.get(section, option)
+        return self.parser.get(section, option, **kwargs)
+
+    def set(self, section, option, value):
+        """Overrides a config option value in memory.
+
+        The dwh.cfg file is not changed. This is useful to point
+        the clients to local stand-ins, such as an S3 emulator.
+
+        Args:
+            secion: The dwh.cfg file section name.
+              E.g. S3
+            option: The section config option name.
+              E.g. ENDPOINT
+            value: The new option value.
+        """
+        if not self.parser.has_section(section):
+            self.parser.add_section(section)
+        self.parser.set(section, option, value)
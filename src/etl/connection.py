@@ -6,11 +6,74 @@ driver was crashing unexpectedly most of the time.
 The Psycopg2 adapter was kept as default to satisfy the projetc requirements.
 """
 
+# sys libs
+import os
+import uuid
+import contextlib
+from datetime import datetime, timezone
+from timeit import default_timer as timer
 # config libs
 from config import Config
-# connector libs
-import psycopg2
-import redshift_connector
+# AWS libs
+from index import list_entries
+# metrics libs
+from metrics import statement_label
+# SQL libs
+from sql_queries import SELECT_COPY_METRICS, SELECT_QUERY_METRICS
+from sql_queries import SELECT_VERSION, render_copy_queries
+from sql_queries import CREATE_TABLE_ETL_GENERATION, INSERT_ETL_GENERATION
+
+# default number of rows of each streamed batch
+STREAM_BATCH_ROWS = 10000
+# pyarrow type factory of each column type oid of the cursor description
+ARROW_TYPES = {16: 'bool_', 20: 'int64', 21: 'int16', 23: 'int32',
+               700: 'float32', 701: 'float64', 19: 'string', 25: 'string',
+               1042: 'string', 1043: 'string', 1082: 'date32'}
+# type oids of the timestamp, timestamptz and numeric columns
+TIMESTAMP_OID = 1114
+TIMESTAMPTZ_OID = 1184
+NUMERIC_OID = 1700
+
+
+def arrow_schema(description, batch):
+    """Builds the pyarrow schema shared by every streamed batch.
+
+    The column types come from the cursor description type oids, so a
+    column with only NULL values in a batch keeps its type. The other
+    types are inferred from the values of the first batch, a column
+    without any value is read as string.
+
+    Args:
+        description: The DB-API cursor description.
+        batch: The first fetched list of rows.
+
+    Returns:
+        A pyarrow Schema object.
+    """
+    # pylint: disable=import-outside-toplevel
+    import pyarrow as pa
+
+    fields = []
+    for index, column in enumerate(description):
+        name, oid = column[0], column[1]
+        if oid in ARROW_TYPES:
+            arrow_type = getattr(pa, ARROW_TYPES[oid])()
+        elif oid == TIMESTAMP_OID:
+            arrow_type = pa.timestamp('us')
+        elif oid == TIMESTAMPTZ_OID:
+            arrow_type = pa.timestamp('us', tz='UTC')
+        elif oid == NUMERIC_OID:
+            # the Redshift connector does not describe the precision
+            precision, scale = column[4], column[5]
+            arrow_type = pa.decimal128(precision, scale or 0) \
+                if precision else pa.decimal128(38, 18)
+        else:
+            arrow_type = pa.array([row[index] for row in batch]).type
+            if pa.types.is_null(arrow_type):
+                arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type))
+
+    return pa.schema(fields)
 
 
 class Connection:
@@ -25,15 +88,36 @@ class Connection:
     connection = Config(redshift=True)
     """
 
-    def __init__(self, redshift=False):
+    def __init__(self, redshift=False, config=None, metrics=None):
         """Creates a Connection object according to the client selection.
 
         Args:
             redshift: If True uses the Redshift connector API,
                 otherwise use the default Psycopg2 adapter.
+            config: An optional Config object. If None, the dwh.cfg
+                file is read.
+            metrics: An optional MetricsRecorder object that records
+                every executed statement.
         """
-        config = Config()
-        if redshift:
+        self.config = config or Config()
+        self.redshift = redshift
+        self.metrics = metrics
+        # the retry number of the running attempt, set by Checkpoint
+        self.retries = 0
+        self.__server = None
+        self.__connect()
+
+    def __connect(self):
+        """Opens the adapter connection and its cursor.
+
+        Also sets transient_errors, the driver exceptions raised
+        when the connection drops.
+        """
+        config = self.config
+        # the connectors are only imported by the selected code path
+        if self.redshift:
+            import redshift_connector  # pylint: disable=import-outside-toplevel
+            driver = redshift_connector
             self.connection = redshift_connector.connect(
                 region=config.get('AWS', 'REGION'),
                 host=config.get('REDSHIFT', 'ENDPOINT'),
@@ -42,6 +126,8 @@ class Connection:
                 user=config.get('REDSHIFT', 'USER'),
                 password=config.get('REDSHIFT', 'PASSWORD'))
         else:
+            import psycopg2  # pylint: disable=import-outside-toplevel
+            driver = psycopg2
             self.connection = psycopg2.connect(
                 host=config.get('REDSHIFT', 'ENDPOINT'),
                 port=config.get('REDSHIFT', 'PORT'),
@@ -49,8 +135,21 @@ class Connection:
                 user=config.get('REDSHIFT', 'USER'),
                 password=config.get('REDSHIFT', 'PASSWORD'))
 
+        self.transient_errors = (driver.OperationalError,
+                                 driver.InterfaceError)
         self.cursor = self.connection.cursor()
 
+    def reconnect(self):
+        """Replaces a dropped adapter connection with a new one.
+
+        The pending transaction of the dropped connection is lost.
+        """
+        try:
+            self.connection.close()
+        except Exception:  # pylint: disable=broad-except
+            pass
+        self.__connect()
+
     def close(self):
         """Closes the adapter connection immediately."""
         self.connection.close()
@@ -59,7 +158,39 @@ class Connection:
         """Commit any pending transaction to the database."""
         self.connection.commit()
 
-    def execute(self, query, commit=False):
+    def rollback(self):
+        """Roll back any pending transaction."""
+        self.connection.rollback()
+
+    def cancel(self):
+        """Cancels the statement running on this connection.
+
+        It is safe to call from another thread. The Redshift connector
+        does not support client side cancellation, so it is a no-op there.
+        """
+        if hasattr(self.connection, 'cancel'):
+            self.connection.cancel()
+
+    def ping(self):
+        """Checks if the database connection is still usable.
+
+        Any pending transaction is rolled back.
+
+        Returns:
+            True if a trivial query succeeds, otherwise False.
+        """
+        try:
+            cursor = self.connection.cursor()
+            cursor.execute('SELECT 1;')
+            cursor.fetchall()
+            cursor.close()
+            self.rollback()
+        except Exception:  # pylint: disable=broad-except
+            return False
+
+        return True
+
+    def execute(self, query, commit=False, params=None):
         """Execute a database operation (query or command).
 
         Args:
@@ -67,6 +198,8 @@ class Connection:
                 otherwise use the default Psycopg2 adapter.
             commit: If True Commit the transaction to the database
                 otherwise leave it pending.
+            params: Optional sequence of values bound to the
+                %s query placeholders.
                 
         Returns:
             The method returns None.
@@ -74,8 +207,344 @@ class Connection:
             If a query was executed, the returned values can be retrieved
             using the corresponding cursor fetch*() methods.
         """
-        result = self.cursor.execute(query)
-        if commit:
-            self.commit()
+        start = timer()
+        error = None
+        try:
+            if params is None:
+                result = self.cursor.execute(query)
+            else:
+                result = self.cursor.execute(query, params)
+
+            if commit:
+                self.commit()
+        except Exception as exception:
+            error = type(exception).__name__
+            raise
+        finally:
+            # every attempt is recorded, the failed ones too
+            if self.metrics is not None:
+                self.__record(query, timer() - start, commit, error)
 
         return result
+
+    @property
+    def is_redshift(self):
+        """True if the server is Redshift, False for PostgreSQL.
+
+        The Psycopg2 adapter can connect to both servers,
+        so the server version is checked once.
+        """
+        if self.redshift:
+            return True
+
+        if self.__server is None:
+            cursor = self.connection.cursor()
+            cursor.execute(SELECT_VERSION)
+            self.__server = cursor.fetchone()[0]
+            cursor.close()
+            self.rollback()
+
+        return 'Redshift' in self.__server
+
+    def __record(self, query, seconds, committed, error=None):
+        """Records the metrics of an executed statement attempt.
+
+        The loaded and scanned bytes are read from the Redshift system
+        tables only after committed statements, so a failing metrics
+        query never aborts a pending transaction.
+
+        Args:
+            query: The executed statement.
+            seconds: The statement wall time, commit included.
+            committed: True if the statement was to be committed.
+            error: The exception class name if the attempt failed.
+        """
+        label = statement_label(query)
+        rows = None
+        if error is None and self.cursor.rowcount >= 0:
+            rows = self.cursor.rowcount
+        bytes_ = None
+
+        verb = label.split()[0]
+        if committed and error is None and \
+                verb in ('copy', 'insert', 'delete', 'create'):
+            try:
+                if self.is_redshift:
+                    cursor = self.connection.cursor()
+                    if verb == 'copy':
+                        cursor.execute(SELECT_COPY_METRICS)
+                        rows, bytes_ = cursor.fetchone()
+                    else:
+                        cursor.execute(SELECT_QUERY_METRICS)
+                        bytes_ = cursor.fetchone()[0]
+                    cursor.close()
+                    self.rollback()
+            except Exception:  # pylint: disable=broad-except
+                self.rollback()
+
+        self.metrics.record(label, seconds, rows,
+                            None if bytes_ is None else int(bytes_),
+                            self.retries, error)
+
+    def execute_batch(self, queries, commit=True):
+        """Executes a list of statements as one atomic batch.
+
+        The Psycopg2 adapter sends all statements in one round-trip.
+        The Redshift connector executes them one by one in the same
+        transaction. Either way there is a single commit, and any
+        failure rolls the whole batch back.
+
+        Args:
+            queries: A list of SQL statements ending with a semicolon.
+            commit: If True commits the batch, otherwise leaves the
+                transaction pending.
+        """
+        try:
+            if self.redshift:
+                for query in queries:
+                    self.execute(query)
+            else:
+                self.execute('\n'.join(queries))
+
+            if commit:
+                self.commit()
+        except Exception:
+            self.rollback()
+            raise
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Groups the statements of a with block into one transaction.
+
+        Commits when the block ends, rolls back if it raises.
+
+        Usage example:
+
+        with connection.transaction():
+            connection.execute(DROP_TABLE_USERS)
+            connection.execute(CREATE_TABLE_USERS)
+
+        Yields:
+            This Connection object.
+        """
+        try:
+            yield self
+            self.commit()
+        except Exception:
+            self.rollback()
+            raise
+
+    @contextlib.contextmanager
+    def autocommit(self):
+        """Runs the statements of a with block outside a transaction.
+
+        The pending transaction is committed first. VACUUM cannot run
+        inside a transaction block.
+
+        Usage example:
+
+        with connection.autocommit():
+            connection.execute(VACUUM_TABLE.format(table='songplays'))
+
+        Yields:
+            This Connection object.
+        """
+        self.commit()
+        self.connection.autocommit = True
+        try:
+            yield self
+        finally:
+            self.connection.autocommit = False
+
+    @contextlib.contextmanager
+    def savepoint(self, name):
+        """Marks a savepoint that a failing with block rolls back to.
+
+        The enclosing transaction stays usable after the failure.
+        Redshift does not support savepoints, use it on PostgreSQL.
+
+        Usage example:
+
+        with connection.transaction():
+            connection.execute(INSERT_TABLE_USERS)
+            with connection.savepoint('songs'):
+                connection.execute(INSERT_TABLE_SONGS)
+
+        Args:
+            name: The savepoint identifier.
+
+        Yields:
+            This Connection object.
+        """
+        self.execute(f'SAVEPOINT {name};')
+        try:
+            yield self
+            self.execute(f'RELEASE SAVEPOINT {name};')
+        except Exception:
+            self.execute(f'ROLLBACK TO SAVEPOINT {name};')
+            raise
+
+    def query(self, query, params=None):
+        """Executes a query and fetches all result rows.
+
+        Args:
+            query: The SELECT statement.
+            params: Optional sequence of values bound to the
+                %s query placeholders.
+
+        Returns:
+            A list of row tuples.
+        """
+        self.execute(query, params=params)
+        return [tuple(row) for row in self.cursor.fetchall()]
+
+    def bump_generation(self, commit=True):
+        """Bumps the load generation after the DW tables changed.
+
+        The cached query results of the older generations are stale.
+        The etl_generation table is created if it does not exist yet,
+        e.g. on a schema created before it was declared.
+
+        Args:
+            commit: If True commits the bump, otherwise leaves it in
+                the pending transaction of the load.
+        """
+        self.execute(CREATE_TABLE_ETL_GENERATION)
+        self.execute(INSERT_ETL_GENERATION, commit=commit)
+
+    def stream(self, query, batch_size=STREAM_BATCH_ROWS,
+               format='rows', params=None):  # pylint: disable=redefined-builtin
+        """Executes a query and streams the result in batches.
+
+        The Psycopg2 adapter reads the rows through a named server side
+        cursor, the Redshift connector through a DECLARE cursor fetched
+        with FETCH FORWARD, since its execute method buffers the whole
+        result, so only one batch is held in the client memory. The
+        cursor lives in the current transaction, which is left open.
+
+        The arrow batches share the schema built from the cursor
+        description, see arrow_schema.
+
+        Usage example:
+
+        for frame in connection.stream('SELECT * FROM songplays;',
+                                       batch_size=50000, format='pandas'):
+            print(len(frame))
+
+        Args:
+            query: The SELECT statement.
+            batch_size: The number of rows of each batch.
+            format: The batch type. rows for a list of row tuples,
+                pandas for a DataFrame or arrow for a pyarrow RecordBatch.
+            params: Optional sequence of values bound to the
+                %s query placeholders.
+
+        Yields:
+            A batch of at most batch_size rows.
+        """
+        if format not in ('rows', 'pandas', 'arrow'):
+            raise ValueError(f'unknown stream format: {format}')
+
+        # the data libraries are only imported by the selected format
+        # pylint: disable=import-outside-toplevel
+        if format == 'pandas':
+            import pandas as pd
+        elif format == 'arrow':
+            import pyarrow as pa
+
+        name = f'stream_{uuid.uuid4().hex}'
+        if self.redshift:
+            cursor = self.connection.cursor()
+            select = query.strip().rstrip(';')
+            statement = f'DECLARE {name} CURSOR FOR {select};'
+            fetch = f'FETCH FORWARD {int(batch_size)} FROM {name};'
+        else:
+            cursor = self.connection.cursor(name=name)
+            cursor.itersize = batch_size
+            statement, fetch = query, None
+
+        start = timer()
+        rows = 0
+        schema = None
+        error = None
+        try:
+            if params is None:
+                cursor.execute(statement)
+            else:
+                cursor.execute(statement, params)
+
+            while True:
+                if self.redshift:
+                    cursor.execute(fetch)
+                    batch = cursor.fetchall()
+                else:
+                    batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    break
+                rows += len(batch)
+
+                # the named cursor describes the columns after a fetch
+                names = [column[0] for column in cursor.description]
+                if format == 'pandas':
+                    yield pd.DataFrame.from_records(batch, columns=names)
+                elif format == 'arrow':
+                    if schema is None:
+                        schema = arrow_schema(cursor.description, batch)
+                    yield pa.RecordBatch.from_pydict(
+                        dict(zip(names, map(list, zip(*batch)))),
+                        schema=schema)
+                else:
+                    yield [tuple(row) for row in batch]
+        except Exception as exception:
+            error = type(exception).__name__
+            raise
+        finally:
+            try:
+                if self.redshift:
+                    cursor.execute(f'CLOSE {name};')
+                cursor.close()
+            except Exception:  # pylint: disable=broad-except
+                pass
+
+            # also recorded when the consumer stops early
+            if self.metrics is not None:
+                self.metrics.record(statement_label(query), timer() - start,
+                                    rows, retries=self.retries, error=error)
+
+    def unload(self, query, directory, loader):
+        """Exports a large query result to local parquet files.
+
+        Redshift writes the result in parallel from every slice with
+        UNLOAD to the STAGING S3 path, then the files are downloaded,
+        so the rows never go through the leader node and this client.
+        Use stream on PostgreSQL, which has no UNLOAD.
+
+        Args:
+            query: The SELECT statement.
+            directory: The local folder of the parquet files.
+            loader: The S3Loader object used to download the files.
+
+        Returns:
+            The list of local parquet file paths.
+        """
+        if not self.is_redshift:
+            raise RuntimeError('UNLOAD needs a Redshift server, '
+                               'use stream instead')
+
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        path = f"{self.config.get('S3', 'STAGING')}/unload/{stamp}/part_"
+        self.execute(render_copy_queries(self.config)['UNLOAD_QUERY'].format(
+            query=query.strip().rstrip(';').replace("'", "''"), path=path),
+            commit=True)
+
+        parts = path.split('/')
+        bucket, prefix = parts[2], '/'.join(parts[3:])
+        os.makedirs(directory, exist_ok=True)
+
+        paths = []
+        for entry in list_entries(loader.client, bucket, prefix):
+            local = os.path.join(directory, os.path.basename(entry.key))
+            loader.client.download_file(bucket, entry.key, local)
+            paths.append(local)
+
+        return paths
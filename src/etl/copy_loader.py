@@ -0,0 +1,287 @@
+"""Defines the CopyLoader class to load the staging tables from the client.
+
+The Redshift COPY statements read the json files straight from S3,
+which a PostgreSQL server cannot do. The CopyLoader streams the json
+files through the S3Loader, or from a local folder, and sends them to
+COPY ... FROM STDIN as a CSV stream encoded one DataFrame chunk at a
+time, so the memory stays bounded by the chunk size and no per row
+INSERT statement is built.
+"""
+
+# sys libs
+import io
+import os
+import glob
+from timeit import default_timer as timer
+# data libs
+import pandas as pd
+from decode import loads_lines
+from schema import STAGING_EVENTS_SCHEMA, STAGING_SONGS_SCHEMA
+
+# optional faster CSV writer
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+# default number of rows of each encoded chunk
+CHUNK_ROWS = 50000
+
+# pandas CSV null marker, its unquoted empty values are empty strings
+NULL = r'\N'
+
+# staging table to its (source folder, Schema object)
+STAGING_SOURCES = {'staging_events': ('log_data', STAGING_EVENTS_SCHEMA),
+                   'staging_songs': ('song_data', STAGING_SONGS_SCHEMA)}
+
+
+def iter_file_frames(paths, chunk_rows=CHUNK_ROWS, schema=None):
+    """Streams local json lines files as DataFrame chunks.
+
+    Args:
+        paths: The json file paths.
+        chunk_rows: The maximum number of rows of each chunk.
+        schema: An optional Schema object used to cast the columns.
+
+    Yields:
+        A pandas DataFrame object with at most chunk_rows rows.
+    """
+    lines = []
+    for path in paths:
+        with open(path, 'rb') as file:
+            for line in file:
+                lines.append(line)
+                if len(lines) == chunk_rows:
+                    yield records_frame(lines, schema)
+                    lines = []
+
+    if lines:
+        yield records_frame(lines, schema)
+
+
+def records_frame(lines, schema=None):
+    """Parses json lines into a DataFrame.
+
+    Args:
+        lines: A list of json lines as bytes.
+        schema: An optional Schema object used to cast the columns.
+
+    Returns:
+        A pandas DataFrame object.
+    """
+    data = pd.DataFrame.from_records(loads_lines(b''.join(lines)))
+    if schema is not None:
+        schema.apply(data)
+    return data
+
+
+class CsvStream(io.RawIOBase):
+    """This class defines a readable file object over DataFrame chunks.
+
+    Each chunk is encoded as CSV only when the previous one was read,
+    so copy_expert pulls the data at its own pace. The Arrow CSV writer
+    is used when pyarrow is installed, it quotes the empty strings and
+    leaves the nulls empty. The pandas writer marks the nulls with NULL.
+
+    Usage example:
+
+    stream = CsvStream(frames, ['song_id', 'title'])
+    cursor.copy_expert(sql, stream)
+    """
+
+    def __init__(self, frames, columns):
+        """Creates the CsvStream object.
+
+        Args:
+            frames: An iterable of DataFrame objects.
+            columns: The table column names in COPY order. The frame
+                columns are matched ignoring case, the missing ones
+                are sent as nulls.
+        """
+        super().__init__()
+        self.frames = iter(frames)
+        self.columns = list(columns)
+        self.rows = 0
+        self.bytes = 0
+        self.chunk = memoryview(b'')
+        self.offset = 0
+        # the COPY NULL option matching the CSV writer
+        self.null = '' if pa is not None else NULL
+
+    def readable(self):
+        return True
+
+    def close(self):
+        """Closes the stream and the DataFrame chunks generator."""
+        if hasattr(self.frames, 'close'):
+            self.frames.close()
+        super().close()
+
+    def __encode(self, frame):
+        """Encodes a DataFrame in the COPY CSV format.
+
+        Args:
+            frame: The DataFrame object.
+
+        Returns:
+            The CSV bytes.
+        """
+        names = {column.lower(): column for column in frame.columns}
+        frame = frame.rename(columns={names[name.lower()]: name
+                                      for name in self.columns
+                                      if name.lower() in names})
+        frame = frame.reindex(columns=self.columns)
+
+        self.rows += len(frame)
+
+        if pa is None:
+            return frame.to_csv(index=False, header=False,
+                                na_rep=NULL).encode('utf-8')
+
+        sink = pa.BufferOutputStream()
+        pa_csv.write_csv(pa.Table.from_pandas(frame, preserve_index=False),
+                         sink, pa_csv.WriteOptions(include_header=False))
+        return sink.getvalue()
+
+    def readinto(self, buffer):
+        """Fills the buffer with the next CSV bytes.
+
+        Args:
+            buffer: The writable buffer.
+
+        Returns:
+            The number of bytes written, 0 at the end of the stream.
+        """
+        while self.offset == len(self.chunk):
+            frame = next(self.frames, None)
+            if frame is None:
+                return 0
+            self.chunk = memoryview(self.__encode(frame))
+            self.offset = 0
+
+        size = min(len(buffer), len(self.chunk) - self.offset)
+        buffer[:size] = self.chunk[self.offset:self.offset + size]
+        self.offset += size
+        self.bytes += size
+
+        return size
+
+
+class CopyLoader:
+    """This class defines the COPY FROM STDIN staging tables loader.
+
+    It needs the Psycopg2 adapter, the Redshift connector has no
+    client side COPY support.
+
+    Usage example loading the S3 json files:
+
+    connection = PostgresConnection()
+    loader = CopyLoader(connection, S3Loader(config), config)
+    loader.run()
+
+    Usage example loading a local copy of the dataset:
+
+    loader = CopyLoader(connection, directory='data/bench')
+    loader.run()
+    """
+
+    def __init__(self, connection, loader=None, config=None, directory=None,
+                 chunk_rows=CHUNK_ROWS, max_workers=None):
+        """Creates the CopyLoader object.
+
+        Args:
+            connection: The Psycopg2 connection wrapper.
+            loader: The S3Loader object used to read the S3 files.
+            config: The dwh.cfg file wrapper object with the S3 paths.
+            directory: A local folder with the log_data and song_data
+                subfolders, read instead of S3 when set.
+            chunk_rows: The number of rows of each encoded chunk.
+            max_workers: The S3Loader thread pool size.
+        """
+        self.connection = connection
+        self.loader = loader
+        self.config = config
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.max_workers = max_workers
+
+    def copy(self, table, columns, frames, commit=True):
+        """Streams DataFrame chunks into a table.
+
+        Args:
+            table: The table name.
+            columns: The table column names.
+            frames: An iterable of DataFrame objects.
+            commit: If True commits the COPY, otherwise leaves the
+                transaction pending.
+
+        Returns:
+            A (rows, bytes) tuple of the loaded data.
+        """
+        start = timer()
+        error = None
+        with CsvStream(frames, columns) as stream:
+            query = f"COPY {table} ({', '.join(columns)}) FROM STDIN " \
+                    f"WITH (FORMAT csv, NULL '{stream.null}')"
+            try:
+                self.connection.cursor.copy_expert(query, stream, size=2**20)
+                if commit:
+                    self.connection.commit()
+            except Exception as exception:
+                error = type(exception).__name__
+                self.connection.rollback()
+                raise
+            finally:
+                if self.connection.metrics is not None:
+                    self.connection.metrics.record(
+                        f'copy {table}', timer() - start,
+                        None if error else stream.rows,
+                        None if error else stream.bytes,
+                        self.connection.retries, error)
+
+        return stream.rows, stream.bytes
+
+    def frames(self, source, schema):
+        """Streams the json files of a source folder.
+
+        Args:
+            source: The source folder. E.g. log_data
+            schema: The Schema object of the staging table.
+
+        Returns:
+            An iterator of DataFrame objects.
+        """
+        if self.directory is not None:
+            pattern = os.path.join(self.directory, source, '**', '*.json')
+            paths = sorted(glob.glob(pattern, recursive=True))
+            return iter_file_frames(paths, self.chunk_rows, schema)
+
+        option = 'LOG_DATA' if source == 'log_data' else 'SONG_DATA'
+        return self.loader.iter_frames(self.config.get('S3', option),
+                                       chunk_rows=self.chunk_rows,
+                                       max_workers=self.max_workers,
+                                       schema=schema)
+
+    def load(self, table, commit=True):
+        """Loads one staging table.
+
+        Args:
+            table: The staging table name. E.g. staging_events
+            commit: If True commits the COPY, otherwise leaves the
+                transaction pending.
+
+        Returns:
+            A (rows, bytes) tuple of the loaded data.
+        """
+        source, schema = STAGING_SOURCES[table]
+        return self.copy(table, list(schema.dtypes),
+                         self.frames(source, schema), commit)
+
+    def run(self):
+        """Loads the staging_events and staging_songs tables.
+
+        Returns:
+            A dict of table name to a (rows, bytes) tuple.
+        """
+        return {table: self.load(table) for table in STAGING_SOURCES}
@@ -1,10 +1,13 @@
-"""Defines a SchemaPipeline class to drop and create the Redshift tables."""
+"""Defines a SchemaPipeline class to drop and create the Redshift tables
+or to migrate only the changed ones."""
 
 # sys libs
 import argparse
 from timeit import default_timer as timer
 # SQL libs
 from connection import Connection
+from metrics import MetricsRecorder
+from migrate import SchemaMigration
 from sql_queries import CREATE_TABLE_QUERIES, DROP_TABLE_QUERIES
 
 
@@ -17,29 +20,88 @@ class SchemaPipeline:
     pipeline = SchemaPipeline(connection)
     pipeline.run()
 
+    Code usage example committing each phase once:
+
+    pipeline = SchemaPipeline(connection, batch=True)
+    pipeline.run()
+
+    Code usage example changing only the tables whose DDL changed:
+
+    pipeline = SchemaPipeline(connection, migrate=True)
+    pipeline.run()
+
     Usage example as python script with redshift connection:
 
     python -m create_tables --redshift
     """
 
-    def __init__(self, connection):
+    def __init__(self, connection, batch=False, migrate=False):
         """Creates the SchemaPipeline object and sets the connection.
 
         Args:
             connection: The connection adapter wrapper.
+            batch: If True each phase runs as one atomic batch with a
+                single commit, otherwise each statement is committed.
+            migrate: If True the catalog is compared to the declared
+                tables and only the changed tables are migrated,
+                instead of dropping and creating all tables.
         """
         self.connection = connection
+        self.batch = batch
+        self.migrate = migrate
 
     def create(self):
         """Executes all CREATE_TABLE_QUERIES statements."""
+        if self.batch:
+            self.connection.execute_batch(CREATE_TABLE_QUERIES)
+            return
+
         for query in CREATE_TABLE_QUERIES:
             self.connection.execute(query, commit=True)
 
     def drop(self):
         """Executes all DROP_TABLE_QUERIES statements."""
+        if self.batch:
+            self.connection.execute_batch(DROP_TABLE_QUERIES)
+            return
+
         for query in DROP_TABLE_QUERIES:
             self.connection.execute(query, commit=True)
 
+    def __phase(self, name, seconds):
+        """Records a phase time if the connection collects metrics.
+
+        Args:
+            name: The phase name.
+            seconds: The phase wall time.
+        """
+        if self.connection.metrics is not None:
+            self.connection.metrics.phase(name, seconds)
+
+    def __migrate(self):
+        """Migrates the changed tables and print time statistics."""
+        print('INFO: Migrating the database schema...')
+        start = timer()
+
+        migration = SchemaMigration(self.connection)
+        changes = migration.apply()
+        if changes:
+            # the rebuilt tables invalidate the cached query results
+            self.connection.bump_generation()
+
+        migrate_time = timer() - start
+        self.__phase('migrate', migrate_time)
+        print('INFO: Database schema migrated.')
+
+        # STATS: print the time statistics
+        print('-----------------------------------------------------')
+        print('Migration Statistics')
+        print('-----------------------------------------------------')
+        for change in changes:
+            print(f'{change.table}: {change.action}')
+        print(f'Unchanged tables: {len(migration.tables) - len(changes)}')
+        print(f'Migrate time: {round(migrate_time, 2)} seconds')
+
     def run(self):
         """Execute all pipeline phases and print time statistics."""
 
@@ -47,6 +109,10 @@ class SchemaPipeline:
         print('AWS Redshift Schema Pipeline')
         print('-----------------------------------------------------')
 
+        if self.migrate:
+            self.__migrate()
+            return
+
         # PHASE 1: drop the database tables
         print('INFO: Droping the database tables...')
         start = timer()
@@ -54,6 +120,7 @@ class SchemaPipeline:
         self.drop()
 
         drop_time = timer() - start
+        self.__phase('drop', drop_time)
         print('INFO: Database tables droped.')
 
         # PHASE 2: create the database schema
@@ -61,8 +128,11 @@ class SchemaPipeline:
         start = timer()
 
         self.create()
+        # the emptied tables invalidate the cached query results
+        self.connection.bump_generation()
 
         create_time = timer() - start
+        self.__phase('create', create_time)
         print('INFO: Database schema created.')
 
         # STATS: print the time statistics
@@ -73,21 +143,29 @@ class SchemaPipeline:
         print(f'Create tables time: {round(create_time, 2)} seconds')
 
 
-def main(redshift):
+def main(redshift, batch=False, metrics_dir=None, migrate=False):
     """The create_tables.py script entry point.
 
     Args:
         redshift: If True uses the Redshift connector API,
             otherwise use the default Psycopg2 adapter.
+        batch: If True commits each phase once.
+        metrics_dir: If set, the directory where the JSON run report
+            and the Prometheus metrics are written.
+        migrate: If True only the changed tables are migrated.
     """
     # sets the connection
-    connection = Connection(redshift=redshift)
+    metrics = MetricsRecorder('schema') if metrics_dir else None
+    connection = Connection(redshift=redshift, metrics=metrics)
 
     # run the pipeline
-    pipeline = SchemaPipeline(connection)
+    pipeline = SchemaPipeline(connection, batch=batch, migrate=migrate)
     pipeline.run()
     connection.close()
 
+    if metrics is not None:
+        metrics.write_reports(metrics_dir)
+
 
 if __name__ == '__main__':
     # create the command line parser
@@ -99,9 +177,19 @@ if __name__ == '__main__':
                         help='Set the redshift connector - default: pyscopg2',
                         type=bool,
                         default=False)
+    parser.add_argument('--batch',
+                        help='Commit each phase as one atomic batch',
+                        action='store_true')
+    parser.add_argument('--metrics',
+                        help='Directory of the JSON and Prometheus metrics',
+                        default=None)
+    parser.add_argument('--migrate',
+                        help='Migrate only the changed tables, '
+                             'keeping their data',
+                        action='store_true')
 
     # parse the command line arguments
     args = parser.parse_args()
 
     # run the pipeline
-    main(args.redshift)
+    main(args.redshift, args.batch, args.metrics, args.migrate)
@@ -0,0 +1,90 @@
+"""Defines the json lines decoding functions run by the process pool.
+
+Parsing json lines with pandas is single-core bound, so the S3Loader can
+spread the decoding across worker processes. The workers use orjson when
+it is installed and hand the results back as Arrow IPC streams when
+pyarrow is installed, which is much cheaper to transfer between processes
+than a pickled DataFrame.
+"""
+
+# sys libs
+import json
+# data libs
+import pandas as pd
+
+# optional faster json parser
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# optional columnar transfer format
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+def loads_lines(body):
+    """Parses json lines into a list of records.
+
+    Args:
+        body: The json lines as bytes.
+
+    Returns:
+        A list of dict records.
+    """
+    loads = json.loads if orjson is None else orjson.loads
+    return [loads(line) for line in body.splitlines() if line.strip()]
+
+
+def decode_frame(body, schema=None):
+    """Parses json lines into a transferable DataFrame payload.
+
+    This function runs in the process pool workers.
+
+    Args:
+        body: The json lines as bytes.
+        schema: An optional Schema object used to cast the columns.
+
+    Returns:
+        The Arrow IPC stream bytes when pyarrow is installed,
+        otherwise the DataFrame object.
+    """
+    data = pd.DataFrame.from_records(loads_lines(body))
+    if schema is not None:
+        schema.apply(data)
+
+    if pa is None:
+        return data
+
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return sink.getvalue().to_pybytes()
+
+
+def to_frame(payload, schema=None):
+    """Converts a decode_frame payload back into a DataFrame.
+
+    The Arrow round trip turns the object text columns into str
+    columns, so the schema is applied again to match the dtypes of
+    the DataFrames parsed in this process.
+
+    Args:
+        payload: The decode_frame return value.
+        schema: The Schema object passed to decode_frame, if any.
+
+    Returns:
+        A pandas DataFrame object.
+    """
+    if isinstance(payload, pd.DataFrame):
+        return payload
+
+    data = pa.ipc.open_stream(payload).read_all().to_pandas()
+    if schema is not None:
+        schema.apply(data)
+
+    return data
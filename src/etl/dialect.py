@@ -0,0 +1,101 @@
+"""Defines the PostgresConnection class to run the Redshift SQL on PostgreSQL.
+
+The benchmarks use a local PostgreSQL server as a stand-in for the
+cluster. The statements of the sql_queries module are rewritten on the
+fly: the distribution and sort keys and the informational primary keys
+are dropped, the DATE_PART units are quoted and the Redshift only
+functions are replaced.
+"""
+
+# sys libs
+import re
+# SQL libs
+from connection import Connection
+
+# DATE_PART units with a different PostgreSQL name
+DATE_PART_UNITS = {'dayofweek': 'dow', 'weekday': 'dow', 'dayofyear': 'doy'}
+
+
+def quote_unit(match):
+    """Quotes the unit of a DATE_PART call with its PostgreSQL name.
+
+    Args:
+        match: The DATE_PART pattern match object.
+
+    Returns:
+        The rewritten call prefix. E.g. DATE_PART('dow',
+    """
+    unit = match.group(1).lower()
+    return f"DATE_PART('{DATE_PART_UNITS.get(unit, unit)}',"
+
+
+# (pattern, replacement) rewrites applied in order
+POSTGRES_REWRITES = [
+    # table attributes: ) diststyle auto;
+    (re.compile(r'\)\s*diststyle\s+\w+\s*;', re.IGNORECASE), ');'),
+    # CREATE TABLE AS attributes: DISTKEY (song_id) SORTKEY (ts)
+    (re.compile(r'^\s*(?:DISTKEY|SORTKEY)\s*\([^)]*\)\s*\n', re.IGNORECASE
+                | re.MULTILINE), ''),
+    # column attributes: start_time TIMESTAMP NOT NULL sortkey distkey,
+    (re.compile(r'[ \t]+(?:sortkey|distkey)\b(?!\s*\()', re.IGNORECASE), ''),
+    # DATE_PART(hour, ts) to DATE_PART('hour', ts)
+    (re.compile(r'DATE_PART\(\s*(\w+)\s*,', re.IGNORECASE), quote_unit),
+    (re.compile(r'\bGETDATE\(\)', re.IGNORECASE), 'NOW()'),
+    # Redshift does not enforce the primary keys, so the duplicated
+    # user levels and songplay ids must not fail on PostgreSQL either
+    (re.compile(r',\s*PRIMARY KEY\s*\([^)]*\)\s*\n', re.IGNORECASE), '\n'),
+    # the INSERT ... SELECT order only matters for the Redshift sort
+    # order, PostgreSQL rejects it on a SELECT DISTINCT of other columns
+    (re.compile(r'\nORDER BY [^\n]+\n\);', re.IGNORECASE), '\n);'),
+]
+
+
+def to_postgres(query):
+    """Rewrites a Redshift statement into the PostgreSQL dialect.
+
+    Args:
+        query: The Redshift SQL statement.
+
+    Returns:
+        The PostgreSQL statement.
+    """
+    for pattern, replacement in POSTGRES_REWRITES:
+        query = pattern.sub(replacement, query)
+    return query
+
+
+class PostgresConnection(Connection):
+    """This class defines a Psycopg2 connection that runs the Redshift
+    statements on a PostgreSQL server.
+
+    The COPY statements from S3 have no PostgreSQL equivalent, the
+    staging tables must be loaded from the client instead.
+
+    Usage example:
+
+    connection = PostgresConnection(config=config)
+    SchemaPipeline(connection).run()
+    """
+
+    def __init__(self, config=None, metrics=None):
+        """Creates the PostgresConnection object.
+
+        Args:
+            config: An optional Config object. If None, the dwh.cfg
+                file is read.
+            metrics: An optional MetricsRecorder object that records
+                every executed statement.
+        """
+        super().__init__(redshift=False, config=config, metrics=metrics)
+
+    def execute(self, query, commit=False, params=None):
+        """Rewrites and executes a database operation.
+
+        Args:
+            query: The Redshift SQL statement.
+            commit: If True Commit the transaction to the database
+                otherwise leave it pending.
+            params: Optional sequence of values bound to the
+                %s query placeholders.
+        """
+        return super().execute(to_postgres(query), commit, params)
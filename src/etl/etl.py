@@ -4,9 +4,22 @@ and insert data into the Redshift Data Warehouse tables."""
 # sys libs
 import argparse
 from timeit import default_timer as timer
+# config libs
+from config import Config
 # SQL libs
+from checkpoint import Checkpoint
 from connection import Connection
-from sql_queries import COPY_TABLE_QUERIES, INSERT_TABLE_QUERIES
+from dialect import PostgresConnection
+from maintenance import TableMaintenance
+from metrics import MetricsRecorder
+from pool import ConnectionPool
+from scheduler import DagScheduler, Step
+# the COPY statements are rendered on first use, not on import
+import sql_queries
+from sql_queries import INSERT_TABLE_QUERIES, INSERT_TABLE_STEPS
+from sql_queries import MATERIALIZED_INSERT_TABLE_QUERIES
+from sql_queries import MATERIALIZED_INSERT_TABLE_STEPS
+from sql_queries import DROP_TABLE_STAGING_PLAYS, TRUNCATE_TABLE_QUERIES
 
 
 class ETLPipeline:
@@ -18,29 +31,273 @@ class ETLPipeline:
     pipeline = ETLPipeline(connection)
     pipeline.run()
 
+    Code usage example running independent statements in parallel:
+
+    pool = ConnectionPool(max_size=4)
+    pipeline = ETLPipeline(connection, pool=pool)
+    pipeline.run()
+
+    Code usage example sharing one materialized staging join:
+
+    pipeline = ETLPipeline(connection, materialize=True)
+    pipeline.run()
+
+    Code usage example on a PostgreSQL stand-in, loading the staging
+    tables from the client:
+
+    connection = PostgresConnection()
+    copy_loader = CopyLoader(connection, S3Loader(config), config)
+    pipeline = ETLPipeline(connection, copy_loader=copy_loader)
+    pipeline.run()
+
+    Code usage example resuming a failed checkpointed run:
+
+    checkpoint = Checkpoint(connection, resume=True)
+    pipeline = ETLPipeline(connection, checkpoint=checkpoint)
+    pipeline.run()
+
+    Code usage example vacuuming and analyzing the loaded tables:
+
+    pipeline = ETLPipeline(connection,
+                           maintenance=TableMaintenance(connection))
+    pipeline.run()
+
     Usage example as python script with redshift connection:
 
     python -m etl --redshift
     """
 
-    def __init__(self, connection):
+    def __init__(self, connection, pool=None, max_workers=4,
+                 materialize=False, batch=False, copy_loader=None,
+                 checkpoint=None, maintenance=None):
         """Creates the ETLPipeline object and sets the connection.
 
         Args:
             connection: The connection adapter wrapper.
+            pool: An optional ConnectionPool object. If set, the
+                statements run in parallel as their table
+                dependencies allow.
+            max_workers: The maximum number of concurrent statements.
+            materialize: If True, the staging tables are joined once
+                into the staging_plays table read by the inserts.
+            batch: If True each phase runs as one atomic batch with a
+                single commit, otherwise each statement is committed.
+            copy_loader: An optional CopyLoader object that loads the
+                staging tables instead of the S3 COPY statements.
+            checkpoint: An optional Checkpoint object. If set, each
+                step is committed with its checkpoint and the steps
+                completed by a resumed run are skipped.
+            maintenance: An optional TableMaintenance object. If set,
+                the loaded tables are vacuumed and analyzed after
+                the run as their statistics require.
         """
         self.connection = connection
+        self.pool = pool
+        self.max_workers = max_workers
+        self.materialize = materialize
+        self.batch = batch
+        self.copy_loader = copy_loader
+        self.checkpoint = checkpoint
+        self.maintenance = maintenance
 
     def load(self):
-        """Executes all COPY_TABLE_QUERIES statements."""
-        for query in COPY_TABLE_QUERIES:
+        """Executes all COPY_TABLE_QUERIES statements.
+
+        If copy_loader is set, the staging tables are streamed
+        from the client instead.
+        """
+        if self.copy_loader is not None:
+            self.copy_loader.run()
+            return
+
+        if self.batch:
+            self.connection.execute_batch(sql_queries.COPY_TABLE_QUERIES)
+            return
+
+        for query in sql_queries.COPY_TABLE_QUERIES:
             self.connection.execute(query, commit=True)
 
     def insert(self):
-        """Executes all INSERT_TABLE_QUERIES statements."""
-        for query in INSERT_TABLE_QUERIES:
+        """Executes all INSERT_TABLE_QUERIES statements.
+
+        If materialize is set, executes all
+        MATERIALIZED_INSERT_TABLE_QUERIES statements instead.
+        """
+        queries = MATERIALIZED_INSERT_TABLE_QUERIES if self.materialize \
+            else INSERT_TABLE_QUERIES
+
+        if self.batch:
+            self.connection.execute_batch(queries)
+            return
+
+        for query in queries:
             self.connection.execute(query, commit=True)
 
+    def steps(self):
+        """Returns the COPY and INSERT statements as dependency graph steps.
+
+        The COPY steps are left out when copy_loader is set.
+
+        Returns:
+            A list of Step objects.
+        """
+        inserts = MATERIALIZED_INSERT_TABLE_STEPS if self.materialize \
+            else INSERT_TABLE_STEPS
+        copies = sql_queries.COPY_TABLE_STEPS if self.copy_loader is None \
+            else []
+
+        return [Step(table, query, depends) for table, query, depends
+                in copies + inserts]
+
+    def compare_inserts(self):
+        """Times the inserts with and without the materialized join.
+
+        The staging tables must be loaded. The DW tables are truncated
+        before each run and hold the materialized run data at the end.
+
+        Returns:
+            A dict of mode ('direct' or 'materialized') to a dict
+            of table name to execution time in seconds.
+        """
+        modes = (('direct', INSERT_TABLE_STEPS),
+                 ('materialized', MATERIALIZED_INSERT_TABLE_STEPS))
+
+        results = {}
+        for mode, steps in modes:
+            for query in TRUNCATE_TABLE_QUERIES + [DROP_TABLE_STAGING_PLAYS]:
+                self.connection.execute(query, commit=True)
+
+            times = {}
+            for table, query, _ in steps:
+                start = timer()
+                self.connection.execute(query, commit=True)
+                times[table] = timer() - start
+            results[mode] = times
+
+        self.connection.execute(DROP_TABLE_STAGING_PLAYS, commit=True)
+
+        # STATS: print the time statistics
+        print('-----------------------------------------------------')
+        print('Insert Time Comparison')
+        print('-----------------------------------------------------')
+        for mode, times in results.items():
+            for table, seconds in times.items():
+                print(f'{mode} {table} time: {round(seconds, 2)} seconds')
+            print(f'{mode} total time: '
+                  f'{round(sum(times.values()), 2)} seconds')
+
+        return results
+
+    def schedule(self):
+        """Executes all statements in parallel and print time statistics.
+
+        The staging tables are loaded concurrently and each insert
+        starts as soon as its source staging tables are loaded.
+        """
+        print('INFO: Running the pipeline statements in parallel...')
+        start = timer()
+
+        if self.materialize:
+            self.connection.execute(DROP_TABLE_STAGING_PLAYS, commit=True)
+
+        if self.copy_loader is not None:
+            self.copy_loader.run()
+
+        scheduler = DagScheduler(self.pool, self.max_workers)
+        times = scheduler.run(self.steps())
+
+        if self.materialize:
+            self.connection.execute(DROP_TABLE_STAGING_PLAYS, commit=True)
+
+        total_time = timer() - start
+        self.__phase('schedule', total_time)
+        print('INFO: Staging and DW tables loaded.')
+
+        # STATS: print the time statistics
+        print('-----------------------------------------------------')
+        print('Time Statistics')
+        print('-----------------------------------------------------')
+        for table, seconds in times.items():
+            print(f'{table} time: {round(seconds, 2)} seconds')
+        print(f'Pipeline time: {round(total_time, 2)} seconds')
+
+    def checkpointed(self):
+        """Executes the steps not yet completed and print statistics.
+
+        The steps run in parallel when a pool is set, otherwise one
+        after another. Each step is committed with its checkpoint.
+        """
+        completed = self.checkpoint.start()
+        if completed:
+            print(f'INFO: Resuming, skipping {len(completed)} completed '
+                  f'steps: {", ".join(sorted(completed))}')
+
+        print('INFO: Running the pending pipeline steps...')
+        start = timer()
+
+        # a resumed run keeps the staging_plays table it has loaded
+        if self.materialize and not self.checkpoint.done('staging_plays'):
+            self.connection.execute(DROP_TABLE_STAGING_PLAYS, commit=True)
+
+        if self.copy_loader is not None:
+            for table in ('staging_events', 'staging_songs'):
+                if not self.checkpoint.done(table):
+                    self.checkpoint.record(
+                        self.connection, table,
+                        lambda table=table:
+                        self.copy_loader.load(table, commit=False)[0],
+                        f'copy {table}')
+
+        steps = [step for step in self.steps()
+                 if not self.checkpoint.done(step.name)]
+        if self.pool is not None:
+            DagScheduler(self.pool, self.max_workers,
+                         runner=self.checkpoint.execute).run(steps)
+        else:
+            for step in steps:
+                self.checkpoint.execute(self.connection, step)
+
+        if self.materialize:
+            self.connection.execute(DROP_TABLE_STAGING_PLAYS, commit=True)
+
+        total_time = timer() - start
+        self.__phase('checkpointed', total_time)
+        print('INFO: Staging and DW tables loaded.')
+
+        # STATS: print the row statistics
+        print('-----------------------------------------------------')
+        print('Step Statistics')
+        print('-----------------------------------------------------')
+        for name, rows in self.checkpoint.completed.items():
+            skipped = ' (skipped)' if name in completed else ''
+            print(f'{name} rows: {rows}{skipped}')
+        print(f'Pipeline time: {round(total_time, 2)} seconds')
+
+    def __phase(self, name, seconds):
+        """Records a phase time if the connection collects metrics.
+
+        Args:
+            name: The phase name.
+            seconds: The phase wall time.
+        """
+        if self.connection.metrics is not None:
+            self.connection.metrics.phase(name, seconds)
+
+    def __bump(self):
+        """Bumps the load generation of the successful run.
+
+        The cached query results of the older generations are stale.
+        """
+        self.connection.bump_generation()
+
+    def __maintain(self):
+        """Runs the maintenance stage if set and records its time."""
+        if self.maintenance is None:
+            return
+
+        print('INFO: Maintaining the DW tables...')
+        self.maintenance.run()
+
     def run(self):
         """Execute all pipeline phases and print time statistics."""
 
@@ -48,6 +305,18 @@ class ETLPipeline:
         print('AWS Redshift ETL Pipeline')
         print('-----------------------------------------------------')
 
+        if self.checkpoint is not None:
+            self.checkpointed()
+            self.__bump()
+            self.__maintain()
+            return
+
+        if self.pool is not None:
+            self.schedule()
+            self.__bump()
+            self.__maintain()
+            return
+
         # PHASE 1: Extract from S3 and load into staging tables
         print('INFO: Loading S3 data into staging tables...')
         start = timer()
@@ -55,6 +324,7 @@ class ETLPipeline:
         self.load()
 
         load_time = timer() - start
+        self.__phase('load', load_time)
         print('INFO: Staging tables loaded.')
 
         # PHASE 3: Insert transformed data into DW tables
@@ -62,6 +332,8 @@ class ETLPipeline:
         start = timer()
         self.insert()
         insert_time = timer() - start
+        self.__phase('insert', insert_time)
+        self.__bump()
         print('INFO: DW tables loaded.')
 
         # STATS: print the time statistics
@@ -71,21 +343,79 @@ class ETLPipeline:
         print(f'Staging tables time: {round(load_time, 2)} seconds')
         print(f'Insert tables time: {round(insert_time, 2)} seconds')
 
+        self.__maintain()
 
-def main(redshift):
+
+def main(redshift, parallel=0, materialize=False, batch=False,
+         metrics_dir=None, postgres=False, checkpoint=False, resume=False,
+         maintain=False, compare=False):
     """The etl.py script entry point.
 
     Args:
         redshift: If True uses the Redshift connector API,
             otherwise use the default Psycopg2 adapter.
+        parallel: The maximum number of concurrent statements.
+            If lower than 2, the statements run one after another.
+        materialize: If True, the inserts read a materialized
+            staging join.
+        batch: If True commits each phase once.
+        metrics_dir: If set, the directory where the JSON run report
+            and the Prometheus metrics are written.
+        postgres: If True runs on a PostgreSQL server, the staging
+            tables are loaded with COPY FROM STDIN and the statements
+            run one after another.
+        checkpoint: If True each step is checkpointed in the
+            etl_checkpoint table.
+        resume: If True skips the steps checkpointed by the previous
+            run, it implies checkpoint.
+        maintain: If True vacuums and analyzes the DW tables whose
+            statistics cross the maintenance thresholds.
+        compare: If True loads the staging tables and only times the
+            inserts with and without the materialized join.
     """
     # sets the connection
-    connection = Connection(redshift=redshift)
+    metrics = MetricsRecorder('etl') if metrics_dir else None
+    copy_loader = None
+    if postgres:
+        # boto3 and pandas are only needed by the client side load
+        # pylint: disable=import-outside-toplevel
+        from s3 import S3Loader
+        from copy_loader import CopyLoader
+
+        config = Config()
+        connection = PostgresConnection(config=config, metrics=metrics)
+        copy_loader = CopyLoader(connection, S3Loader(config), config)
+    else:
+        connection = Connection(redshift=redshift, metrics=metrics)
+    pool = None
+    if parallel > 1 and not postgres:
+        pool = ConnectionPool(redshift=redshift, min_size=0,
+                              max_size=parallel, metrics=metrics)
+
+    checkpoints = None
+    if checkpoint or resume:
+        checkpoints = Checkpoint(connection, resume=resume)
+
+    maintenance = TableMaintenance(connection) if maintain else None
 
     # run the pipeline
-    pipeline = ETLPipeline(connection)
-    pipeline.run()
+    pipeline = ETLPipeline(connection, pool=pool, max_workers=parallel,
+                           materialize=materialize, batch=batch,
+                           copy_loader=copy_loader, checkpoint=checkpoints,
+                           maintenance=maintenance)
+    if compare:
+        pipeline.load()
+        pipeline.compare_inserts()
+        # the comparison rewrites the DW tables
+        connection.bump_generation()
+    else:
+        pipeline.run()
     connection.close()
+    if pool is not None:
+        pool.close()
+
+    if metrics is not None:
+        metrics.write_reports(metrics_dir)
 
 
 if __name__ == "__main__":
@@ -98,9 +428,43 @@ if __name__ == "__main__":
                         help='Set the redshift connector - default: pyscopg2',
                         type=bool,
                         default=False)
+    parser.add_argument('--parallel',
+                        help='Max concurrent statements - default: 0',
+                        type=int,
+                        default=0)
+    parser.add_argument('--materialize',
+                        help='Share one materialized staging join',
+                        action='store_true')
+    parser.add_argument('--batch',
+                        help='Commit each phase as one atomic batch',
+                        action='store_true')
+    parser.add_argument('--metrics',
+                        help='Directory of the JSON and Prometheus metrics',
+                        default=None)
+    parser.add_argument('--postgres',
+                        help='Run on PostgreSQL loading the staging tables '
+                             'with COPY FROM STDIN',
+                        action='store_true')
+    parser.add_argument('--checkpoint',
+                        help='Record each completed step in etl_checkpoint',
+                        action='store_true')
+    parser.add_argument('--resume',
+                        help='Skip the steps completed by the previous '
+                             'checkpointed run',
+                        action='store_true')
+    parser.add_argument('--maintain',
+                        help='Vacuum and analyze the DW tables after the '
+                             'load as their statistics require',
+                        action='store_true')
+    parser.add_argument('--compare',
+                        help='Time the inserts with and without the '
+                             'materialized staging join',
+                        action='store_true')
 
     # parse the command line arguments
     args = parser.parse_args()
 
     # run the pipeline
-    main(args.redshift)
+    main(args.redshift, args.parallel, args.materialize, args.batch,
+         args.metrics, args.postgres, args.checkpoint, args.resume,
+         args.maintain, args.compare)
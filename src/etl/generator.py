@@ -0,0 +1,394 @@
+"""Defines the DataGenerator class to write synthetic Sparkify datasets.
+
+The generated song_data and log_data json files follow the layout and
+the fields of the udacity-dend bucket, so the staging schemas, the COPY
+statements and the inserts can be measured at any scale without the
+shared bucket. The song and artist popularity follow a Zipf law whose
+exponent controls the skew of the joins and of the dimension tables.
+
+Usage example as python script:
+
+python -m generator --events 1000000 --skew 1.2 --output ../../data/bench
+"""
+
+# sys libs
+import os
+import json
+import contextlib
+import random
+import argparse
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from timeit import default_timer as timer
+# config libs
+from config import Config
+# AWS libs
+from s3 import S3Loader
+
+# optional faster json serializer
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# milliseconds per day
+DAY_MS = 24 * 60 * 60 * 1000
+
+# staging_events SMALLINT upper bound
+SMALLINT_MAX = 32767
+
+# log_data pages, NextSong is the only page with a song
+PAGES = ['NextSong'] * 16 + ['Home', 'Logout', 'Login', 'Settings',
+                             'Upgrade', 'Downgrade', 'Help', 'About']
+
+USER_AGENTS = [
+    '"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/36.0.1985.143 Safari/537.36"',
+    'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0',
+    '"Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Ubuntu Chromium/36.0.1985.125 Chrome/36.0.1985.125 '
+    'Safari/537.36"']
+
+LOCATIONS = ['San Francisco-Oakland-Hayward, CA',
+             'Atlanta-Sandy Springs-Roswell, GA',
+             'Chicago-Naperville-Elgin, IL-IN-WI',
+             'Houston-The Woodlands-Sugar Land, TX',
+             'New York-Newark-Jersey City, NY-NJ-PA',
+             'Portland-South Portland, ME',
+             'Lansing-East Lansing, MI',
+             'Tampa-St. Petersburg-Clearwater, FL']
+
+LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+
+
+def dumps(record):
+    """Serializes a record as one json line.
+
+    Args:
+        record: The dict record.
+
+    Returns:
+        The json line as bytes.
+    """
+    if orjson is None:
+        return json.dumps(record).encode('utf-8') + b'\n'
+    return orjson.dumps(record) + b'\n'
+
+
+def zipf_weights(count, skew):
+    """Builds the cumulative Zipf weights of count ranked items.
+
+    Args:
+        count: The number of items.
+        skew: The Zipf exponent. 0 is uniform, 1 is the classic Zipf.
+
+    Returns:
+        A list of cumulative weights for random.choices.
+    """
+    return list(itertools.accumulate(
+        1.0 / rank ** skew for rank in range(1, count + 1)))
+
+
+class DataGenerator:
+    """This class defines a reproducible synthetic Sparkify dataset.
+
+    Every NextSong event references a generated song by title, artist
+    name and duration, so the staging join matches as it does on the
+    real data. The other pages carry no song, as in the log_data files.
+
+    Usage example:
+
+    generator = DataGenerator(events=1000000, skew=1.2)
+    generator.write('data/bench')
+    generator.upload(S3Loader(config), 'data/bench', 's3://sparkify-bench')
+    """
+
+    def __init__(self, events, songs=None, artists=None, users=100,
+                 skew=1.0, days=30, start='2018-11-01', seed=42):
+        """Creates the DataGenerator object.
+
+        Args:
+            events: The number of log_data events.
+            songs: The number of songs. If None, one per 20 events.
+            artists: The number of artists. If None, one per 4 songs.
+            users: The number of users.
+            skew: The Zipf exponent of the song and artist popularity.
+            days: The number of days, one log_data file per day.
+            start: The ISO date of the first event.
+            seed: The random generator seed.
+        """
+        self.events = events
+        self.songs = songs or max(events // 20, 1)
+        self.artists = artists or max(self.songs // 4, 1)
+        self.users = users
+        self.skew = skew
+        self.days = days
+        self.start = int(datetime.fromisoformat(start).replace(
+            tzinfo=timezone.utc).timestamp() * 1000)
+        self.seed = seed
+
+    @staticmethod
+    def __code(rand, prefix):
+        """Builds an 18 characters identifier. E.g. SOUPIRU12A6D4FA1E1"""
+        return prefix + ''.join(rand.choice(LETTERS) for _ in range(16))
+
+    def song_records(self):
+        """Generates the song_data records.
+
+        Yields:
+            A (track_id, record) tuple per song.
+        """
+        rand = random.Random(self.seed)
+
+        artists = []
+        for index in range(self.artists):
+            located = rand.random() < 0.4
+            artists.append({
+                'artist_id': self.__code(rand, 'AR'),
+                'artist_name': f'Artist {index}',
+                'artist_location': rand.choice(LOCATIONS) if located else '',
+                'artist_latitude': round(rand.uniform(-60, 60), 5)
+                if located else None,
+                'artist_longitude': round(rand.uniform(-150, 150), 5)
+                if located else None})
+
+        # popular artists release more songs
+        weights = zipf_weights(self.artists, self.skew)
+        for index in range(self.songs):
+            artist = rand.choices(artists, cum_weights=weights)[0]
+            record = {'num_songs': 1,
+                      'song_id': self.__code(rand, 'SO'),
+                      'title': f'Song {index}',
+                      'duration': round(rand.uniform(60, 600), 5),
+                      'year': rand.choice([0, rand.randint(1960, 2018)])}
+            record.update(artist)
+            yield self.__code(rand, 'TR'), record
+
+    def __users(self, rand):
+        """Builds the user profiles of the log_data events."""
+        users = []
+        for index in range(1, self.users + 1):
+            users.append({
+                'userId': str(index),
+                'firstName': f'First{index}',
+                'lastName': f'Last{index}',
+                'gender': rand.choice('FM'),
+                'location': rand.choice(LOCATIONS),
+                'registration': float(self.start
+                                      - rand.randint(0, 90) * DAY_MS),
+                'userAgent': rand.choice(USER_AGENTS),
+                'level': rand.choice(['free', 'paid'])})
+        return users
+
+    def event_records(self, songs):
+        """Generates the log_data records in ts order.
+
+        Args:
+            songs: The list of song records the events play.
+
+        Yields:
+            A (day, record) tuple per event, day counted from start.
+        """
+        rand = random.Random(self.seed + 1)
+        users = self.__users(rand)
+        weights = zipf_weights(len(songs), self.skew)
+        step = self.days * DAY_MS / max(self.events, 1)
+
+        sessions = {}
+        session_id = 0
+        for index in range(self.events):
+            user = rand.choice(users)
+
+            # a new session every 20 events on average, the ids wrap
+            # around as sessionId and itemInSession are SMALLINT columns
+            session = sessions.get(user['userId'])
+            if session is None or session[1] >= SMALLINT_MAX \
+                    or rand.random() < 0.05:
+                session_id = session_id % SMALLINT_MAX + 1
+                sessions[user['userId']] = [session_id, 0]
+                # a few users change their level between sessions
+                if rand.random() < 0.02:
+                    user['level'] = 'paid' if user['level'] == 'free' \
+                        else 'free'
+            session = sessions[user['userId']]
+
+            page = rand.choice(PAGES)
+            song = rand.choices(songs, cum_weights=weights)[0] \
+                if page == 'NextSong' else None
+
+            ts = self.start + int(index * step)
+            yield (ts - self.start) // DAY_MS, {
+                'artist': song['artist_name'] if song else None,
+                'auth': 'Logged In',
+                'firstName': user['firstName'],
+                'gender': user['gender'],
+                'itemInSession': session[1],
+                'lastName': user['lastName'],
+                'length': song['duration'] if song else None,
+                'level': user['level'],
+                'location': user['location'],
+                'method': 'PUT' if page == 'NextSong' else 'GET',
+                'page': page,
+                'registration': user['registration'],
+                'sessionId': session[0],
+                'song': song['title'] if song else None,
+                'status': 200,
+                'ts': ts,
+                'userAgent': user['userAgent'],
+                'userId': user['userId']}
+            session[1] += 1
+
+    def write(self, directory):
+        """Writes the song_data and log_data files.
+
+        Songs are written one per file under song_data/A/B/C/ as in
+        the udacity-dend bucket, the events one file per day under
+        log_data/YYYY/MM/. The records are streamed, so only the
+        songs are held in memory.
+
+        Args:
+            directory: The local output directory.
+
+        Returns:
+            A dict with the number of songs, events and bytes written.
+        """
+        songs = []
+        written = 0
+        for track_id, record in self.song_records():
+            folder = os.path.join(directory, 'song_data', *track_id[2:5])
+            os.makedirs(folder, exist_ok=True)
+            body = dumps(record)
+            with open(os.path.join(folder, f'{track_id}.json'), 'wb') as file:
+                file.write(body)
+            written += len(body)
+            songs.append(record)
+
+        events = 0
+        current = None
+        with contextlib.ExitStack() as stack:
+            for day, record in self.event_records(songs):
+                if day != current:
+                    # close the previous day file before opening the next
+                    stack.close()
+                    current = day
+                    date = datetime.fromtimestamp(
+                        (self.start + day * DAY_MS) / 1000, timezone.utc)
+                    folder = os.path.join(directory, 'log_data',
+                                          f'{date:%Y}', f'{date:%m}')
+                    os.makedirs(folder, exist_ok=True)
+                    file = stack.enter_context(open(
+                        os.path.join(folder, f'{date:%Y-%m-%d}-events.json'),
+                        'wb'))
+                body = dumps(record)
+                file.write(body)
+                written += len(body)
+                events += 1
+
+        return {'songs': len(songs), 'events': events, 'bytes': written}
+
+    @staticmethod
+    def upload(loader, directory, bucket_path, max_workers=32):
+        """Uploads the written files keeping their relative keys.
+
+        Args:
+            loader: The S3Loader object.
+            directory: The local directory passed to write.
+            bucket_path: The S3 destination. E.g. s3://sparkify-bench
+            max_workers: The number of upload threads.
+
+        Returns:
+            The number of uploaded files.
+        """
+        paths = [os.path.join(root, name)
+                 for root, _, names in os.walk(directory) for name in names]
+
+        def put(path):
+            key = os.path.relpath(path, directory).replace(os.sep, '/')
+            with open(path, 'rb') as file:
+                loader.save_path(f'{bucket_path}/{key}', file.read())
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(put, paths))
+
+        return len(paths)
+
+
+def main(events, songs, artists, users, skew, days, output, bucket_path):
+    """The generator.py script entry point.
+
+    Args:
+        events: The number of log_data events.
+        songs: The number of songs or None.
+        artists: The number of artists or None.
+        users: The number of users.
+        skew: The Zipf exponent of the song and artist popularity.
+        days: The number of days of events.
+        output: The local output directory.
+        bucket_path: An optional S3 path the files are uploaded to.
+    """
+    print('-----------------------------------------------------')
+    print('Sparkify Synthetic Data Generator')
+    print('-----------------------------------------------------')
+
+    start = timer()
+    generator = DataGenerator(events, songs, artists, users, skew, days)
+    stats = generator.write(output)
+    write_time = timer() - start
+
+    print(f"INFO: {stats['songs']} songs and {stats['events']} events "
+          f"written to {output}.")
+    print(f"Write time: {round(write_time, 2)} seconds, "
+          f"{round(stats['bytes'] / 2**20 / write_time, 1)} MiB/s")
+
+    if bucket_path:
+        start = timer()
+        count = generator.upload(S3Loader(Config()), output, bucket_path)
+        print(f'INFO: {count} files uploaded to {bucket_path} in '
+              f'{round(timer() - start, 2)} seconds.')
+
+
+if __name__ == '__main__':
+    # create the command line parser
+    parser = argparse.ArgumentParser(
+        description='Sparkify Synthetic Data Generator')
+
+    # set the command line arguments
+    parser.add_argument('--events',
+                        help='Number of log_data events - default: 10000',
+                        type=int,
+                        default=10000)
+    parser.add_argument('--songs',
+                        help='Number of songs - default: events / 20',
+                        type=int,
+                        default=None)
+    parser.add_argument('--artists',
+                        help='Number of artists - default: songs / 4',
+                        type=int,
+                        default=None)
+    parser.add_argument('--users',
+                        help='Number of users - default: 100',
+                        type=int,
+                        default=100)
+    parser.add_argument('--skew',
+                        help='Zipf exponent of the song popularity '
+                             '- default: 1.0',
+                        type=float,
+                        default=1.0)
+    parser.add_argument('--days',
+                        help='Number of days of events - default: 30',
+                        type=int,
+                        default=30)
+    parser.add_argument('--output',
+                        help='Local output directory',
+                        default='generated')
+    parser.add_argument('--upload',
+                        help='S3 path the files are uploaded to',
+                        default=None)
+
+    # parse the command line arguments
+    args = parser.parse_args()
+
+    # generate the data
+    main(args.events, args.songs, args.artists, args.users, args.skew,
+         args.days, args.output, args.upload)
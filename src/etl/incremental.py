@@ -0,0 +1,229 @@
+"""Defines the IncrementalPipeline class to load only the new log data.
+
+The etl_state table keeps a high-water mark per source: the last
+loaded S3 key and the last event ts. Each run lists the log_data keys
+sorted after the mark, COPYs them through a generated manifest,
+appends the new events to songplays and time and upserts the
+dimension tables, so the cost follows the new data instead of the
+whole history.
+"""
+
+# sys libs
+import argparse
+from datetime import datetime, timezone
+from timeit import default_timer as timer
+# config libs
+from config import Config
+# AWS libs
+from s3 import S3Loader
+from index import list_entries
+from manifest import build_manifest, write_manifest
+# SQL libs
+from connection import Connection
+# the COPY statements are rendered on first use, not on import
+import sql_queries
+from sql_queries import SELECT_ETL_STATE, DELETE_ETL_STATE, INSERT_ETL_STATE
+from sql_queries import SELECT_STAGING_EVENTS_MAX_TS, SELECT_STAGING_SONGS_COUNT
+from sql_queries import TRUNCATE_TABLE_STAGING_EVENTS
+from sql_queries import INCREMENTAL_INSERT_TABLE_QUERIES
+from upsert import DimensionUpsert
+
+# etl_state source name of the log data
+LOG_SOURCE = 'log_data'
+
+
+class IncrementalPipeline:
+    """This class defines the incremental Redshift ETL pipeline.
+
+    The staging_songs table is loaded once and kept between runs.
+    The inserts, the merges and the new high-water mark are committed
+    in one transaction, so a failed run loads the same files again.
+
+    Code usage example:
+
+    config = Config()
+    connection = Connection()
+    pipeline = IncrementalPipeline(connection, S3Loader(config), config)
+    pipeline.run()
+
+    Usage example as python script with redshift connection:
+
+    python -m incremental --redshift
+    """
+
+    def __init__(self, connection, loader, config):
+        """Creates the IncrementalPipeline object.
+
+        Args:
+            connection: The connection adapter wrapper.
+            loader: The S3Loader object used to list the log data
+                and write the manifest.
+            config: The dwh.cfg file wrapper object.
+        """
+        self.connection = connection
+        self.loader = loader
+        self.config = config
+
+    def watermark(self):
+        """Reads the high-water mark of the log data.
+
+        Returns:
+            A (last_key, last_ts) tuple, (None, 0) on the first run.
+        """
+        rows = self.connection.query(SELECT_ETL_STATE, (LOG_SOURCE,))
+        if not rows:
+            return None, 0
+
+        last_key, last_ts = rows[0]
+        return last_key, last_ts or 0
+
+    def plan(self, last_key):
+        """Lists the log data files sorted after the last loaded key.
+
+        Args:
+            last_key: The last loaded S3 key or None.
+
+        Returns:
+            A list of IndexEntry objects.
+        """
+        path = self.config.get('S3', 'LOG_DATA').split('/')
+        bucket, prefix = path[2], '/'.join(path[3:])
+
+        return [entry for entry in
+                list_entries(self.loader.client, bucket, prefix, last_key)
+                if entry.key.endswith('.json')]
+
+    def stage(self, entries):
+        """Loads the planned files into the staging tables.
+
+        Args:
+            entries: The IndexEntry objects of the new log files.
+        """
+        bucket = self.config.get('S3', 'LOG_DATA').split('/')[2]
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        path = f"{self.config.get('S3', 'STAGING')}/manifests/" \
+               f"log_data-{stamp}.manifest"
+
+        manifest = write_manifest(build_manifest(bucket, entries), path,
+                                  self.loader)
+
+        self.connection.execute(TRUNCATE_TABLE_STAGING_EVENTS, commit=True)
+        self.connection.execute(
+            sql_queries.COPY_STAGING_EVENTS_MANIFEST.format(
+                manifest=manifest),
+            commit=True)
+
+        # the song data is loaded on the first run only
+        if self.connection.query(SELECT_STAGING_SONGS_COUNT)[0][0] == 0:
+            self.connection.execute(sql_queries.COPY_STAGING_SONGS,
+                                    commit=True)
+
+    def insert(self, last_ts, last_key):
+        """Appends the new facts, merges the dimensions and moves the mark.
+
+        Args:
+            last_ts: The ts high-water mark of the previous run.
+            last_key: The last S3 key of this run.
+
+        Returns:
+            A dict of dimension table name to the number of
+            new or changed rows.
+        """
+        for query in INCREMENTAL_INSERT_TABLE_QUERIES:
+            self.connection.execute(query, params=(last_ts,))
+
+        changed = DimensionUpsert(self.connection).run(commit=False)
+
+        max_ts = self.connection.query(SELECT_STAGING_EVENTS_MAX_TS)[0][0]
+
+        self.connection.execute(DELETE_ETL_STATE, params=(LOG_SOURCE,))
+        self.connection.execute(
+            INSERT_ETL_STATE,
+            params=(LOG_SOURCE, last_key, max(max_ts or 0, last_ts)))
+
+        # the cached query results of the previous loads are stale
+        self.connection.bump_generation(commit=False)
+
+        self.connection.commit()
+
+        return changed
+
+    def run(self):
+        """Execute all pipeline phases and print time statistics."""
+
+        print('-----------------------------------------------------')
+        print('AWS Redshift Incremental ETL Pipeline')
+        print('-----------------------------------------------------')
+
+        # PHASE 1: plan the new log files
+        last_key, last_ts = self.watermark()
+        entries = self.plan(last_key)
+
+        if not entries:
+            print(f'INFO: No log data after {last_key}.')
+            return
+
+        print(f'INFO: Loading {len(entries)} new log files...')
+        start = timer()
+
+        self.stage(entries)
+
+        load_time = timer() - start
+        print('INFO: Staging tables loaded.')
+
+        # PHASE 2: append and merge into the DW tables
+        print('INFO: Merging data into DW tables...')
+        start = timer()
+
+        try:
+            changed = self.insert(last_ts, entries[-1].key)
+        except Exception:
+            self.connection.rollback()
+            raise
+
+        insert_time = timer() - start
+        print('INFO: DW tables loaded.')
+
+        # STATS: print the time statistics
+        print('-----------------------------------------------------')
+        print('Time Statistics')
+        print('-----------------------------------------------------')
+        print(f'Staging tables time: {round(load_time, 2)} seconds')
+        print(f'Merge tables time: {round(insert_time, 2)} seconds')
+        for table, rows in changed.items():
+            print(f'{table} new or changed rows: {rows}')
+
+
+def main(redshift):
+    """The incremental.py script entry point.
+
+    Args:
+        redshift: If True uses the Redshift connector API,
+            otherwise use the default Psycopg2 adapter.
+    """
+    # sets the connection
+    config = Config()
+    connection = Connection(redshift=redshift, config=config)
+
+    # run the pipeline
+    pipeline = IncrementalPipeline(connection, S3Loader(config), config)
+    pipeline.run()
+    connection.close()
+
+
+if __name__ == '__main__':
+    # create the command line parser
+    parser = argparse.ArgumentParser(
+        description='AWS Redshift Incremental ETL Pipeline')
+
+    # set the command line arguments
+    parser.add_argument('--redshift',
+                        help='Set the redshift connector - default: pyscopg2',
+                        type=bool,
+                        default=False)
+
+    # parse the command line arguments
+    args = parser.parse_args()
+
+    # run the pipeline
+    main(args.redshift)
@@ -0,0 +1,163 @@
+"""Defines the PrefixIndex class to persist S3 prefix listings.
+
+Listing a deeply nested prefix, such as song_data, takes many paginated
+ListObjects round-trips. The index saves the listing to a compact local
+file (gzip compressed, tab separated) and refreshes it incrementally,
+so the loaders can plan their work without listing the bucket again.
+"""
+
+# sys libs
+import os
+import gzip
+import fnmatch
+import collections
+
+# index file record
+IndexEntry = collections.namedtuple(
+    'IndexEntry', ['key', 'size', 'etag', 'last_modified'])
+
+
+def list_entries(client, bucket, prefix, start_after=None):
+    """Lists the objects of an S3 prefix as index entries.
+
+    Args:
+        client: The boto3 S3 client object.
+        bucket: The S3 bucket name.
+        prefix: The S3 object key prefix.
+        start_after: If set, only the keys sorted after it are listed.
+
+    Yields:
+        An IndexEntry object per object in key order.
+    """
+    params = {'Bucket': bucket, 'Prefix': prefix}
+    if start_after:
+        params['StartAfter'] = start_after
+
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(**params):
+        for obj in page.get('Contents', []):
+            yield IndexEntry(obj['Key'], obj['Size'], obj['ETag'],
+                             int(obj['LastModified'].timestamp()))
+
+
+class PrefixIndex:
+    """This class defines a persistent listing index of an S3 prefix.
+
+    The incremental refresh only lists the keys sorted after the last
+    indexed key, which suits prefixes that only grow, such as the
+    date named log_data files. Use a full refresh to pick up removed
+    or overwritten objects.
+
+    Usage example:
+
+    index = PrefixIndex(loader.client, 's3://udacity-dend/song_data',
+                        'song_data.idx.gz')
+    index.refresh()
+    entries = index.entries(pattern='*/A/A/*.json', max_size=4096)
+    """
+
+    def __init__(self, client, bucket_path, path):
+        """Creates the PrefixIndex object and reads the index file.
+
+        Args:
+            client: The boto3 S3 client object.
+            bucket_path: The S3 prefix path. E.g. s3://udacity-dend/log_data
+            path: The local index file path.
+        """
+        parts = bucket_path.split('/')
+
+        self.client = client
+        self.bucket = parts[2]
+        self.prefix = '/'.join(parts[3:])
+        self.path = path
+        self.records = {}
+
+        if os.path.exists(path):
+            self.load()
+
+    def load(self):
+        """Reads the index entries from the local index file."""
+        self.records = {}
+        with gzip.open(self.path, 'rt', encoding='utf-8') as file:
+            for line in file:
+                key, size, etag, last_modified = line.rstrip('\n').split('\t')
+                self.records[key] = IndexEntry(key, int(size), etag,
+                                               int(last_modified))
+
+    def save(self):
+        """Writes the index entries to the local index file.
+
+        The file is written to a temporary path and then renamed,
+        so a failed save never corrupts the previous index.
+        """
+        temp = f'{self.path}.tmp'
+        with gzip.open(temp, 'wt', encoding='utf-8') as file:
+            for entry in self.entries():
+                file.write(f'{entry.key}\t{entry.size}\t'
+                           f'{entry.etag}\t{entry.last_modified}\n')
+        os.replace(temp, self.path)
+
+    def refresh(self, full=False):
+        """Lists the S3 prefix and saves the new entries.
+
+        Args:
+            full: If True relists the whole prefix, otherwise only
+              the keys sorted after the last indexed key.
+
+        Returns:
+            The number of new or changed entries.
+        """
+        start_after = None
+        if full:
+            records = {}
+        else:
+            records = dict(self.records)
+            if records:
+                start_after = max(records)
+
+        changed = 0
+        for entry in list_entries(self.client, self.bucket, self.prefix,
+                                  start_after):
+            if self.records.get(entry.key) != entry:
+                changed += 1
+            records[entry.key] = entry
+
+        self.records = records
+        self.save()
+
+        return changed
+
+    def entries(self, pattern=None, min_size=None, max_size=None):
+        """Returns the index entries sorted by key.
+
+        Args:
+            pattern: An optional fnmatch pattern the keys must match.
+              E.g. log_data/2018/11/*.json
+            min_size: The optional minimum object size in bytes.
+            max_size: The optional maximum object size in bytes.
+
+        Returns:
+            A list of IndexEntry objects.
+        """
+        result = []
+        for key in sorted(self.records):
+            entry = self.records[key]
+
+            if pattern is not None and not fnmatch.fnmatchcase(key, pattern):
+                continue
+            if min_size is not None and entry.size < min_size:
+                continue
+            if max_size is not None and entry.size > max_size:
+                continue
+
+            result.append(entry)
+
+        return result
+
+    def total_size(self, **kwargs):
+        """Returns the total size in bytes of the filtered entries.
+
+        Args:
+            kwargs: The entries method filter arguments.
+        """
+        return sum(entry.size for entry in self.entries(**kwargs))
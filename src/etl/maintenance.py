@@ -0,0 +1,251 @@
+"""Defines the TableMaintenance class to vacuum and analyze the loaded tables.
+
+Each load appends unsorted rows, deletes rows and makes the planner
+statistics stale, so the queries on songplays and time slow down run
+after run. The maintenance stage reads the table health from the
+svv_table_info view, or from pg_stat_user_tables on a PostgreSQL
+stand-in, and only runs the VACUUM and ANALYZE statements whose
+thresholds are crossed. The statements run in autocommit mode, one at
+a time, because Redshift runs a single VACUUM per cluster.
+"""
+
+# sys libs
+import argparse
+import collections
+from timeit import default_timer as timer
+# config libs
+from config import Config
+# SQL libs
+from connection import Connection
+from dialect import PostgresConnection
+from sql_queries import SELECT_TABLE_INFO, SELECT_PG_TABLE_STATS
+from sql_queries import ANALYZE_TABLE, VACUUM_TABLE
+from sql_queries import VACUUM_SORT_ONLY, VACUUM_DELETE_ONLY
+
+# health of one table: unsorted, stats_off and deleted are percents,
+# skew_rows is the largest to smallest slice rows ratio
+TableStats = collections.namedtuple('TableStats',
+                                    ['table', 'unsorted', 'stats_off',
+                                     'skew_rows', 'deleted'])
+
+# the fact and dimension tables loaded by the pipelines
+DW_TABLES = ('songplays', 'users', 'songs', 'artists', 'time')
+
+# default thresholds, the Redshift VACUUM sorts up to 95 percent
+UNSORTED_PCT = 5.0
+STATS_OFF_PCT = 10.0
+DELETED_PCT = 5.0
+SKEW_RATIO = 4.0
+
+
+class TableMaintenance:
+    """This class defines the post-load table maintenance stage.
+
+    A table with both unsorted and deleted rows is vacuumed once with
+    a full VACUUM. The row skew cannot be fixed by a VACUUM, it is only
+    reported, since it comes from the distribution key choice.
+
+    Code usage example:
+
+    maintenance = TableMaintenance(connection, unsorted=10.0)
+    times = maintenance.run()
+
+    Usage example as python script with redshift connection:
+
+    python -m maintenance --redshift --dry-run
+    """
+
+    def __init__(self, connection, tables=DW_TABLES, unsorted=UNSORTED_PCT,
+                 stats_off=STATS_OFF_PCT, deleted=DELETED_PCT,
+                 skew=SKEW_RATIO):
+        """Creates the TableMaintenance object.
+
+        Args:
+            connection: The connection adapter wrapper.
+            tables: The names of the maintained tables.
+            unsorted: The unsorted rows percent above which
+                the table is sorted.
+            stats_off: The stale statistics percent above which
+                the table is analyzed.
+            deleted: The deleted rows percent above which
+                the table space is reclaimed.
+            skew: The slice rows ratio above which the table
+                skew is reported.
+        """
+        self.connection = connection
+        self.tables = tables
+        self.unsorted = unsorted
+        self.stats_off = stats_off
+        self.deleted = deleted
+        self.skew = skew
+
+    def statistics(self):
+        """Reads the health of the maintained tables.
+
+        Returns:
+            A dict of table name to its TableStats object. The empty
+            tables are not listed by svv_table_info.
+        """
+        query = SELECT_TABLE_INFO if self.connection.is_redshift \
+            else SELECT_PG_TABLE_STATS
+        rows = self.connection.query(query)
+        # the catalog read must not hold a transaction open
+        self.connection.rollback()
+
+        return {row[0].strip(): TableStats(row[0].strip(),
+                                           *(float(value) for value
+                                             in row[1:]))
+                for row in rows if row[0].strip() in self.tables}
+
+    def plan(self, stats):
+        """Selects the statements of the tables crossing a threshold.
+
+        Args:
+            stats: A dict of table name to its TableStats object.
+
+        Returns:
+            A list of (table, statement) tuples, the VACUUM of a
+            table before its ANALYZE.
+        """
+        redshift = self.connection.is_redshift
+        statements = []
+        for table in self.tables:
+            if table not in stats:
+                continue
+            info = stats[table]
+
+            sort = redshift and info.unsorted > self.unsorted
+            delete = info.deleted > self.deleted
+            # a full VACUUM sorts and reclaims the space at once
+            if delete and (sort or not redshift):
+                statements.append((table, VACUUM_TABLE.format(table=table)))
+            elif sort:
+                statements.append(
+                    (table, VACUUM_SORT_ONLY.format(table=table)))
+            elif delete:
+                statements.append(
+                    (table, VACUUM_DELETE_ONLY.format(table=table)))
+
+            if info.stats_off > self.stats_off:
+                statements.append((table, ANALYZE_TABLE.format(table=table)))
+
+        return statements
+
+    def run(self, dry_run=False):
+        """Runs the maintenance statements and print statistics.
+
+        Args:
+            dry_run: If True only prints the planned statements.
+
+        Returns:
+            A dict of statement to execution time in seconds.
+        """
+        print('INFO: Reading the table statistics...')
+        start = timer()
+        stats = self.statistics()
+
+        for info in stats.values():
+            print(f'INFO: {info.table} unsorted: {round(info.unsorted, 2)}%, '
+                  f'stats off: {round(info.stats_off, 2)}%, '
+                  f'deleted: {round(info.deleted, 2)}%')
+            if info.skew_rows > self.skew:
+                print(f'INFO: {info.table} rows are skewed '
+                      f'{round(info.skew_rows, 2)} times across the slices, '
+                      'review its distribution key.')
+
+        statements = self.plan(stats)
+        if dry_run:
+            for _, statement in statements:
+                print(f'INFO: Planned {statement}')
+            return {}
+
+        times = {}
+        with self.connection.autocommit():
+            for _, statement in statements:
+                print(f'INFO: Running {statement}')
+                begin = timer()
+                self.connection.execute(statement)
+                times[statement] = timer() - begin
+
+        total_time = timer() - start
+        if self.connection.metrics is not None:
+            self.connection.metrics.phase('maintenance', total_time)
+
+        # STATS: print the time statistics
+        print('-----------------------------------------------------')
+        print('Maintenance Statistics')
+        print('-----------------------------------------------------')
+        for statement, seconds in times.items():
+            print(f'{statement} time: {round(seconds, 2)} seconds')
+        print(f'Maintenance time: {round(total_time, 2)} seconds')
+
+        return times
+
+
+def main(redshift, postgres=False, dry_run=False, unsorted=UNSORTED_PCT,
+         stats_off=STATS_OFF_PCT, deleted=DELETED_PCT):
+    """The maintenance.py script entry point.
+
+    Args:
+        redshift: If True uses the Redshift connector API,
+            otherwise use the default Psycopg2 adapter.
+        postgres: If True runs on a PostgreSQL server.
+        dry_run: If True only prints the planned statements.
+        unsorted: The unsorted rows percent threshold.
+        stats_off: The stale statistics percent threshold.
+        deleted: The deleted rows percent threshold.
+    """
+    config = Config()
+    if postgres:
+        connection = PostgresConnection(config=config)
+    else:
+        connection = Connection(redshift=redshift, config=config)
+
+    print('-----------------------------------------------------')
+    print('AWS Redshift Table Maintenance')
+    print('-----------------------------------------------------')
+
+    maintenance = TableMaintenance(connection, unsorted=unsorted,
+                                   stats_off=stats_off, deleted=deleted)
+    try:
+        maintenance.run(dry_run)
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    # create the command line parser
+    parser = argparse.ArgumentParser(
+        description='AWS Redshift Table Maintenance')
+
+    # set the command line arguments
+    parser.add_argument('--redshift',
+                        help='Set the redshift connector - default: pyscopg2',
+                        type=bool,
+                        default=False)
+    parser.add_argument('--postgres',
+                        help='Run on PostgreSQL reading pg_stat_user_tables',
+                        action='store_true')
+    parser.add_argument('--dry-run',
+                        help='Only print the planned statements',
+                        action='store_true')
+    parser.add_argument('--unsorted',
+                        help='Unsorted rows percent threshold - default: 5',
+                        type=float,
+                        default=UNSORTED_PCT)
+    parser.add_argument('--stats-off',
+                        help='Stale statistics percent threshold '
+                             '- default: 10',
+                        type=float,
+                        default=STATS_OFF_PCT)
+    parser.add_argument('--deleted',
+                        help='Deleted rows percent threshold - default: 5',
+                        type=float,
+                        default=DELETED_PCT)
+
+    # parse the command line arguments
+    args = parser.parse_args()
+
+    # run the maintenance
+    main(args.redshift, args.postgres, args.dry_run, args.unsorted,
+         args.stats_off, args.deleted)
@@ -0,0 +1,49 @@
+"""Defines the functions to build and write Redshift COPY manifests.
+
+A manifest lists the exact S3 objects loaded by a COPY command, so
+a load can target new, partitioned or compacted files instead of
+every object under a prefix.
+"""
+
+# sys libs
+import os
+import json
+
+
+def build_manifest(bucket, entries):
+    """Builds a COPY manifest document.
+
+    Args:
+        bucket: The S3 bucket name.
+        entries: An iterable of IndexEntry objects.
+
+    Returns:
+        The manifest as a dict.
+    """
+    return {'entries': [{'url': f's3://{bucket}/{entry.key}',
+                         'mandatory': True,
+                         'meta': {'content_length': entry.size}}
+                        for entry in entries]}
+
+
+def write_manifest(manifest, path, loader=None):
+    """Writes a COPY manifest to a local file or to S3.
+
+    Args:
+        manifest: The manifest dict.
+        path: The local file path or the S3 path. E.g. s3://bucket/x.json
+        loader: The S3Loader object, required for S3 paths.
+
+    Returns:
+        The manifest path.
+    """
+    body = json.dumps(manifest, indent=2)
+
+    if path.startswith('s3://'):
+        loader.save_path(path, body)
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(body)
+
+    return path
@@ -0,0 +1,229 @@
+"""Defines the MetricsRecorder class to collect per-statement metrics.
+
+A Connection created with a MetricsRecorder records, for every executed
+statement attempt, its label, wall time, affected rows, scanned or
+loaded bytes, retry number and error, so the failed attempts are
+recorded too. The run can be exported as a JSON report and as
+Prometheus text-format metrics, e.g. for the node exporter textfile
+collector, to graph the pipeline performance across runs.
+"""
+
+# sys libs
+import os
+import re
+import json
+import time
+import uuid
+import threading
+import collections
+
+# per statement metric record
+StatementMetric = collections.namedtuple(
+    'StatementMetric',
+    ['label', 'seconds', 'rows', 'bytes', 'retries', 'started_at',
+     'error'])
+
+# matches the statement verb and its target table
+LABEL_PATTERN = re.compile(
+    r'^\s*(COPY|INSERT INTO|DELETE FROM|TRUNCATE TABLE|UNLOAD|'
+    r'DROP TABLE IF EXISTS|DROP TABLE|CREATE TEMP TABLE|CREATE TABLE|'
+    r'ALTER TABLE|ANALYZE|VACUUM(?: \w+ ONLY)?|SELECT|BEGIN|SET)\s*(\w*)',
+    re.IGNORECASE)
+
+
+def statement_label(query):
+    """Builds a short metric label from a SQL statement.
+
+    Args:
+        query: The SQL statement.
+
+    Returns:
+        The lower case verb and table. E.g. 'copy staging_events'
+    """
+    match = LABEL_PATTERN.match(query)
+    if match is None:
+        return query.split(None, 1)[0].lower() if query.strip() else 'empty'
+
+    verb = match.group(1).lower().replace(' if exists', '')
+    verb = {'insert into': 'insert', 'delete from': 'delete',
+            'truncate table': 'truncate', 'drop table': 'drop',
+            'create table': 'create', 'create temp table': 'create',
+            'alter table': 'alter'}.get(verb, verb)
+
+    table = match.group(2).lower()
+    if verb == 'select' or table in ('from', ''):
+        return verb
+
+    return f'{verb} {table}'
+
+
+class MetricsRecorder:
+    """This class defines a thread-safe recorder of pipeline metrics.
+
+    Usage example:
+
+    metrics = MetricsRecorder()
+    connection = Connection(metrics=metrics)
+    ETLPipeline(connection).run()
+    metrics.write_json('metrics/etl.json')
+    metrics.write_prometheus('metrics/etl.prom')
+    """
+
+    def __init__(self, pipeline='etl', run_id=None):
+        """Creates the MetricsRecorder object.
+
+        Args:
+            pipeline: The pipeline name added to the metrics.
+            run_id: The run identifier. If None, a random one is used.
+        """
+        self.pipeline = pipeline
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.started_at = time.time()
+        self.statements = []
+        self.phases = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def record(self, label, seconds, rows=None, bytes_=None, retries=0,
+               error=None):
+        """Records one statement attempt.
+
+        Args:
+            label: The statement label. E.g. copy staging_events
+            seconds: The statement wall time.
+            rows: The affected or loaded rows, if known.
+            bytes_: The scanned or loaded bytes, if known.
+            retries: The retry number of the attempt, 0 for the first.
+            error: The exception class name of a failed attempt.
+        """
+        metric = StatementMetric(label, seconds, rows, bytes_, retries,
+                                 time.time() - seconds, error)
+        with self.lock:
+            self.statements.append(metric)
+
+    def phase(self, name, seconds):
+        """Records the wall time of a pipeline phase.
+
+        Args:
+            name: The phase name. E.g. load
+            seconds: The phase wall time.
+        """
+        with self.lock:
+            self.phases[name] = seconds
+
+    def report(self):
+        """Builds the run report.
+
+        Returns:
+            A JSON serializable dict.
+        """
+        with self.lock:
+            statements = [metric._asdict() for metric in self.statements]
+            phases = dict(self.phases)
+
+        return {'pipeline': self.pipeline,
+                'run_id': self.run_id,
+                'started_at': self.started_at,
+                'seconds': time.time() - self.started_at,
+                'phases': phases,
+                'statements': statements}
+
+    def write_json(self, path):
+        """Writes the run report as a JSON file.
+
+        Args:
+            path: The local file path.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.report(), file, indent=2)
+
+    def prometheus(self):
+        """Formats the run metrics in the Prometheus text format.
+
+        Statements sharing a label are summed.
+
+        Returns:
+            The metrics text.
+        """
+        report = self.report()
+        base = f'pipeline="{self.pipeline}"'
+
+        totals = collections.OrderedDict()
+        for metric in report['statements']:
+            total = totals.setdefault(metric['label'], collections.Counter())
+            total['seconds'] += metric['seconds']
+            total['rows'] += metric['rows'] or 0
+            total['bytes'] += metric['bytes'] or 0
+            total['retries'] += metric['retries'] > 0
+            total['failures'] += metric['error'] is not None
+            total['count'] += 1
+
+        lines = []
+        for name, kind, help_text in (
+                ('seconds', 'gauge', 'Statement wall time in seconds.'),
+                ('rows', 'gauge', 'Rows affected or loaded by the statement.'),
+                ('bytes', 'gauge', 'Bytes scanned or loaded by the statement.'),
+                ('retries', 'gauge', 'Retried statement attempts.'),
+                ('failures', 'gauge', 'Failed statement attempts.'),
+                ('count', 'gauge', 'Executed statement attempts.')):
+            lines.append(f'# HELP etl_statement_{name} {help_text}')
+            lines.append(f'# TYPE etl_statement_{name} {kind}')
+            for label, total in totals.items():
+                lines.append(f'etl_statement_{name}{{{base},'
+                             f'statement="{label}"}} {total[name]}')
+
+        lines.append('# HELP etl_phase_seconds Pipeline phase wall time '
+                     'in seconds.')
+        lines.append('# TYPE etl_phase_seconds gauge')
+        for phase, seconds in report['phases'].items():
+            lines.append(f'etl_phase_seconds{{{base},phase="{phase}"}} '
+                         f'{seconds}')
+
+        lines.append('# HELP etl_run_seconds Pipeline run wall time '
+                     'in seconds.')
+        lines.append('# TYPE etl_run_seconds gauge')
+        lines.append(f'etl_run_seconds{{{base}}} {report["seconds"]}')
+
+        lines.append('# HELP etl_run_timestamp_seconds Pipeline run start '
+                     'time.')
+        lines.append('# TYPE etl_run_timestamp_seconds gauge')
+        lines.append(f'etl_run_timestamp_seconds{{{base}}} '
+                     f'{report["started_at"]}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Writes the Prometheus metrics to a text file.
+
+        The file is written to a temporary path and then renamed,
+        as the textfile collector expects.
+
+        Args:
+            path: The local file path. E.g. metrics/etl.prom
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp = f'{path}.tmp'
+        with open(temp, 'w', encoding='utf-8') as file:
+            file.write(self.prometheus())
+        os.replace(temp, path)
+
+    def write_reports(self, directory):
+        """Writes the JSON report and the Prometheus metrics of the run.
+
+        The JSON file is kept per run, the Prometheus file holds the
+        latest run of the pipeline.
+
+        Args:
+            directory: The local reports directory.
+
+        Returns:
+            A (json_path, prometheus_path) tuple.
+        """
+        json_path = os.path.join(directory,
+                                 f'{self.pipeline}-{self.run_id}.json')
+        prometheus_path = os.path.join(directory, f'{self.pipeline}.prom')
+
+        self.write_json(json_path)
+        self.write_prometheus(prometheus_path)
+
+        return json_path, prometheus_path
@@ -0,0 +1,262 @@
+"""Defines the SchemaMigration class to apply only the changed table DDL.
+
+The declared tables are the CREATE TABLE statements of the sql_queries
+module. They are compared to the information_schema catalog, and to the
+pg_table_def distribution and sort keys on Redshift, so a deploy only
+creates the missing tables, adds or drops the changed columns and
+rebuilds the tables whose column types or keys changed. The unchanged
+tables are not touched and keep their data.
+"""
+
+# sys libs
+import re
+import collections
+# data libs
+from schema import parse_columns
+# SQL libs
+from sql_queries import CREATE_TABLE_QUERIES
+from sql_queries import SELECT_TABLE_COLUMNS, SELECT_TABLE_KEYS
+from sql_queries import ALTER_TABLE_ADD_COLUMN, ALTER_TABLE_DROP_COLUMN
+from sql_queries import ALTER_TABLE_RENAME, INSERT_TABLE_REBUILD
+from sql_queries import DROP_TABLE_REBUILD
+
+# planned change of one table, action is create, alter or rebuild
+Migration = collections.namedtuple('Migration',
+                                   ['table', 'action', 'queries'])
+
+# declared column: name, SQL type, (precision, scale), flags
+Column = collections.namedtuple('Column',
+                                ['name', 'sql_type', 'size', 'not_null',
+                                 'sortkey', 'distkey'])
+
+TABLE_PATTERN = re.compile(r'CREATE TABLE\s+(?:IF NOT EXISTS\s+)?(\w+)',
+                           re.IGNORECASE)
+
+# SQL type names, declared or from the catalog, to a common type name
+TYPE_FAMILIES = {
+    'TEXT': 'varchar', 'VARCHAR': 'varchar', 'CHARACTER VARYING': 'varchar',
+    'CHAR': 'char', 'CHARACTER': 'char', 'BPCHAR': 'char',
+    'SMALLINT': 'int2', 'INT2': 'int2',
+    'INTEGER': 'int4', 'INT': 'int4', 'INT4': 'int4',
+    'BIGINT': 'int8', 'INT8': 'int8',
+    'REAL': 'float4', 'FLOAT4': 'float4',
+    'FLOAT': 'float8', 'FLOAT8': 'float8', 'DOUBLE PRECISION': 'float8',
+    'DECIMAL': 'numeric', 'NUMERIC': 'numeric',
+    'BOOLEAN': 'bool', 'BOOL': 'bool',
+    'TIMESTAMP': 'timestamp', 'TIMESTAMP WITHOUT TIME ZONE': 'timestamp',
+    'DATE': 'date',
+}
+
+
+def type_key(sql_type, precision=None, scale=None):
+    """Builds a comparable key of a column type.
+
+    The TEXT columns are stored as VARCHAR(256) by Redshift, so the
+    character lengths are not compared. The DECIMAL precision and
+    scale are.
+
+    Args:
+        sql_type: The SQL type name. E.g. DOUBLE PRECISION
+        precision: The DECIMAL/NUMERIC precision.
+        scale: The DECIMAL/NUMERIC scale.
+
+    Returns:
+        A tuple. E.g. ('numeric', 13, 0)
+    """
+    family = TYPE_FAMILIES.get(sql_type.upper(), sql_type.lower())
+    if family == 'numeric':
+        return family, precision, scale or 0
+    return (family,)
+
+
+def type_name(column):
+    """Formats the declared SQL type of a column. E.g. NUMERIC(2)"""
+    precision, scale = column.size
+    if precision is None:
+        return column.sql_type
+    if scale is None:
+        return f'{column.sql_type}({precision})'
+    return f'{column.sql_type}({precision},{scale})'
+
+
+def declared_tables(queries=None):
+    """Parses the declared tables of CREATE TABLE statements.
+
+    Args:
+        queries: The CREATE TABLE statements.
+            Defaults to CREATE_TABLE_QUERIES.
+
+    Returns:
+        An ordered dict of table name to a (ddl, columns) tuple,
+        columns is a list of Column objects.
+    """
+    tables = collections.OrderedDict()
+    for ddl in queries or CREATE_TABLE_QUERIES:
+        table = TABLE_PATTERN.search(ddl).group(1).lower()
+        lines = {line.split()[0].lower(): line.lower()
+                 for line in ddl.splitlines() if line.strip()}
+
+        columns = []
+        for name, sql_type, precision, scale in parse_columns(ddl):
+            line = lines[name.lower()]
+            columns.append(Column(name.lower(), sql_type, (precision, scale),
+                                  'not null' in line,
+                                  re.search(r'\bsortkey\b', line) is not None,
+                                  re.search(r'\bdistkey\b', line) is not None))
+
+        tables[table] = (ddl, columns)
+
+    return tables
+
+
+class SchemaMigration:
+    """This class defines the idempotent schema migration.
+
+    Running it twice in a row changes nothing the second time. The
+    sort and distribution keys of a table are only compared when its
+    DDL declares that kind of key, so a key dropped from the DDL is
+    left as it is on the cluster.
+
+    Usage example:
+
+    migration = SchemaMigration(connection)
+    for change in migration.plan():
+        print(change.table, change.action)
+    migration.apply()
+    """
+
+    def __init__(self, connection, queries=None):
+        """Creates the SchemaMigration object.
+
+        Args:
+            connection: The connection adapter wrapper.
+            queries: The declared CREATE TABLE statements.
+                Defaults to CREATE_TABLE_QUERIES.
+        """
+        self.connection = connection
+        self.tables = declared_tables(queries)
+
+    def catalog(self):
+        """Reads the current columns and keys of the schema tables.
+
+        Returns:
+            A dict of table name to an ordered dict of column name
+            to a (type_key, sortkey, distkey) tuple.
+        """
+        catalog = collections.defaultdict(collections.OrderedDict)
+        for table, column, data_type, precision, scale in \
+                self.connection.query(SELECT_TABLE_COLUMNS):
+            if table not in self.tables:
+                continue
+            catalog[table][column] = [type_key(data_type, precision, scale),
+                                      False, False]
+
+        # the keys are only known on Redshift
+        if self.connection.is_redshift:
+            for table, column, distkey, sortkey in \
+                    self.connection.query(SELECT_TABLE_KEYS):
+                if column in catalog.get(table, {}):
+                    catalog[table][column][1:] = [bool(sortkey), bool(distkey)]
+
+        return {table: {column: tuple(value) for column, value in
+                        columns.items()} for table, columns in catalog.items()}
+
+    def __rebuild(self, table, ddl, columns, current):
+        """Builds the statements copying a table into its new definition.
+
+        The new table is created under a temporary name and renamed
+        after the old one is dropped, so the constraint names of both
+        tables never clash. A new NOT NULL column makes the copy fail
+        and roll back unless the table is empty.
+
+        Args:
+            table: The table name.
+            ddl: The declared CREATE TABLE statement.
+            columns: The declared Column objects.
+            current: The catalog columns of the table.
+
+        Returns:
+            A list of SQL statements.
+        """
+        target = f'{table}_migrate'
+        kept = [column for column in columns if column.name in current]
+
+        queries = [TABLE_PATTERN.sub(f'CREATE TABLE {target}', ddl, count=1)]
+        if kept:
+            queries.append(INSERT_TABLE_REBUILD.format(
+                table=target,
+                columns=', '.join(column.name for column in kept),
+                values=', '.join(f'CAST ({column.name} AS {type_name(column)})'
+                                 for column in kept),
+                source=table))
+        queries.append(DROP_TABLE_REBUILD.format(table=table))
+        queries.append(ALTER_TABLE_RENAME.format(table=target, name=table))
+
+        return queries
+
+    def plan(self):
+        """Compares the declared tables to the catalog.
+
+        Returns:
+            A list of Migration objects of the changed tables,
+            in the declared order.
+        """
+        catalog = self.catalog()
+        is_redshift = self.connection.is_redshift
+
+        changes = []
+        for table, (ddl, columns) in self.tables.items():
+            current = catalog.get(table)
+            if current is None:
+                changes.append(Migration(table, 'create', [ddl]))
+                continue
+
+            declared = {column.name: column for column in columns}
+            added = [column for column in columns if column.name not in current]
+            dropped = [name for name in current if name not in declared]
+
+            # Redshift may set AUTO keys on the tables declaring none,
+            # so only the declared kinds of keys are compared
+            sorted_table = is_redshift and any(column.sortkey
+                                               for column in columns)
+            distributed = is_redshift and any(column.distkey
+                                              for column in columns)
+
+            # type or key changes need a new table
+            rebuild = any(
+                current[column.name][0] != type_key(column.sql_type,
+                                                    *column.size)
+                or (sorted_table and current[column.name][1] !=
+                    column.sortkey)
+                or (distributed and current[column.name][2] !=
+                    column.distkey)
+                for column in columns if column.name in current)
+
+            # new keys or NOT NULL columns without default can not be added
+            rebuild = rebuild or any(column.not_null or column.sortkey
+                                     or column.distkey for column in added)
+
+            if rebuild:
+                changes.append(Migration(
+                    table, 'rebuild',
+                    self.__rebuild(table, ddl, columns, current)))
+            elif added or dropped:
+                queries = [ALTER_TABLE_ADD_COLUMN.format(
+                    table=table, column=column.name, type=type_name(column))
+                    for column in added]
+                queries += [ALTER_TABLE_DROP_COLUMN.format(
+                    table=table, column=name) for name in dropped]
+                changes.append(Migration(table, 'alter', queries))
+
+        return changes
+
+    def apply(self):
+        """Applies the planned changes, one transaction per table.
+
+        Returns:
+            The list of applied Migration objects.
+        """
+        changes = self.plan()
+        for change in changes:
+            self.connection.execute_batch(change.queries)
+        return changes
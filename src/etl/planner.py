@@ -0,0 +1,465 @@
+"""Defines the CopyPlanner class to load the log data by partition.
+
+COPY_STAGING_EVENTS loads the whole log_data prefix in one statement.
+The planner splits the date named log files into partitions, by the
+log_data/YYYY/MM key layout or into bins of balanced byte size, writes
+one COPY manifest per partition and loads the partitions from
+concurrent sessions. A date window only lists the months it covers and
+only replaces the staging rows of its days, so a backfill leaves the
+other partitions untouched. A load without window replaces the whole
+table. The plan and the manifests need no database connection, so a
+dry run previews them with S3 access only.
+"""
+
+# sys libs
+import re
+import heapq
+import argparse
+import collections
+from datetime import date, datetime, timedelta, timezone
+from timeit import default_timer as timer
+# config libs
+from config import Config
+# AWS libs
+from s3 import S3Loader
+from index import list_entries
+from manifest import build_manifest, write_manifest
+# SQL libs
+from connection import Connection
+from pool import ConnectionPool
+from scheduler import DagScheduler, Step
+# the COPY statements are rendered on first use, not on import
+import sql_queries
+from sql_queries import CREATE_TABLE_STAGING_EVENTS_PARTITION
+from sql_queries import DROP_TABLE_STAGING_EVENTS_PARTITION
+from sql_queries import DELETE_STAGING_EVENTS_WINDOW
+from sql_queries import DELETE_STAGING_EVENTS_ALL
+from sql_queries import INSERT_STAGING_EVENTS_PARTITION
+
+# planned COPY: name is the partition name, entries its IndexEntry objects
+Partition = collections.namedtuple('Partition', ['name', 'entries'])
+
+# day of a log file name. E.g. log_data/2018/11/2018-11-05-events.json
+LOG_DATE_PATTERN = re.compile(r'(\d{4})-(\d{2})-(\d{2})[^/]*$')
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def log_date(key):
+    """Parses the day of a log file key.
+
+    Args:
+        key: The S3 object key.
+
+    Returns:
+        A date object or None if the file name has no date.
+    """
+    match = LOG_DATE_PATTERN.search(key)
+    if match is None:
+        return None
+    return date(*map(int, match.groups()))
+
+
+def epoch_ms(day):
+    """Converts a day to the staging_events ts of its UTC midnight."""
+    moment = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+    return int((moment - EPOCH).total_seconds()) * 1000
+
+
+def month_prefixes(prefix, start, end):
+    """Builds the log_data/YYYY/MM/ prefixes of a date window.
+
+    Args:
+        prefix: The log data key prefix. E.g. log_data
+        start: The first day of the window.
+        end: The day after the window.
+
+    Returns:
+        A list of key prefixes, one per month.
+    """
+    prefixes = []
+    year, month = start.year, start.month
+    while date(year, month, 1) < end:
+        prefixes.append(f'{prefix.rstrip("/")}/{year:04d}/{month:02d}/')
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return prefixes
+
+
+def partition_by_month(entries):
+    """Groups the log files by the month of their name.
+
+    Args:
+        entries: An iterable of IndexEntry objects.
+
+    Returns:
+        A list of Partition objects named YYYY_MM, in month order.
+        The files without a date are grouped as undated. They are
+        only listed without a date window, whose load replaces every
+        staging row.
+    """
+    groups = collections.defaultdict(list)
+    for entry in entries:
+        day = log_date(entry.key)
+        groups[f'{day:%Y_%m}' if day else 'undated'].append(entry)
+
+    return [Partition(name, groups[name]) for name in sorted(groups)]
+
+
+def partition_by_size(entries, partitions):
+    """Spreads the log files over bins of balanced byte size.
+
+    The largest files are placed first, each into the lightest bin,
+    so the bins differ by at most the size of one file.
+
+    Args:
+        entries: An iterable of IndexEntry objects.
+        partitions: The number of bins.
+
+    Returns:
+        A list of non empty Partition objects named p0, p1... with
+        their files in key order.
+    """
+    bins = [(0, index, []) for index in range(partitions)]
+    for entry in sorted(entries, key=lambda entry: -entry.size):
+        size, index, files = heapq.heappop(bins)
+        files.append(entry)
+        heapq.heappush(bins, (size + entry.size, index, files))
+
+    return [Partition(f'p{index}', sorted(files))
+            for _, index, files in sorted(bins, key=lambda item: item[1])
+            if files]
+
+
+class CopyPlanner:
+    """This class defines the partitioned staging_events loader.
+
+    Each partition is copied into its own table, concurrent COPYs into
+    staging_events would wait on its write lock. The partition tables
+    are then appended to staging_events in one transaction that first
+    deletes the rows of the loaded days, so a failed or repeated run
+    never leaves a day loaded twice or half loaded.
+
+    Code usage example:
+
+    config = Config()
+    pool = ConnectionPool(max_size=4)
+    planner = CopyPlanner(Connection(), S3Loader(config), config, pool)
+    planner.run(by='month', start=date(2018, 11, 5), end=date(2018, 11, 8))
+
+    Usage example as python script backfilling three days:
+
+    python -m planner --start 2018-11-05 --end 2018-11-08 --parallel 4
+    """
+
+    def __init__(self, connection, loader, config, pool=None, max_workers=4):
+        """Creates the CopyPlanner object.
+
+        Args:
+            connection: The connection adapter wrapper. None for
+                a dry run, which only plans and writes the manifests.
+            loader: The S3Loader object used to list the log data
+                and write the manifests.
+            config: The dwh.cfg file wrapper object.
+            pool: An optional ConnectionPool object. If None, the
+                partitions are copied one after another.
+            max_workers: The maximum number of concurrent COPYs.
+        """
+        self.connection = connection
+        self.loader = loader
+        self.config = config
+        self.pool = pool
+        self.max_workers = max_workers
+
+        path = config.get('S3', 'LOG_DATA').split('/')
+        self.bucket, self.prefix = path[2], '/'.join(path[3:])
+
+    def entries(self, start=None, end=None):
+        """Lists the log files of a date window.
+
+        Args:
+            start: The first day of the window, None for no lower bound.
+            end: The day after the window, None for no upper bound.
+
+        Returns:
+            A list of IndexEntry objects in key order. The files
+            without a date are only listed when there is no window.
+        """
+        if start is not None and end is not None:
+            prefixes = month_prefixes(self.prefix, start, end)
+        else:
+            prefixes = [self.prefix]
+
+        entries = []
+        for prefix in prefixes:
+            for entry in list_entries(self.loader.client, self.bucket, prefix):
+                if not entry.key.endswith('.json'):
+                    continue
+
+                day = log_date(entry.key)
+                if start is not None or end is not None:
+                    if day is None or (start is not None and day < start) \
+                            or (end is not None and day >= end):
+                        continue
+
+                entries.append(entry)
+
+        return entries
+
+    def plan(self, by='month', partitions=4, start=None, end=None):
+        """Splits the log files of a date window into partitions.
+
+        Args:
+            by: The partitioning, month or size.
+            partitions: The number of size partitions.
+            start: The first day of the window.
+            end: The day after the window.
+
+        Returns:
+            A list of Partition objects.
+        """
+        entries = self.entries(start, end)
+        if by == 'month':
+            return partition_by_month(entries)
+        if by == 'size':
+            return partition_by_size(entries, partitions)
+
+        raise ValueError(f'unknown partitioning: {by}')
+
+    def write(self, partitions, directory=None):
+        """Writes one COPY manifest per partition.
+
+        Args:
+            partitions: A list of Partition objects.
+            directory: The local or S3 manifests folder. Defaults to
+                a new folder under the STAGING S3 path.
+
+        Returns:
+            A list of manifest paths in the partitions order.
+        """
+        if directory is None:
+            stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+            directory = f"{self.config.get('S3', 'STAGING')}/manifests/" \
+                        f"partitions-{stamp}"
+
+        return [write_manifest(build_manifest(self.bucket, partition.entries),
+                               f'{directory.rstrip("/")}/'
+                               f'log_data-{partition.name}.manifest',
+                               self.loader)
+                for partition in partitions]
+
+    @staticmethod
+    def window(partitions, start=None, end=None):
+        """Computes the ts range replaced by a load.
+
+        Args:
+            partitions: The loaded Partition objects.
+            start: The first day of the requested window.
+            end: The day after the requested window.
+
+        Returns:
+            A (start, end) tuple of epoch ms, the days of the loaded
+            files fill in the open window bounds. None if no file
+            is named by day.
+        """
+        days = [log_date(entry.key) for partition in partitions
+                for entry in partition.entries]
+        days = [day for day in days if day is not None]
+        if not days:
+            return None
+
+        start = start or min(days)
+        end = end or max(days) + timedelta(days=1)
+
+        return epoch_ms(start), epoch_ms(end)
+
+    def __copy(self, steps):
+        """Runs the partition COPY steps.
+
+        Args:
+            steps: A list of Step objects.
+        """
+        if self.pool is None or self.max_workers < 2:
+            for step in steps:
+                with self.connection.transaction():
+                    self.connection.execute(step.query)
+        else:
+            DagScheduler(self.pool, self.max_workers).run(steps)
+
+    def load(self, partitions, manifests, start=None, end=None):
+        """Copies the partitions and replaces their days in staging_events.
+
+        Without a window every staging row is replaced, since the rows
+        of the undated files cannot be told apart by their ts.
+
+        Args:
+            partitions: A list of Partition objects.
+            manifests: The manifest path of each partition.
+            start: The first day of the requested window.
+            end: The day after the requested window.
+        """
+        tables = [f'staging_events_{partition.name}'
+                  for partition in partitions]
+
+        for table in tables:
+            self.connection.execute_batch([
+                DROP_TABLE_STAGING_EVENTS_PARTITION.format(table=table),
+                CREATE_TABLE_STAGING_EVENTS_PARTITION.format(table=table)])
+
+        try:
+            copy = sql_queries.COPY_STAGING_EVENTS_PARTITION
+            self.__copy([Step(table, copy.format(table=table,
+                                                 manifest=manifest), ())
+                         for table, manifest in zip(tables, manifests)])
+
+            queries = [INSERT_STAGING_EVENTS_PARTITION.format(table=table)
+                       for table in tables]
+            if start is None and end is None:
+                queries.insert(0, DELETE_STAGING_EVENTS_ALL)
+            else:
+                window = self.window(partitions, start, end)
+                queries.insert(0, DELETE_STAGING_EVENTS_WINDOW.format(
+                    start=window[0], end=window[1]))
+            self.connection.execute_batch(queries)
+        finally:
+            self.connection.execute_batch(
+                [DROP_TABLE_STAGING_EVENTS_PARTITION.format(table=table)
+                 for table in tables])
+
+    def run(self, by='month', partitions=4, start=None, end=None,
+            directory=None, dry_run=False):
+        """Plans, writes and loads the partitions and print statistics.
+
+        Args:
+            by: The partitioning, month or size.
+            partitions: The number of size partitions.
+            start: The first day of the window.
+            end: The day after the window.
+            directory: The local or S3 manifests folder.
+            dry_run: If True only writes the manifests.
+
+        Returns:
+            The list of loaded Partition objects.
+        """
+        # HEADER: print the pipeline header
+        print('-----------------------------------------------------')
+        print('AWS Redshift Partitioned COPY Planner')
+        print('-----------------------------------------------------')
+
+        print('INFO: Planning log data partitions...')
+        start_time = timer()
+        planned = self.plan(by, partitions, start, end)
+        if not planned:
+            print('INFO: No log data in the window.')
+            return planned
+
+        manifests = self.write(planned, directory)
+        plan_time = timer() - start_time
+        for partition, manifest in zip(planned, manifests):
+            print(f'INFO: {partition.name}: {len(partition.entries)} files, '
+                  f'{sum(entry.size for entry in partition.entries)} '
+                  f'bytes -> {manifest}')
+
+        if dry_run:
+            return planned
+
+        print('INFO: Loading partitions...')
+        start_time = timer()
+        self.load(planned, manifests, start, end)
+        load_time = timer() - start_time
+        print('INFO: Staging events loaded.')
+
+        if self.connection.metrics is not None:
+            self.connection.metrics.phase('plan', plan_time)
+            self.connection.metrics.phase('load', load_time)
+
+        # STATS: print the time statistics
+        print('-----------------------------------------------------')
+        print('Time Statistics')
+        print('-----------------------------------------------------')
+        print(f'Plan time: {round(plan_time, 2)} seconds')
+        print(f'Load time: {round(load_time, 2)} seconds')
+
+        return planned
+
+
+def main(redshift, by='month', partitions=4, start=None, end=None,
+         parallel=0, manifests=None, dry_run=False):
+    """The planner.py script entry point.
+
+    Args:
+        redshift: If True uses the Redshift connector API,
+            otherwise use the default Psycopg2 adapter.
+        by: The partitioning, month or size.
+        partitions: The number of size partitions.
+        start: The first day of the window. E.g. 2018-11-05
+        end: The day after the window. E.g. 2018-11-08
+        parallel: The maximum number of concurrent COPYs.
+            If lower than 2, the partitions load one after another.
+        manifests: The local or S3 manifests folder.
+        dry_run: If True only writes the manifests.
+    """
+    start = date.fromisoformat(start) if start else None
+    end = date.fromisoformat(end) if end else None
+
+    # a dry run only reads S3, it needs no cluster access
+    config = Config()
+    connection = None
+    if not dry_run:
+        connection = Connection(redshift=redshift, config=config)
+    pool = None
+    if parallel > 1 and not dry_run:
+        pool = ConnectionPool(redshift=redshift, min_size=0,
+                              max_size=parallel, config=config)
+
+    # run the planner
+    planner = CopyPlanner(connection, S3Loader(config), config, pool=pool,
+                          max_workers=parallel)
+    planner.run(by, partitions, start, end, manifests, dry_run)
+    if connection is not None:
+        connection.close()
+    if pool is not None:
+        pool.close()
+
+
+if __name__ == '__main__':
+    # create the command line parser
+    parser = argparse.ArgumentParser(
+        description='AWS Redshift Partitioned COPY Planner')
+
+    # set the command line arguments
+    parser.add_argument('--redshift',
+                        help='Set the redshift connector - default: pyscopg2',
+                        type=bool,
+                        default=False)
+    parser.add_argument('--by',
+                        help='Partition by month or by size - default: month',
+                        choices=['month', 'size'],
+                        default='month')
+    parser.add_argument('--partitions',
+                        help='Number of size partitions - default: 4',
+                        type=int,
+                        default=4)
+    parser.add_argument('--start',
+                        help='First day of the window. E.g. 2018-11-05',
+                        default=None)
+    parser.add_argument('--end',
+                        help='Day after the window. E.g. 2018-11-08',
+                        default=None)
+    parser.add_argument('--parallel',
+                        help='Max concurrent COPYs - default: 0',
+                        type=int,
+                        default=0)
+    parser.add_argument('--manifests',
+                        help='Local or S3 manifests folder '
+                             '- default: STAGING/manifests',
+                        default=None)
+    parser.add_argument('--dry-run',
+                        help='Only write the manifests',
+                        action='store_true')
+
+    # parse the command line arguments
+    args = parser.parse_args()
+
+    # run the planner
+    main(args.redshift, args.by, args.partitions, args.start, args.end,
+         args.parallel, args.manifests, args.dry_run)
@@ -0,0 +1,215 @@
+"""Defines a ConnectionPool class to share warm database connections.
+
+Opening a Redshift connection pays the TLS handshake and the
+authentication round-trips. The pool keeps a bounded set of open
+Connection objects that the pipelines and the notebooks check out
+and give back, instead of connecting from scratch every time.
+"""
+
+# sys libs
+import time
+import threading
+import contextlib
+import collections
+# config libs
+from config import Config
+# SQL libs
+from connection import Connection
+
+
+class ConnectionPool:
+    """This class defines a thread-safe pool of Connection objects.
+
+    Connections are health checked on checkout, rolled back on return
+    and closed after staying idle longer than idle_timeout seconds,
+    down to min_size connections.
+
+    Usage example:
+
+    pool = ConnectionPool(redshift=True, min_size=1, max_size=4)
+
+    with pool.connection() as connection:
+        SchemaPipeline(connection).run()
+
+    with pool.connection() as connection:
+        ETLPipeline(connection).run()
+
+    pool.close()
+    """
+
+    def __init__(self, redshift=False, min_size=1, max_size=4,
+                 idle_timeout=300, config=None, metrics=None):
+        """Creates the ConnectionPool object and opens min_size connections.
+
+        Args:
+            redshift: If True uses the Redshift connector API,
+                otherwise use the default Psycopg2 adapter.
+            min_size: The number of connections kept open.
+            max_size: The maximum number of open connections.
+            idle_timeout: The seconds after which an idle connection
+                above min_size is closed.
+            config: An optional Config object shared by all connections.
+            metrics: An optional MetricsRecorder object shared by
+                all connections.
+        """
+        if not 0 <= min_size <= max_size or max_size < 1:
+            raise ValueError('expected 0 <= min_size <= max_size and '
+                             'max_size >= 1')
+
+        self.redshift = redshift
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.config = config or Config()
+        self.metrics = metrics
+
+        self.condition = threading.Condition()
+        # (connection, released_at) tuples, the warmest at the end
+        self.idle = collections.deque()
+        # number of open connections, idle and checked out
+        self.size = 0
+        self.closed = False
+
+        for _ in range(min_size):
+            self.size += 1
+            self.idle.append((self.__open(), time.monotonic()))
+
+    def __open(self):
+        """Opens a new Connection object."""
+        return Connection(redshift=self.redshift, config=self.config,
+                          metrics=self.metrics)
+
+    @staticmethod
+    def __discard(connection):
+        """Closes a connection ignoring the already broken ones.
+
+        Args:
+            connection: The Connection object.
+        """
+        try:
+            connection.close()
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+    def __prune(self):
+        """Closes the expired idle connections above min_size.
+
+        Must be called with the condition lock held.
+        """
+        now = time.monotonic()
+        while (self.idle and self.size > self.min_size
+               and now - self.idle[0][1] > self.idle_timeout):
+            connection, _ = self.idle.popleft()
+            self.size -= 1
+            self.__discard(connection)
+
+    def acquire(self, timeout=None):
+        """Checks out a healthy connection.
+
+        Args:
+            timeout: The maximum seconds to wait for a free connection.
+                If None, waits forever.
+
+        Returns:
+            A Connection object.
+
+        Raises:
+            TimeoutError: If no connection was freed within timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self.condition:
+            while True:
+                if self.closed:
+                    raise RuntimeError('the connection pool is closed')
+
+                self.__prune()
+
+                if self.idle:
+                    connection, _ = self.idle.pop()
+                    break
+
+                if self.size < self.max_size:
+                    # reserve the slot and connect outside the lock
+                    self.size += 1
+                    connection = None
+                    break
+
+                remaining = None if deadline is None \
+                    else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError('no free connection in the pool')
+                self.condition.wait(remaining)
+
+        if connection is not None and connection.ping():
+            return connection
+
+        if connection is not None:
+            self.__discard(connection)
+
+        try:
+            return self.__open()
+        except Exception:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, connection, discard=False):
+        """Gives a connection back to the pool.
+
+        Pending transactions are rolled back, so the next
+        checkout starts from a clean session.
+
+        Args:
+            connection: The Connection object.
+            discard: If True closes the connection instead.
+        """
+        if not discard:
+            try:
+                connection.rollback()
+            except Exception:  # pylint: disable=broad-except
+                discard = True
+
+        with self.condition:
+            if discard or self.closed:
+                self.size -= 1
+                self.__discard(connection)
+            else:
+                self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        """Checks out a connection for the duration of a with block.
+
+        Args:
+            timeout: The maximum seconds to wait for a free connection.
+
+        Yields:
+            A Connection object.
+        """
+        connection = self.acquire(timeout)
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self):
+        """Closes the idle connections and refuses new checkouts.
+
+        Checked out connections are closed when released.
+        """
+        with self.condition:
+            self.closed = True
+            while self.idle:
+                connection, _ = self.idle.popleft()
+                self.size -= 1
+                self.__discard(connection)
+            self.condition.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
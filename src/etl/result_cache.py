@@ -0,0 +1,242 @@
+"""Defines the QueryCache class to serve repeated analytical query results.
+
+The DW tables only change when a pipeline run finishes, and each
+successful run bumps the load generation of the etl_generation table,
+which the table rebuilds keep, so a generation is never reused.
+The results are cached on the local disk keyed by the normalized SQL,
+its parameters and the load generation, so a new load invalidates the
+cached results without any explicit call. The entries are parquet
+files when pyarrow is installed, otherwise pickled DataFrames.
+"""
+
+# sys libs
+import re
+import json
+import time
+import pickle
+import hashlib
+# data libs
+import pandas as pd
+from cache import DiskCache, MAX_BYTES
+# SQL libs
+from sql_queries import SELECT_ETL_GENERATION
+
+# optional columnar storage format
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# single quoted literals, double quoted names, comments and the rest
+SQL_TOKEN_PATTERN = re.compile(
+    r"('(?:[^']|'')*')|(\"[^\"]*\")|(--[^\n]*|/\*.*?\*/)|([^'\"/-]+|[/-])",
+    re.DOTALL)
+
+# parquet schema metadata key of the entry creation time
+CREATED_KEY = b'etl.created'
+# default seconds a read load generation is trusted, so a cache hit
+# only reads the generation from the cluster once per period
+REFRESH_SECONDS = 60.0
+
+
+def normalize_sql(query):
+    """Normalizes a SQL statement for the cache key.
+
+    The comments are removed, the whitespace is collapsed and the
+    keywords and names are lower cased. The quoted literals and
+    names are kept as they are.
+
+    Args:
+        query: The SQL statement.
+
+    Returns:
+        The normalized statement without the trailing semicolon.
+    """
+    parts = []
+    for literal, name, comment, text in SQL_TOKEN_PATTERN.findall(query):
+        if comment:
+            parts.append(' ')
+        else:
+            parts.append(literal or name or text.lower())
+
+    return re.sub(r'\s+', ' ', ''.join(parts)).strip().rstrip(';').strip()
+
+
+class QueryCache(DiskCache):
+    """This class defines a load generation aware query result cache.
+
+    When a new load generation is seen, the entries of the older
+    generations are removed. The entries older than ttl seconds are
+    read again from the cluster, and the least recently used entries
+    are evicted above max_bytes.
+
+    Each query ends its read-only transaction, so the session never
+    holds the table locks the pipeline DROP and TRUNCATE statements
+    wait for. Use a connection dedicated to the cached queries.
+
+    Usage example:
+
+    cache = QueryCache('/tmp/query-cache', connection, ttl=3600)
+    top = cache.query('SELECT level, COUNT(*) FROM songplays GROUP BY 1;')
+    """
+
+    def __init__(self, directory, connection, max_bytes=MAX_BYTES, ttl=None,
+                 refresh=REFRESH_SECONDS):
+        """Creates the QueryCache object and indexes the cached results.
+
+        Args:
+            directory: The local cache directory path.
+            connection: The connection adapter wrapper.
+            max_bytes: The maximum total size of the cached results.
+            ttl: The maximum age of an entry in seconds.
+                If None, the entries only expire with their generation.
+            refresh: The seconds a read load generation is trusted
+                before it is read again, so the results of the previous
+                load may be served up to refresh seconds after a new
+                load. Use 0 to read it on every query.
+        """
+        super().__init__(directory, max_bytes)
+        self.connection = connection
+        self.ttl = ttl
+        self.refresh = refresh
+        self.current = None
+        self.checked = 0.0
+
+    def generation(self):
+        """Reads the load generation and drops the stale entries.
+
+        Returns:
+            The current load generation number.
+        """
+        now = time.monotonic()
+        if self.current is not None and now - self.checked < self.refresh:
+            return self.current
+
+        generation = self.connection.query(SELECT_ETL_GENERATION)[0][0]
+        # the read-only query must not leave a transaction open
+        self.connection.rollback()
+
+        if generation != self.current:
+            prefix = f'{generation}-'
+            self.invalidate(lambda name: not name.startswith(prefix))
+
+        self.current = generation
+        self.checked = now
+        return generation
+
+    @staticmethod
+    def key(query, params=None):
+        """Builds the generation independent part of an entry name.
+
+        Args:
+            query: The SQL statement.
+            params: Optional sequence of query parameter values.
+
+        Returns:
+            The SHA-256 hex digest of the normalized query and params.
+        """
+        data = json.dumps([normalize_sql(query), list(params or [])],
+                          default=str)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def encode(frame, created):
+        """Serializes a result DataFrame with its creation time.
+
+        Args:
+            frame: The result DataFrame object.
+            created: The creation epoch time.
+
+        Returns:
+            The entry content as bytes.
+        """
+        if pa is None:
+            return pickle.dumps((created, frame),
+                                protocol=pickle.HIGHEST_PROTOCOL)
+
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        table = table.replace_schema_metadata(
+            {**(table.schema.metadata or {}),
+             CREATED_KEY: str(created).encode('utf-8')})
+
+        sink = pa.BufferOutputStream()
+        pq.write_table(table, sink, compression='zstd')
+        return sink.getvalue().to_pybytes()
+
+    @staticmethod
+    def decode(path):
+        """Reads a cached result.
+
+        Args:
+            path: The entry file path.
+
+        Returns:
+            A (created, frame) tuple.
+        """
+        if pa is None:
+            with open(path, 'rb') as file:
+                return pickle.load(file)
+
+        table = pq.read_table(path)
+        created = float(table.schema.metadata[CREATED_KEY])
+        return created, table.to_pandas()
+
+    def get(self, query, params=None):
+        """Looks up a cached result of the current load generation.
+
+        Args:
+            query: The SQL statement.
+            params: Optional sequence of query parameter values.
+
+        Returns:
+            A pandas DataFrame object or None on a cache miss.
+        """
+        name = f'{self.generation()}-{self.key(query, params)}'
+        path = self.get_path(name)
+        if path is None:
+            return None
+
+        try:
+            created, frame = self.decode(path)
+        except FileNotFoundError:
+            # evicted by another thread after the lookup
+            return None
+
+        if self.ttl is not None and time.time() - created > self.ttl:
+            self.invalidate(lambda entry: entry == name)
+            return None
+
+        return frame
+
+    def query(self, query, params=None):
+        """Runs a query through the cache.
+
+        Args:
+            query: The SELECT statement.
+            params: Optional sequence of values bound to the
+                %s query placeholders.
+
+        Returns:
+            A pandas DataFrame object of the result rows.
+        """
+        frame = self.get(query, params)
+        if frame is not None:
+            return frame
+
+        generation = self.current
+        try:
+            self.connection.execute(query, params=params)
+            names = [column[0]
+                     for column in self.connection.cursor.description]
+            frame = pd.DataFrame.from_records(
+                [tuple(row) for row in self.connection.cursor.fetchall()],
+                columns=names)
+        finally:
+            # a failed SELECT must not leave the transaction aborted
+            self.connection.rollback()
+
+        self.put_bytes(f'{generation}-{self.key(query, params)}',
+                       self.encode(frame, time.time()))
+
+        return frame
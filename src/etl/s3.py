@@ -2,11 +2,21 @@
 
 # sys libs
 import io
+import contextlib
+import collections
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 # AWS libs
 import boto3
+from botocore.config import Config as ClientConfig
 # data libs
-import json
 import pandas as pd
+import decode
+import stream
+
+# max number of pooled HTTP connections of the boto3 client
+MAX_POOL_CONNECTIONS = 64
+# default number of rows of the iter_frames chunks
+CHUNK_ROWS = 100000
 
 
 class S3Loader:
@@ -17,14 +27,17 @@ class S3Loader:
     loader = S3Loader()
     """
 
-    def __init__(self, config):
+    def __init__(self, config, cache=None):
         """Creates the S3Loader object to read json files from buckets.
 
         Args:
             config: The aws.ini config file wrapper object.
+            cache: An optional ObjectCache object. If set, the objects
+              are read from the local disk when their ETag is cached.
         """
         self.client = self.__create_cliente(config)
         self.resource = self.__create_resource(config)
+        self.cache = cache
 
     def __create_cliente(self, config):
         """Initilizes the AWS S3 client object from boto3 library.
@@ -41,7 +54,11 @@ class S3Loader:
                             aws_access_key_id=config.get(
                                 'AWS', 'KEY'),
                             aws_secret_access_key=config.get(
-                                'AWS', 'SECRET')
+                                'AWS', 'SECRET'),
+                            endpoint_url=config.get(
+                                'S3', 'ENDPOINT', fallback=None),
+                            config=ClientConfig(
+                                max_pool_connections=MAX_POOL_CONNECTIONS)
                             )
 
     def __create_resource(self, config):
@@ -58,44 +75,396 @@ class S3Loader:
                               aws_access_key_id=config.get(
                                   'AWS', 'KEY'),
                               aws_secret_access_key=config.get(
-                                  'AWS', 'SECRET'))
+                                  'AWS', 'SECRET'),
+                              endpoint_url=config.get(
+                                  'S3', 'ENDPOINT', fallback=None))
 
-    def load_data(self, bucket_path, file_count=1):
-        """Loads all json files from an S3 bucket.
+    def __split_path(self, bucket_path):
+        """Splits an S3 path into its bucket name and object key.
 
         Args:
-            bucket_path: The S3 bucket folder path.
-            file_count: The number of json files to load.
+            bucket_path: The S3 path. E.g. s3://udacity-dend/log_data
 
         Returns:
-            A pandas DataFrame object containing
-            the data of all json files.
+            A (bucket, key) tuple.
         """
-        # get the bucket path and resource object
         path = bucket_path.split('/')
-        bucket = self.resource.Bucket(path[2])
+        return path[2], '/'.join(path[3:])
 
-        # initialize counter and data frame array
-        count = 0
-        data_frames = []
+    def __list_keys(self, bucket, prefix, file_count, index=None):
+        """Lists the json object keys starting with a prefix.
+
+        The gzip, bzip2 and zstd compressed json objects are listed too.
 
-        # filter bucket objects starting with 'bucket-folder' and iterate
-        for obj in bucket.objects.filter(Prefix=path[3]):
+        The keys are yielded as the listing pages arrive.
+
+        Args:
+            bucket: The S3 bucket name.
+            prefix: The S3 object key prefix.
+            file_count: The maximum number of keys to list.
+              A negative value lists all keys.
+            index: An optional PrefixIndex object. If set, the keys
+              are read from the index instead of listing the bucket.
+
+        Yields:
+            A (key, etag) tuple per object in the bucket listing order.
+        """
+        if index is None:
+            # filter bucket objects starting with 'bucket-folder'
+            objects = ((obj.key, obj.e_tag) for obj in
+                       self.resource.Bucket(bucket).objects.filter(
+                           Prefix=prefix))
+        else:
+            objects = ((entry.key, entry.etag) for entry in index.entries()
+                       if entry.key.startswith(prefix))
+
+        count = 0
+        for key, etag in objects:
 
             # stop when reaching max 'count' files
             if count == file_count:
                 break
 
-            # read json to a data frame and append it to array
-            if obj.key.endswith('.json'):
-                body = io.BytesIO(obj.get()['Body'].read())
-                data = pd.read_json(body, lines=True)
-                data_frames.append(data)
+            if stream.is_json(key):
+                yield key, etag
                 count += 1
 
-        # concatenate all json data frames
+    def __read_body(self, bucket, key, etag=None):
+        """Reads an object from the cache or downloads it.
+
+        Args:
+            bucket: The S3 bucket name.
+            key: The S3 object key.
+            etag: The S3 object ETag, if known from the listing.
+
+        Returns:
+            A file-like object with the object content.
+        """
+        if self.cache is None:
+            obj = self.client.get_object(Bucket=bucket, Key=key)
+            return io.BytesIO(obj['Body'].read())
+
+        if etag is None:
+            etag = self.client.head_object(Bucket=bucket, Key=key)['ETag']
+
+        body = self.cache.open(bucket, key, etag)
+        if body is None:
+            obj = self.client.get_object(Bucket=bucket, Key=key)
+            data = obj['Body'].read()
+            self.cache.put(bucket, key, obj['ETag'], data)
+            body = io.BytesIO(data)
+        elif stream.compression(key) and not isinstance(body, io.IOBase):
+            # the decompressors call seekable, which a memory-mapped
+            # entry lacks although it can seek, so only the compressed
+            # entries are copied and the others are read in place
+            with body:
+                body = io.BytesIO(body)
+
+        return body
+
+    @contextlib.contextmanager
+    def __open_stream(self, bucket, key, etag=None):
+        """Opens the decompressed content stream of an object.
+
+        Without a cache the HTTP body is read as it is consumed,
+        so the object is never buffered in memory.
+
+        Args:
+            bucket: The S3 bucket name.
+            key: The S3 object key.
+            etag: The S3 object ETag, if known from the listing.
+
+        Yields:
+            A binary file-like object of the decompressed content.
+        """
+        if self.cache is None:
+            body = self.client.get_object(Bucket=bucket, Key=key)['Body']
+        else:
+            body = self.__read_body(bucket, key, etag)
+
+        try:
+            yield stream.open_stream(body, key)
+        finally:
+            body.close()
+
+    def __read_frame(self, bucket, key, etag=None, schema=None, pool=None):
+        """Downloads one json lines object and parses it.
+
+        The boto3 client is thread-safe, so this method
+        can be called from the thread pool workers.
+
+        Args:
+            bucket: The S3 bucket name.
+            key: The S3 object key.
+            etag: The S3 object ETag, if known from the listing.
+            schema: An optional Schema object used to cast the columns.
+            pool: An optional ProcessPoolExecutor object. If set,
+              the json lines are decoded by the pool workers.
+
+        Returns:
+            A pandas DataFrame object containing the object data.
+        """
+        with self.__open_stream(bucket, key, etag) as body:
+            if pool is not None:
+                payload = pool.submit(decode.decode_frame,
+                                      body.read(), schema).result()
+                return decode.to_frame(payload, schema)
+
+            data = pd.read_json(body, lines=True)
+
+        if schema is not None:
+            schema.apply(data)
+
+        return data
+
+    @staticmethod
+    def __concat(data_frames, schema=None):
+        """Concatenates the per object DataFrames.
+
+        Args:
+            data_frames: A list of pandas DataFrame objects.
+            schema: The Schema object used to parse the frames.
+
+        Returns:
+            The concatenated DataFrame object.
+        """
+        if schema is not None:
+            return schema.concat(data_frames)
+
         return pd.concat(data_frames, ignore_index=True)
 
+    @staticmethod
+    def __prefetch(read, items, max_workers):
+        """Calls a read function on each item, in order, from a thread pool.
+
+        At most two items per worker are read ahead of the consumer,
+        so memory stays bounded, and the reads not started yet are
+        cancelled when the consumer stops early.
+
+        Args:
+            read: A function called with each item.
+            items: An iterable of items.
+            max_workers: The number of reading threads.
+              If None, or lower than 2, the items are read
+              one at a time.
+
+        Yields:
+            The read function result per item in the items order.
+        """
+        if max_workers is None or max_workers < 2:
+            for item in items:
+                yield read(item)
+            return
+
+        pending = collections.deque()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            try:
+                for item in items:
+                    pending.append(executor.submit(read, item))
+
+                    if len(pending) >= 2 * max_workers:
+                        yield pending.popleft().result()
+
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                # drop the prefetched work if the consumer stops early
+                for future in pending:
+                    future.cancel()
+
+    def __read_frames(self, bucket, keys, max_workers, schema=None,
+                      processes=None):
+        """Downloads and parses the json lines objects in order.
+
+        When max_workers is set, at most two objects per worker are
+        fetched ahead of the consumer, so memory stays bounded.
+        When processes is set, the fetching threads hand the downloaded
+        bytes to a process pool that decodes them.
+
+        Args:
+            bucket: The S3 bucket name.
+            keys: An iterable of (key, etag) tuples.
+            max_workers: The number of fetching threads.
+              If None, or lower than 2, the objects are read
+              one at a time.
+            schema: An optional Schema object used to cast the columns.
+            processes: The number of json decoding processes.
+              If None, the objects are decoded by the fetching threads.
+
+        Yields:
+            A pandas DataFrame object per S3 object in the keys order.
+        """
+        pool = None
+        if processes:
+            pool = ProcessPoolExecutor(max_workers=processes)
+            # keep every decoding process busy
+            max_workers = max(max_workers or 0, processes)
+
+        def read(item):
+            key, etag = item
+            return self.__read_frame(bucket, key, etag, schema, pool)
+
+        try:
+            yield from self.__prefetch(read, keys, max_workers)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+    def load_data(self, bucket_path, file_count=1, max_workers=None,
+                  index=None, schema=None, processes=None):
+        """Loads all json files from an S3 bucket.
+
+        Args:
+            bucket_path: The S3 bucket folder path.
+            file_count: The number of json files to load.
+              A negative value loads all files.
+            max_workers: The number of threads used to fetch and parse
+              the objects concurrently. If None, or lower than 2,
+              the objects are loaded one at a time.
+            index: An optional PrefixIndex object of the bucket path
+              used to plan the downloads without listing the bucket.
+            schema: An optional Schema object used to parse the json
+              data into compact dtypes. E.g. STAGING_EVENTS_SCHEMA
+            processes: The number of processes used to decode the json
+              data. Useful when parsing, not downloading, is the
+              bottleneck. If None, the data is decoded in this process.
+
+        Returns:
+            A pandas DataFrame object containing
+            the data of all json files in the bucket listing order.
+        """
+        bucket, prefix = self.__split_path(bucket_path)
+        keys = self.__list_keys(bucket, prefix, file_count, index)
+        data_frames = list(
+            self.__read_frames(bucket, keys, max_workers, schema, processes))
+
+        # concatenate all json data frames
+        return self.__concat(data_frames, schema)
+
+    def iter_frames(self, bucket_path, chunk_rows=CHUNK_ROWS,
+                    file_count=-1, max_workers=None, index=None,
+                    schema=None, processes=None):
+        """Streams the json files of an S3 bucket as DataFrame chunks.
+
+        Only the current chunk and the prefetched objects are kept
+        in memory, so the peak memory does not grow with the
+        number of files.
+
+        Usage example:
+
+        for chunk in loader.iter_frames(path, chunk_rows=50000):
+            print(len(chunk))
+
+        Args:
+            bucket_path: The S3 bucket folder path.
+            chunk_rows: The number of rows of each yielded chunk.
+              The last chunk may be smaller.
+            file_count: The number of json files to load.
+              A negative value loads all files.
+            max_workers: The number of threads used to fetch and parse
+              the objects concurrently.
+            index: An optional PrefixIndex object of the bucket path.
+            schema: An optional Schema object used to cast the columns.
+            processes: The number of json decoding processes.
+
+        Returns:
+            An iterator of pandas DataFrame objects with at most
+            chunk_rows rows.
+
+        Raises:
+            ValueError: If chunk_rows is not positive, since no chunk
+                could ever be split from the buffered rows.
+        """
+        if chunk_rows <= 0:
+            raise ValueError(f'chunk_rows must be positive: {chunk_rows}')
+
+        bucket, prefix = self.__split_path(bucket_path)
+        keys = self.__list_keys(bucket, prefix, file_count, index)
+
+        return self.__iter_chunks(
+            self.__read_frames(bucket, keys, max_workers, schema, processes),
+            chunk_rows, schema)
+
+    def __iter_chunks(self, frames, chunk_rows, schema=None):
+        """Regroups a stream of DataFrames into chunk_rows sized chunks.
+
+        Args:
+            frames: An iterable of pandas DataFrame objects.
+            chunk_rows: The positive number of rows of each chunk.
+            schema: The Schema object used to parse the frames.
+
+        Yields:
+            A pandas DataFrame object with at most chunk_rows rows.
+        """
+        buffer = []
+        rows = 0
+
+        for data in frames:
+            buffer.append(data)
+            rows += len(data)
+
+            # split the buffered rows into full chunks
+            while rows >= chunk_rows:
+                data = self.__concat(buffer, schema)
+                yield data.iloc[:chunk_rows].reset_index(drop=True)
+
+                buffer = [data.iloc[chunk_rows:].reset_index(drop=True)]
+                rows = len(buffer[0])
+
+        if rows > 0:
+            yield self.__concat(buffer, schema)
+
+    def reduce_frames(self, bucket_path, reducer, initial=None, **kwargs):
+        """Aggregates the json files of an S3 bucket chunk by chunk.
+
+        The reducer is called with the accumulated value and each chunk
+        yielded by iter_frames, so the whole dataset is never held in memory.
+
+        Usage example:
+
+        pages = loader.reduce_frames(
+            path,
+            lambda total, chunk: total.add(chunk['page'].value_counts(),
+                                           fill_value=0),
+            initial=pd.Series(dtype='int64'))
+
+        Args:
+            bucket_path: The S3 bucket folder path.
+            reducer: A function (accumulator, chunk) -> accumulator.
+            initial: The initial accumulator value.
+            kwargs: The iter_frames keyword arguments.
+
+        Returns:
+            The final accumulator value.
+        """
+        result = initial
+        for chunk in self.iter_frames(bucket_path, **kwargs):
+            result = reducer(result, chunk)
+
+        return result
+
+    def iter_objects(self, bucket, keys, max_workers=None):
+        """Downloads objects without parsing them.
+
+        At most two objects per worker are fetched ahead of the
+        consumer, so memory stays bounded.
+
+        Args:
+            bucket: The S3 bucket name.
+            keys: An iterable of object keys.
+            max_workers: The number of fetching threads.
+              If None, or lower than 2, the objects are read
+              one at a time.
+
+        Yields:
+            A (key, bytes) tuple per object in the keys order.
+        """
+        def read(key):
+            with self.__read_body(bucket, key) as body:
+                return key, body.read()
+
+        yield from self.__prefetch(read, keys, max_workers)
+
     def load_path(self, bucket_path):
         """Load one json file from an S3 bucket.
 
@@ -106,9 +475,51 @@ class S3Loader:
             A pandas DataFrame object containing
             the data of the json file.
         """
-        path = bucket_path.split('/')
+        bucket, key = self.__split_path(bucket_path)
 
-        obj = self.client.get_object(Bucket=path[2], Key=path[3])
-        data = json.loads(obj['Body'].read().decode('utf-8'))
+        with self.__open_stream(bucket, key) as body:
+            data = stream.load_document(body)
 
         return data
+
+    def iter_records(self, bucket_path, prefix=None):
+        """Streams the records of one json file from an S3 bucket.
+
+        The object is decompressed and parsed as its body is read,
+        so the peak memory does not grow with the object size.
+
+        Usage example:
+
+        for path in loader.iter_records(config.get('S3', 'LOG_JSON_PATH'),
+                                        prefix='jsonpaths.item'):
+            print(path)
+
+        Args:
+            bucket_path: The S3 bucket file path.
+            prefix: The ijson path of the items of a single json
+                document. If None, the file is read as json lines.
+
+        Yields:
+            A record per line, or an item per prefix match.
+        """
+        bucket, key = self.__split_path(bucket_path)
+
+        with self.__open_stream(bucket, key) as body:
+            if prefix is None:
+                yield from stream.iter_json_lines(body)
+            else:
+                yield from stream.iter_items(body, prefix)
+
+    def save_path(self, bucket_path, body):
+        """Writes one file to an S3 bucket.
+
+        Args:
+            bucket_path: The S3 bucket file path.
+            body: The file content as bytes or str.
+        """
+        bucket, key = self.__split_path(bucket_path)
+
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+
+        self.client.put_object(Bucket=bucket, Key=key, Body=body)
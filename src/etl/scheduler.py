@@ -0,0 +1,174 @@
+"""Defines the DagScheduler class to run independent statements in parallel.
+
+Each Step names the table it writes and the tables it reads. A step
+starts as soon as all steps writing its source tables have finished,
+so the run time drops to the critical path of the dependency graph.
+"""
+
+# sys libs
+import threading
+import collections
+from timeit import default_timer as timer
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# pipeline statement: name is the written table,
+# depends are the names of the tables it reads
+Step = collections.namedtuple('Step', ['name', 'query', 'depends'])
+
+
+def validate(steps):
+    """Checks the step names are unique and the graph has no cycles.
+
+    Dependencies on tables that no step writes are treated as
+    already loaded.
+
+    Args:
+        steps: A list of Step objects.
+
+    Raises:
+        ValueError: If a name is duplicated or a cycle is found.
+    """
+    names = [step.name for step in steps]
+    if len(names) != len(set(names)):
+        raise ValueError(f'duplicated step names: {names}')
+
+    pending = {step.name: set(step.depends) & set(names) for step in steps}
+    while pending:
+        ready = [name for name, depends in pending.items() if not depends]
+        if not ready:
+            raise ValueError(f'dependency cycle between: {sorted(pending)}')
+
+        for name in ready:
+            del pending[name]
+        for depends in pending.values():
+            depends.difference_update(ready)
+
+
+class DagScheduler:
+    """This class defines a dependency-aware parallel statement runner.
+
+    Every running step checks out its own connection from the pool.
+    When a step fails, no new step is started, the queued steps are
+    dropped, the running statements are cancelled and the first
+    error is raised.
+
+    Usage example:
+
+    pool = ConnectionPool(max_size=4)
+    scheduler = DagScheduler(pool, max_workers=4)
+    times = scheduler.run([Step('a', 'SELECT 1;', ()),
+                           Step('b', 'SELECT 2;', ('a',))])
+    """
+
+    def __init__(self, pool, max_workers=4, runner=None):
+        """Creates the DagScheduler object.
+
+        Args:
+            pool: The ConnectionPool object.
+            max_workers: The maximum number of concurrent statements.
+            runner: An optional callable(connection, step) that runs
+                a step. Defaults to executing and committing its query.
+        """
+        self.pool = pool
+        self.max_workers = max_workers
+        self.runner = runner
+        self.lock = threading.Lock()
+        self.active = {}
+        self.failed = threading.Event()
+
+    def __execute(self, step):
+        """Runs one step on a pooled connection.
+
+        Args:
+            step: The Step object.
+
+        Returns:
+            The step execution time in seconds.
+        """
+        with self.pool.connection() as connection:
+            # a sibling failed while this step was waiting for a connection
+            if self.failed.is_set():
+                raise RuntimeError(f'step {step.name} cancelled')
+
+            with self.lock:
+                self.active[step.name] = connection
+
+            try:
+                start = timer()
+                if self.runner is None:
+                    connection.execute(step.query, commit=True)
+                else:
+                    self.runner(connection, step)
+                return timer() - start
+            finally:
+                with self.lock:
+                    del self.active[step.name]
+
+    def __cancel(self, futures):
+        """Drops the queued steps and cancels the running statements.
+
+        Args:
+            futures: The running futures.
+        """
+        self.failed.set()
+
+        for future in futures:
+            future.cancel()
+
+        with self.lock:
+            connections = list(self.active.values())
+
+        for connection in connections:
+            try:
+                connection.cancel()
+            except Exception:  # pylint: disable=broad-except
+                pass
+
+    def run(self, steps):
+        """Runs the steps respecting their dependencies.
+
+        Args:
+            steps: A list of Step objects.
+
+        Returns:
+            A dict of step name to execution time in seconds,
+            in completion order.
+
+        Raises:
+            The exception of the first failed step.
+        """
+        validate(steps)
+        self.failed.clear()
+
+        names = {step.name for step in steps}
+        waiting = list(steps)
+        done = set()
+        times = {}
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while waiting or running:
+
+                # start the steps whose source tables are loaded
+                for step in list(waiting):
+                    if len(running) == self.max_workers:
+                        break
+                    if set(step.depends) & names <= done:
+                        waiting.remove(step)
+                        running[executor.submit(self.__execute, step)] = step
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    step = running.pop(future)
+                    error = future.exception()
+
+                    if error is not None:
+                        self.__cancel(running)
+                        wait(running)
+                        raise error
+
+                    times[step.name] = future.result()
+                    done.add(step.name)
+
+        return times
@@ -0,0 +1,197 @@
+"""Defines the Schema class to parse json data into compact DataFrames.
+
+The column types are derived from the CREATE TABLE statements in the
+sql_queries module, so the pandas dtypes follow the staging tables:
+SMALLINT columns become Int16, TEXT columns with few distinct values
+become categoricals and the integer columns use the nullable dtypes.
+
+The dtypes are plain names, so pandas is only imported by the methods
+converting DataFrames and the DDL parsing stays cheap to import.
+"""
+
+# sys libs
+import re
+# SQL libs
+from sql_queries import CREATE_TABLE_STAGING_EVENTS, CREATE_TABLE_STAGING_SONGS
+
+# SQL type to pandas dtype mapping
+SQL_DTYPES = {
+    'SMALLINT': 'Int16',
+    'INTEGER': 'Int32',
+    'BIGINT': 'Int64',
+    'REAL': 'float32',
+    'FLOAT': 'float64',
+    'DOUBLE PRECISION': 'float64',
+    'BOOLEAN': 'boolean',
+    'TIMESTAMP': 'datetime64[ns]',
+    'TEXT': 'object',
+}
+
+# low cardinality TEXT columns of the staging_events table
+EVENTS_CATEGORIES = ('gender', 'level', 'auth', 'page', 'method')
+
+# matches a column definition line: name TYPE[(precision[,scale])]
+COLUMN_PATTERN = re.compile(
+    r'^\s*(\w+)\s+(DOUBLE PRECISION|\w+)\s*(?:\((\d+)\s*(?:,\s*(\d+))?\))?',
+    re.IGNORECASE)
+
+
+def parse_columns(ddl):
+    """Parses the column definitions of a CREATE TABLE statement.
+
+    Args:
+        ddl: The CREATE TABLE statement.
+
+    Returns:
+        A list of (name, sql_type, precision, scale) tuples in the
+        declared order. The precision and scale may be None.
+    """
+    body = ddl[ddl.index('(') + 1:ddl.rindex(')')]
+
+    columns = []
+    for line in body.splitlines():
+        match = COLUMN_PATTERN.match(line)
+        if match is None or match.group(1).upper() == 'PRIMARY':
+            continue
+
+        name, sql_type, precision, scale = match.groups()
+        columns.append((name, sql_type.upper(),
+                        None if precision is None else int(precision),
+                        None if scale is None else int(scale)))
+
+    return columns
+
+
+def sql_dtype(sql_type, precision=None, scale=None):
+    """Maps a SQL column type to the most compact pandas dtype.
+
+    Args:
+        sql_type: The upper case SQL type name. E.g. SMALLINT
+        precision: The DECIMAL/NUMERIC precision.
+        scale: The DECIMAL/NUMERIC scale.
+
+    Returns:
+        The pandas dtype name.
+    """
+    if sql_type in ('DECIMAL', 'NUMERIC'):
+        if scale:
+            return 'float64'
+        if precision is not None and precision <= 4:
+            return 'Int16'
+        if precision is not None and precision <= 9:
+            return 'Int32'
+        return 'Int64'
+
+    return SQL_DTYPES.get(sql_type, 'object')
+
+
+class Schema:
+    """This class defines the pandas dtypes of a staging table.
+
+    Usage example:
+
+    schema = Schema.from_ddl(CREATE_TABLE_STAGING_EVENTS,
+                             categories=EVENTS_CATEGORIES)
+    data = loader.load_data(path, -1, schema=schema)
+    """
+
+    def __init__(self, dtypes, categories=()):
+        """Creates the Schema object.
+
+        Args:
+            dtypes: A dict of column name to pandas dtype.
+            categories: The names of the columns stored as categoricals.
+        """
+        self.dtypes = dict(dtypes)
+        for column in categories:
+            self.dtypes[column] = 'category'
+
+        # json keys are matched ignoring case, as the COPY command does
+        self.columns = {name.lower(): name for name in self.dtypes}
+
+    @classmethod
+    def from_ddl(cls, ddl, categories=()):
+        """Creates a Schema object from a CREATE TABLE statement.
+
+        Args:
+            ddl: The CREATE TABLE statement.
+            categories: The names of the TEXT columns stored
+              as categoricals.
+
+        Returns:
+            A Schema object.
+        """
+        dtypes = {name: sql_dtype(sql_type, precision, scale)
+                  for name, sql_type, precision, scale in parse_columns(ddl)}
+
+        return cls(dtypes, categories)
+
+    @property
+    def categories(self):
+        """The names of the categorical columns."""
+        return [name for name, dtype in self.dtypes.items()
+                if dtype == 'category']
+
+    def apply(self, data):
+        """Casts the DataFrame columns to the schema dtypes in place.
+
+        Columns missing from the schema are left untouched.
+
+        Args:
+            data: A pandas DataFrame object.
+
+        Returns:
+            The same DataFrame object.
+        """
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+
+        for column in data.columns:
+            name = self.columns.get(column.lower())
+            if name is None:
+                continue
+
+            dtype = self.dtypes[name]
+            values = data[column]
+
+            if dtype.startswith(('Int', 'float')) and values.dtype == object:
+                values = pd.to_numeric(values, errors='coerce')
+            elif dtype.startswith('datetime') and values.dtype != object:
+                values = pd.to_datetime(values, unit='ms')
+
+            data[column] = values.astype(dtype)
+
+        return data
+
+    def concat(self, frames):
+        """Concatenates DataFrames keeping the categorical dtypes.
+
+        pandas falls back to object columns when the categories differ
+        between frames, so the categories are unified first.
+
+        Args:
+            frames: A list of DataFrame objects parsed with this schema.
+
+        Returns:
+            The concatenated DataFrame object.
+        """
+        # pylint: disable=import-outside-toplevel
+        import pandas as pd
+        from pandas.api.types import union_categoricals
+
+        for column in self.categories:
+            present = [data for data in frames if column in data]
+            if len(present) < 2:
+                continue
+
+            categories = union_categoricals(
+                [data[column] for data in present]).categories
+            for data in present:
+                data[column] = data[column].cat.set_categories(categories)
+
+        return pd.concat(frames, ignore_index=True)
+
+
+STAGING_EVENTS_SCHEMA = Schema.from_ddl(CREATE_TABLE_STAGING_EVENTS,
+                                        categories=EVENTS_CATEGORIES)
+
+STAGING_SONGS_SCHEMA = Schema.from_ddl(CREATE_TABLE_STAGING_SONGS)
@@ -3,11 +3,13 @@
 This module defines a constant for each AWS Redshift SQL statement.
 Then, a list is created to group each SQL query category,
 such as DROP, CREATE, COPY and INSERT.
+
+The COPY statements hold the dwh.cfg values, so they are rendered on
+first use by the module __getattr__ function and importing this
+module does not read the configuration file.
 """
 from config import Config
 
-config = Config()
-
 # DROP TABLES
 
 DROP_TABLE_STAGING_EVENTS = 'DROP TABLE IF EXISTS staging_events;'
@@ -17,6 +19,10 @@ DROP_TABLE_USERS = 'DROP TABLE IF EXISTS users;'
 DROP_TABLE_SONGS = 'DROP TABLE IF EXISTS songs;'
 DROP_TABLE_ARTISTS = 'DROP TABLE IF EXISTS artists;'
 DROP_TABLE_TIME = 'DROP TABLE IF EXISTS time;'
+DROP_TABLE_STAGING_PLAYS = 'DROP TABLE IF EXISTS staging_plays;'
+DROP_TABLE_ETL_STATE = 'DROP TABLE IF EXISTS etl_state;'
+DROP_TABLE_ETL_CHECKPOINT = 'DROP TABLE IF EXISTS etl_checkpoint;'
+DROP_TABLE_ETL_GENERATION = 'DROP TABLE IF EXISTS etl_generation;'
 
 # CREATE TABLES
 
@@ -119,24 +125,128 @@ PRIMARY KEY (start_time)
 );
 """
 
+CREATE_TABLE_ETL_STATE = """
+CREATE TABLE etl_state (
+source              TEXT                NOT NULL           ,
+last_key            TEXT                                   ,
+last_ts             BIGINT                                 ,
+updated_at          TIMESTAMP           NOT NULL           ,
+PRIMARY KEY (source)
+) diststyle all;
+"""
+
+CREATE_TABLE_ETL_CHECKPOINT = """
+CREATE TABLE etl_checkpoint (
+step                TEXT                NOT NULL           ,
+row_count           BIGINT                                 ,
+seconds             FLOAT                                  ,
+finished_at         TIMESTAMP           NOT NULL           ,
+PRIMARY KEY (step)
+) diststyle all;
+"""
+
+# kept across the rebuilds, the result cache entries are keyed on it
+CREATE_TABLE_ETL_GENERATION = """
+CREATE TABLE IF NOT EXISTS etl_generation (
+generation          BIGINT              NOT NULL           ,
+loaded_at           TIMESTAMP           NOT NULL           ,
+PRIMARY KEY (generation)
+) diststyle all;
+"""
+
 #
 # STAGING TABLES
 
-COPY_STAGING_EVENTS = f"""
+COPY_STAGING_EVENTS_TEMPLATE = """
+COPY staging_events
+FROM '{log_data}'
+CREDENTIALS 'aws_iam_role={role_arn}'
+FORMAT AS JSON 'auto ignorecase'
+TIMEFORMAT 'YYYY-MM-DD HH:MI:SS'
+region '{region}';
+"""
+
+COPY_STAGING_SONGS_TEMPLATE = """
+COPY staging_songs
+FROM '{song_data}'
+CREDENTIALS 'aws_iam_role={role_arn}'
+FORMAT AS JSON 'auto ignorecase'
+region '{region}';
+"""
+
+COPY_STAGING_EVENTS_MANIFEST_TEMPLATE = """
 COPY staging_events
-FROM '{config.get('S3', 'LOG_DATA')}'
-CREDENTIALS 'aws_iam_role={config.get('IAM', 'REDSHIFT_ROLE_ARN')}'
+FROM '{{manifest}}'
+CREDENTIALS 'aws_iam_role={role_arn}'
+FORMAT AS JSON 'auto ignorecase'
+TIMEFORMAT 'YYYY-MM-DD HH:MI:SS'
+MANIFEST
+region '{region}';
+"""
+
+COPY_STAGING_EVENTS_PARTITION_TEMPLATE = """
+COPY {{table}}
+FROM '{{manifest}}'
+CREDENTIALS 'aws_iam_role={role_arn}'
 FORMAT AS JSON 'auto ignorecase'
 TIMEFORMAT 'YYYY-MM-DD HH:MI:SS'
-region '{config.get('AWS', 'REGION')}';
+MANIFEST
+region '{region}';
 """
 
-COPY_STAGING_SONGS = f"""
+COPY_STAGING_SONGS_MANIFEST_TEMPLATE = """
 COPY staging_songs
-FROM '{config.get('S3', 'SONG_DATA')}'
-CREDENTIALS 'aws_iam_role={config.get('IAM', 'REDSHIFT_ROLE_ARN')}'
+FROM '{song_manifest}'
+CREDENTIALS 'aws_iam_role={role_arn}'
 FORMAT AS JSON 'auto ignorecase'
-region '{config.get('AWS', 'REGION')}';
+GZIP
+MANIFEST
+region '{region}';
+"""
+
+# RESULT EXPORT
+# the query is quoted by Connection.unload, the parquet files are
+# named after the {path} prefix
+
+UNLOAD_QUERY_TEMPLATE = """
+UNLOAD ('{{query}}')
+TO '{{path}}'
+CREDENTIALS 'aws_iam_role={role_arn}'
+FORMAT AS PARQUET
+ALLOWOVERWRITE
+region '{region}';
+"""
+
+# MATERIALIZED STAGING JOIN
+# the NextSong events joined to their songs, shared by the fact
+# and dimension inserts instead of joining the staging tables four times
+
+CREATE_TABLE_STAGING_PLAYS = """
+CREATE TABLE staging_plays
+DISTKEY (song_id)
+SORTKEY (ts)
+AS
+SELECT
+e.userid AS userid,
+e.sessionid AS sessionid,
+e.iteminsession AS iteminsession,
+e.level AS level,
+e.location AS location,
+e.useragent AS useragent,
+e.ts AS ts,
+s.song_id AS song_id,
+s.title AS title,
+s.year AS year,
+s.duration AS duration,
+s.artist_id AS artist_id,
+s.artist_name AS artist_name,
+s.artist_location AS artist_location,
+s.artist_latitude AS artist_latitude,
+s.artist_longitude AS artist_longitude
+FROM staging_events AS e
+JOIN staging_songs  AS s
+ON e.song = s.title AND e.artist = s.artist_name AND e.length = s.duration
+WHERE e.page = 'NextSong';
 """
 
 # FACT AND DIMENSIONS TABLES
@@ -162,18 +272,24 @@ ORDER BY e.ts
 );
 """
 
+# a user changing level has several rows, only the latest one is kept
 INSERT_TABLE_USERS = """
 INSERT INTO users
 (
+SELECT user_id, first_name, last_name, gender, level
+FROM (
 SELECT
-DISTINCT CAST (userid AS INTEGER) AS user_id,
+CAST (userid AS INTEGER) AS user_id,
 firstname AS first_name,
 lastname AS last_name,
 TRIM (BOTH FROM gender) AS gender,
-TRIM (BOTH FROM level) AS level
+TRIM (BOTH FROM level) AS level,
+ROW_NUMBER() OVER (PARTITION BY userid ORDER BY ts DESC) AS latest
 FROM staging_events
 WHERE page = 'NextSong'
-ORDER BY userId
+) AS e
+WHERE latest = 1
+ORDER BY user_id
 );
 """
 
@@ -230,19 +346,592 @@ ORDER BY e.ts
 );
 """
 
+# FACT AND DIMENSIONS TABLES FROM THE MATERIALIZED JOIN
+
+INSERT_TABLE_SONGPLAYS_FROM_PLAYS = """
+INSERT INTO songplays
+(
+SELECT
+CONCAT(CAST (p.userid AS VARCHAR), CONCAT(CAST (p.sessionid AS VARCHAR), CAST (p.iteminsession AS VARCHAR))) as songplay_id,
+p.level AS level,
+p.location AS location,
+p.useragent AS user_agent,
+p.sessionid AS session_id,
+CAST (p.userid AS INTEGER) AS user_id,
+p.song_id AS song_id,
+p.artist_id AS artist_id,
+TIMESTAMP 'epoch' + p.ts::float / 1000 * INTERVAL '1 second' AS start_time
+FROM staging_plays AS p
+ORDER BY p.ts
+);
+"""
+
+INSERT_TABLE_SONGS_FROM_PLAYS = """
+INSERT INTO songs
+(
+SELECT
+DISTINCT p.song_id AS song_id,
+p.title AS title,
+p.year AS year,
+p.duration AS duration,
+p.artist_id AS artist_id
+FROM staging_plays AS p
+ORDER BY p.song_id
+);
+"""
+
+INSERT_TABLE_ARTISTS_FROM_PLAYS = """
+INSERT INTO artists
+(
+SELECT
+DISTINCT p.artist_id AS artist_id,
+p.artist_name AS name,
+p.artist_location AS location,
+p.artist_latitude AS latitude,
+p.artist_longitude AS longitude
+FROM staging_plays AS p
+ORDER BY p.artist_id
+);
+"""
+
+INSERT_TABLE_TIME_FROM_PLAYS = """
+INSERT INTO time
+(
+SELECT
+DISTINCT TIMESTAMP 'epoch' + p.ts::float / 1000 * INTERVAL '1 second' AS start_time,
+DATE_PART(hour, TIMESTAMP 'epoch' + p.ts::float / 1000 * INTERVAL '1 second') AS hour,
+DATE_PART(day, TIMESTAMP 'epoch' + p.ts::float / 1000 * INTERVAL '1 second') AS day,
+DATE_PART(week, TIMESTAMP 'epoch' + p.ts::float / 1000 * INTERVAL '1 second') AS week,
+DATE_PART(month, TIMESTAMP 'epoch' + p.ts::float / 1000 * INTERVAL '1 second') AS month,
+DATE_PART(year, TIMESTAMP 'epoch' + p.ts::float / 1000 * INTERVAL '1 second') AS year,
+DATE_PART(dayofweek, TIMESTAMP 'epoch' + p.ts::float / 1000 * INTERVAL '1 second') AS weekday
+FROM staging_plays AS p
+ORDER BY start_time
+);
+"""
+
+# INCREMENTAL LOAD
+# the %s placeholder is the ts high-water mark of the previous run
+
+SELECT_ETL_STATE = """
+SELECT last_key, last_ts
+FROM etl_state
+WHERE source = %s;
+"""
+
+DELETE_ETL_STATE = 'DELETE FROM etl_state WHERE source = %s;'
+
+INSERT_ETL_STATE = """
+INSERT INTO etl_state (source, last_key, last_ts, updated_at)
+VALUES (%s, %s, %s, GETDATE());
+"""
+
+SELECT_STAGING_EVENTS_MAX_TS = 'SELECT MAX(ts) FROM staging_events;'
+
+SELECT_STAGING_SONGS_COUNT = 'SELECT COUNT(*) FROM staging_songs;'
+
+TRUNCATE_TABLE_STAGING_EVENTS = 'TRUNCATE TABLE staging_events;'
+
+INSERT_TABLE_SONGPLAYS_INCREMENTAL = """
+INSERT INTO songplays
+(
+SELECT
+CONCAT(CAST (e.userid AS VARCHAR), CONCAT(CAST (e.sessionid AS VARCHAR), CAST (e.iteminsession AS VARCHAR))) as songplay_id,
+e.level AS level,
+e.location AS location,
+e.useragent AS user_agent,
+e.sessionid AS session_id,
+CAST (e.userid AS INTEGER) AS user_id,
+s.song_id AS song_id,
+s.artist_id AS artist_id,
+TIMESTAMP 'epoch' + e.ts::float / 1000 * INTERVAL '1 second' AS start_time
+FROM staging_events AS e
+JOIN staging_songs  AS s
+ON e.song = s.title AND e.artist = s.artist_name AND e.length = s.duration
+WHERE e.page = 'NextSong' AND e.ts > %s
+ORDER BY e.ts
+);
+"""
+
+INSERT_TABLE_TIME_INCREMENTAL = """
+INSERT INTO time
+(
+SELECT t.*
+FROM (
+SELECT
+DISTINCT TIMESTAMP 'epoch' + e.ts::float / 1000 * INTERVAL '1 second' AS start_time,
+DATE_PART(hour, TIMESTAMP 'epoch' + e.ts::float / 1000 * INTERVAL '1 second') AS hour,
+DATE_PART(day, TIMESTAMP 'epoch' + e.ts::float / 1000 * INTERVAL '1 second') AS day,
+DATE_PART(week, TIMESTAMP 'epoch' + e.ts::float / 1000 * INTERVAL '1 second') AS week,
+DATE_PART(month, TIMESTAMP 'epoch' + e.ts::float / 1000 * INTERVAL '1 second') AS month,
+DATE_PART(year, TIMESTAMP 'epoch' + e.ts::float / 1000 * INTERVAL '1 second') AS year,
+DATE_PART(dayofweek, TIMESTAMP 'epoch' + e.ts::float / 1000 * INTERVAL '1 second') AS weekday
+FROM staging_events AS e
+JOIN staging_songs  AS s
+ON e.song = s.title AND e.artist = s.artist_name AND e.length = s.duration
+WHERE e.page = 'NextSong' AND e.ts > %s
+) AS t
+WHERE NOT EXISTS (SELECT 1 FROM time WHERE time.start_time = t.start_time)
+ORDER BY t.start_time
+);
+"""
+
+# DIMENSION UPSERT
+# the staged rows are compared to the dimension rows by an MD5 row hash,
+# so only the new and the changed rows are deleted and inserted
+
+DROP_TABLE_USERS_DELTA = 'DROP TABLE IF EXISTS users_delta;'
+DROP_TABLE_SONGS_DELTA = 'DROP TABLE IF EXISTS songs_delta;'
+DROP_TABLE_ARTISTS_DELTA = 'DROP TABLE IF EXISTS artists_delta;'
+
+CREATE_TABLE_USERS_DELTA = """
+CREATE TEMP TABLE users_delta AS
+SELECT
+user_id, first_name, last_name, gender, level,
+MD5(COALESCE(first_name, '') || '|' || COALESCE(last_name, '') || '|' ||
+    COALESCE(gender, '') || '|' || COALESCE(level, '')) AS row_hash
+FROM (
+SELECT
+CAST (userid AS INTEGER) AS user_id,
+firstname AS first_name,
+lastname AS last_name,
+TRIM (BOTH FROM gender) AS gender,
+TRIM (BOTH FROM level) AS level,
+ROW_NUMBER() OVER (PARTITION BY userid ORDER BY ts DESC) AS latest
+FROM staging_events
+WHERE page = 'NextSong'
+) AS e
+WHERE latest = 1;
+"""
+
+CREATE_TABLE_SONGS_DELTA = """
+CREATE TEMP TABLE songs_delta AS
+SELECT
+song_id, title, year, duration, artist_id,
+MD5(COALESCE(title, '') || '|' ||
+    COALESCE(CAST (year AS VARCHAR), '') || '|' ||
+    COALESCE(CAST (duration AS VARCHAR), '') || '|' ||
+    COALESCE(artist_id, '')) AS row_hash
+FROM (
+SELECT
+s.song_id AS song_id,
+s.title AS title,
+s.year AS year,
+s.duration AS duration,
+s.artist_id AS artist_id,
+ROW_NUMBER() OVER (PARTITION BY s.song_id ORDER BY s.title) AS latest
+FROM staging_events AS e
+JOIN staging_songs  AS s
+ON e.song = s.title AND e.artist = s.artist_name AND e.length = s.duration
+WHERE e.page = 'NextSong'
+) AS d
+WHERE latest = 1;
+"""
+
+CREATE_TABLE_ARTISTS_DELTA = """
+CREATE TEMP TABLE artists_delta AS
+SELECT
+artist_id, name, location, latitude, longitude,
+MD5(COALESCE(name, '') || '|' || COALESCE(location, '') || '|' ||
+    COALESCE(CAST (latitude AS VARCHAR), '') || '|' ||
+    COALESCE(CAST (longitude AS VARCHAR), '')) AS row_hash
+FROM (
+SELECT
+s.artist_id AS artist_id,
+s.artist_name AS name,
+s.artist_location AS location,
+s.artist_latitude AS latitude,
+s.artist_longitude AS longitude,
+ROW_NUMBER() OVER (PARTITION BY s.artist_id ORDER BY s.artist_name) AS latest
+FROM staging_events AS e
+JOIN staging_songs  AS s
+ON e.song = s.title AND e.artist = s.artist_name AND e.length = s.duration
+WHERE e.page = 'NextSong'
+) AS d
+WHERE latest = 1;
+"""
+
+DELETE_USERS_DELTA_UNCHANGED = """
+DELETE FROM users_delta
+USING users AS u
+WHERE users_delta.user_id = u.user_id
+AND users_delta.row_hash =
+MD5(COALESCE(u.first_name, '') || '|' || COALESCE(u.last_name, '') || '|' ||
+    COALESCE(u.gender, '') || '|' || COALESCE(u.level, ''));
+"""
+
+DELETE_SONGS_DELTA_UNCHANGED = """
+DELETE FROM songs_delta
+USING songs AS s
+WHERE songs_delta.song_id = s.song_id
+AND songs_delta.row_hash =
+MD5(COALESCE(s.title, '') || '|' ||
+    COALESCE(CAST (s.year AS VARCHAR), '') || '|' ||
+    COALESCE(CAST (s.duration AS VARCHAR), '') || '|' ||
+    COALESCE(s.artist_id, ''));
+"""
+
+DELETE_ARTISTS_DELTA_UNCHANGED = """
+DELETE FROM artists_delta
+USING artists AS a
+WHERE artists_delta.artist_id = a.artist_id
+AND artists_delta.row_hash =
+MD5(COALESCE(a.name, '') || '|' || COALESCE(a.location, '') || '|' ||
+    COALESCE(CAST (a.latitude AS VARCHAR), '') || '|' ||
+    COALESCE(CAST (a.longitude AS VARCHAR), ''));
+"""
+
+DELETE_USERS_CHANGED = """
+DELETE FROM users
+USING users_delta AS d
+WHERE users.user_id = d.user_id;
+"""
+
+DELETE_SONGS_CHANGED = """
+DELETE FROM songs
+USING songs_delta AS d
+WHERE songs.song_id = d.song_id;
+"""
+
+DELETE_ARTISTS_CHANGED = """
+DELETE FROM artists
+USING artists_delta AS d
+WHERE artists.artist_id = d.artist_id;
+"""
+
+INSERT_USERS_DELTA = """
+INSERT INTO users
+(
+SELECT user_id, first_name, last_name, gender, level
+FROM users_delta
+ORDER BY user_id
+);
+"""
+
+INSERT_SONGS_DELTA = """
+INSERT INTO songs
+(
+SELECT song_id, title, year, duration, artist_id
+FROM songs_delta
+ORDER BY song_id
+);
+"""
+
+INSERT_ARTISTS_DELTA = """
+INSERT INTO artists
+(
+SELECT artist_id, name, location, latitude, longitude
+FROM artists_delta
+ORDER BY artist_id
+);
+"""
+
+SELECT_USERS_DELTA_COUNT = 'SELECT COUNT(*) FROM users_delta;'
+SELECT_SONGS_DELTA_COUNT = 'SELECT COUNT(*) FROM songs_delta;'
+SELECT_ARTISTS_DELTA_COUNT = 'SELECT COUNT(*) FROM artists_delta;'
+
+# STATEMENT METRICS
+# Redshift system tables read after each statement by the MetricsRecorder
+
+SELECT_COPY_METRICS = """
+SELECT
+(SELECT COALESCE(SUM(lines_scanned), 0) FROM stl_load_commits
+ WHERE query = pg_last_copy_id()),
+(SELECT COALESCE(SUM(bytes), 0) FROM svl_query_summary
+ WHERE query = pg_last_copy_id());
+"""
+
+SELECT_QUERY_METRICS = """
+SELECT COALESCE(SUM(bytes), 0)
+FROM svl_query_summary
+WHERE query = pg_last_query_id() AND label LIKE 'scan%';
+"""
+
+SELECT_VERSION = 'SELECT version();'
+
+# SCHEMA MIGRATIONS
+# the catalog is compared to the CREATE TABLE statements and only
+# the changed tables are altered or rebuilt
+
+SELECT_TABLE_COLUMNS = """
+SELECT table_name, column_name, data_type, numeric_precision, numeric_scale
+FROM information_schema.columns
+WHERE table_schema = current_schema()
+ORDER BY table_name, ordinal_position;
+"""
+
+SELECT_TABLE_KEYS = """
+SELECT tablename, "column", distkey, sortkey <> 0
+FROM pg_table_def
+WHERE schemaname = current_schema();
+"""
+
+ALTER_TABLE_ADD_COLUMN = 'ALTER TABLE {table} ADD COLUMN {column} {type};'
+
+ALTER_TABLE_DROP_COLUMN = 'ALTER TABLE {table} DROP COLUMN {column};'
+
+ALTER_TABLE_RENAME = 'ALTER TABLE {table} RENAME TO {name};'
+
+INSERT_TABLE_REBUILD = """
+INSERT INTO {table} ({columns})
+SELECT {values}
+FROM {source};
+"""
+
+DROP_TABLE_REBUILD = 'DROP TABLE {table};'
+
+# CHECKPOINTS
+# a step and its etl_checkpoint row are committed together,
+# so a resumed run never repeats a committed step
+
+SELECT_ETL_CHECKPOINT = 'SELECT step, row_count FROM etl_checkpoint;'
+
+SELECT_ETL_CHECKPOINT_STEP = """
+SELECT row_count
+FROM etl_checkpoint
+WHERE step = %s;
+"""
+
+INSERT_ETL_CHECKPOINT = """
+INSERT INTO etl_checkpoint (step, row_count, seconds, finished_at)
+VALUES (%s, %s, %s, GETDATE());
+"""
+
+DELETE_ETL_CHECKPOINT = 'DELETE FROM etl_checkpoint;'
+
+# LOAD GENERATIONS
+# bumped by each successful pipeline run, the cached query results
+# of an older generation are stale
+
+SELECT_ETL_GENERATION = """
+SELECT COALESCE(MAX(generation), 0)
+FROM etl_generation;
+"""
+
+INSERT_ETL_GENERATION = """
+INSERT INTO etl_generation (generation, loaded_at)
+SELECT COALESCE(MAX(generation), 0) + 1, GETDATE()
+FROM etl_generation;
+"""
+
+# STATEMENT CANCELLATION
+# a statement past its deadline is cancelled by its backend process id
+# from another session
+
+SELECT_BACKEND_PID = 'SELECT pg_backend_pid();'
+
+SELECT_CANCEL_BACKEND = 'SELECT pg_cancel_backend(%s);'
+
+# SMALL FILE COMPACTION
+# the compacted file count is a multiple of the cluster slices
+
+SELECT_SLICE_COUNT = 'SELECT COUNT(*) FROM stv_slices;'
+
+# PARTITIONED COPY
+# concurrent COPYs into one table wait on its write lock, so each
+# partition is loaded into its own table and appended to staging_events
+# in one transaction, the {start} and {end} ts bounds are epoch ms
+
+CREATE_TABLE_STAGING_EVENTS_PARTITION = """
+CREATE TABLE {table} (LIKE staging_events);
+"""
+
+DROP_TABLE_STAGING_EVENTS_PARTITION = 'DROP TABLE IF EXISTS {table};'
+
+DELETE_STAGING_EVENTS_WINDOW = """
+DELETE FROM staging_events
+WHERE ts >= {start} AND ts < {end};
+"""
+
+# a load without window replaces every row, the undated files included
+DELETE_STAGING_EVENTS_ALL = 'DELETE FROM staging_events;'
+
+INSERT_STAGING_EVENTS_PARTITION = """
+INSERT INTO staging_events
+SELECT * FROM {table};
+"""
+
+# TABLE MAINTENANCE
+# the table health columns: name, unsorted, stats_off, skew_rows and
+# deleted, all percents but skew_rows, the largest to smallest slice
+# rows ratio; VACUUM must run outside a transaction block
+
+SELECT_TABLE_INFO = """
+SELECT "table",
+       COALESCE(unsorted, 0),
+       COALESCE(stats_off, 0),
+       COALESCE(skew_rows, 1),
+       CASE WHEN tbl_rows > 0
+            THEN 100.0 * (tbl_rows - estimated_visible_rows) / tbl_rows
+            ELSE 0 END
+FROM svv_table_info
+WHERE schema = CURRENT_SCHEMA();
+"""
+
+# PostgreSQL has no sort keys nor slices, the stats_off of a table
+# never analyzed is 100
+SELECT_PG_TABLE_STATS = """
+SELECT relname,
+       0,
+       CASE WHEN COALESCE(last_analyze, last_autoanalyze) IS NULL THEN 100.0
+            ELSE 100.0 * n_mod_since_analyze / GREATEST(n_live_tup, 1) END,
+       1,
+       100.0 * n_dead_tup / GREATEST(n_live_tup + n_dead_tup, 1)
+FROM pg_stat_user_tables
+WHERE schemaname = CURRENT_SCHEMA();
+"""
+
+ANALYZE_TABLE = 'ANALYZE {table};'
+
+VACUUM_TABLE = 'VACUUM {table};'
+
+VACUUM_SORT_ONLY = 'VACUUM SORT ONLY {table};'
+
+VACUUM_DELETE_ONLY = 'VACUUM DELETE ONLY {table};'
+
+# TRUNCATE TABLES
+
+TRUNCATE_TABLE_SONGPLAYS = 'TRUNCATE TABLE songplays;'
+TRUNCATE_TABLE_USERS = 'TRUNCATE TABLE users;'
+TRUNCATE_TABLE_SONGS = 'TRUNCATE TABLE songs;'
+TRUNCATE_TABLE_ARTISTS = 'TRUNCATE TABLE artists;'
+TRUNCATE_TABLE_TIME = 'TRUNCATE TABLE time;'
+
 # QUERY LISTS
+# COPY_TABLE_QUERIES is rendered on first use, see LAZY COPY STATEMENTS
 
 CREATE_TABLE_QUERIES = [CREATE_TABLE_STAGING_EVENTS, CREATE_TABLE_STAGING_SONGS,
                         CREATE_TABLE_SONGPLAYS, CREATE_TABLE_USERS,
                         CREATE_TABLE_SONGS, CREATE_TABLE_ARTISTS,
-                        CREATE_TABLE_TIME]
+                        CREATE_TABLE_TIME, CREATE_TABLE_ETL_STATE,
+                        CREATE_TABLE_ETL_CHECKPOINT,
+                        CREATE_TABLE_ETL_GENERATION]
 
 DROP_TABLE_QUERIES = [DROP_TABLE_STAGING_EVENTS, DROP_TABLE_STAGING_SONGS,
                       DROP_TABLE_SONGPLAYS, DROP_TABLE_USERS, DROP_TABLE_SONGS,
-                      DROP_TABLE_ARTISTS, DROP_TABLE_TIME]
-
-COPY_TABLE_QUERIES = [COPY_STAGING_EVENTS, COPY_STAGING_SONGS]
+                      DROP_TABLE_ARTISTS, DROP_TABLE_TIME,
+                      DROP_TABLE_STAGING_PLAYS, DROP_TABLE_ETL_STATE,
+                      DROP_TABLE_ETL_CHECKPOINT]
 
 INSERT_TABLE_QUERIES = [INSERT_TABLE_SONGPLAYS, INSERT_TABLE_USERS,
                         INSERT_TABLE_SONGS, INSERT_TABLE_ARTISTS,
                         INSERT_TABLE_TIME]
+
+MATERIALIZED_INSERT_TABLE_QUERIES = [DROP_TABLE_STAGING_PLAYS,
+                                     CREATE_TABLE_STAGING_PLAYS,
+                                     INSERT_TABLE_SONGPLAYS_FROM_PLAYS,
+                                     INSERT_TABLE_USERS,
+                                     INSERT_TABLE_SONGS_FROM_PLAYS,
+                                     INSERT_TABLE_ARTISTS_FROM_PLAYS,
+                                     INSERT_TABLE_TIME_FROM_PLAYS,
+                                     DROP_TABLE_STAGING_PLAYS]
+
+INCREMENTAL_INSERT_TABLE_QUERIES = [INSERT_TABLE_SONGPLAYS_INCREMENTAL,
+                                    INSERT_TABLE_TIME_INCREMENTAL]
+
+# (staging queries, count query, merge queries) of each dimension,
+# the count query reads the new or changed rows left in the delta table
+
+UPSERT_USERS_QUERIES = ([DROP_TABLE_USERS_DELTA, CREATE_TABLE_USERS_DELTA,
+                         DELETE_USERS_DELTA_UNCHANGED],
+                        SELECT_USERS_DELTA_COUNT,
+                        [DELETE_USERS_CHANGED, INSERT_USERS_DELTA,
+                         DROP_TABLE_USERS_DELTA])
+
+UPSERT_SONGS_QUERIES = ([DROP_TABLE_SONGS_DELTA, CREATE_TABLE_SONGS_DELTA,
+                         DELETE_SONGS_DELTA_UNCHANGED],
+                        SELECT_SONGS_DELTA_COUNT,
+                        [DELETE_SONGS_CHANGED, INSERT_SONGS_DELTA,
+                         DROP_TABLE_SONGS_DELTA])
+
+UPSERT_ARTISTS_QUERIES = ([DROP_TABLE_ARTISTS_DELTA,
+                           CREATE_TABLE_ARTISTS_DELTA,
+                           DELETE_ARTISTS_DELTA_UNCHANGED],
+                          SELECT_ARTISTS_DELTA_COUNT,
+                          [DELETE_ARTISTS_CHANGED, INSERT_ARTISTS_DELTA,
+                           DROP_TABLE_ARTISTS_DELTA])
+
+UPSERT_TABLE_QUERIES = {'users': UPSERT_USERS_QUERIES,
+                        'songs': UPSERT_SONGS_QUERIES,
+                        'artists': UPSERT_ARTISTS_QUERIES}
+
+TRUNCATE_TABLE_QUERIES = [TRUNCATE_TABLE_SONGPLAYS, TRUNCATE_TABLE_USERS,
+                          TRUNCATE_TABLE_SONGS, TRUNCATE_TABLE_ARTISTS,
+                          TRUNCATE_TABLE_TIME]
+
+# QUERY DEPENDENCIES
+# (target table, query, source tables) of each ETL statement,
+# COPY_TABLE_STEPS is rendered on first use
+
+INSERT_TABLE_STEPS = [
+    ('songplays', INSERT_TABLE_SONGPLAYS, ('staging_events', 'staging_songs')),
+    ('users', INSERT_TABLE_USERS, ('staging_events',)),
+    ('songs', INSERT_TABLE_SONGS, ('staging_events', 'staging_songs')),
+    ('artists', INSERT_TABLE_ARTISTS, ('staging_events', 'staging_songs')),
+    ('time', INSERT_TABLE_TIME, ('staging_events', 'staging_songs'))]
+
+MATERIALIZED_INSERT_TABLE_STEPS = [
+    ('staging_plays', CREATE_TABLE_STAGING_PLAYS,
+     ('staging_events', 'staging_songs')),
+    ('songplays', INSERT_TABLE_SONGPLAYS_FROM_PLAYS, ('staging_plays',)),
+    ('users', INSERT_TABLE_USERS, ('staging_events',)),
+    ('songs', INSERT_TABLE_SONGS_FROM_PLAYS, ('staging_plays',)),
+    ('artists', INSERT_TABLE_ARTISTS_FROM_PLAYS, ('staging_plays',)),
+    ('time', INSERT_TABLE_TIME_FROM_PLAYS, ('staging_plays',))]
+
+# LAZY COPY STATEMENTS
+# names rendered from the templates with the dwh.cfg values on first use
+
+LAZY_QUERIES = ('COPY_STAGING_EVENTS', 'COPY_STAGING_SONGS',
+                'COPY_STAGING_EVENTS_MANIFEST',
+                'COPY_STAGING_EVENTS_PARTITION', 'COPY_TABLE_QUERIES',
+                'COPY_TABLE_STEPS', 'UNLOAD_QUERY')
+
+
+def render_copy_queries(config=None):
+    """Renders the COPY statements with the dwh.cfg values.
+
+    Args:
+        config: An optional Config object. Defaults to the shared one.
+
+    Returns:
+        A dict of the LAZY_QUERIES names to their values.
+    """
+    config = config or Config()
+    values = {'log_data': config.get('S3', 'LOG_DATA'),
+              'song_data': config.get('S3', 'SONG_DATA'),
+              'song_manifest': config.get('S3', 'SONG_DATA_MANIFEST',
+                                          fallback=None),
+              'role_arn': config.get('IAM', 'REDSHIFT_ROLE_ARN'),
+              'region': config.get('AWS', 'REGION')}
+
+    events = COPY_STAGING_EVENTS_TEMPLATE.format(**values)
+    # the compacted song data replaces the small files when set
+    if values['song_manifest']:
+        songs = COPY_STAGING_SONGS_MANIFEST_TEMPLATE.format(**values)
+    else:
+        songs = COPY_STAGING_SONGS_TEMPLATE.format(**values)
+
+    return {'COPY_STAGING_EVENTS': events,
+            'COPY_STAGING_SONGS': songs,
+            'COPY_STAGING_EVENTS_MANIFEST':
+                COPY_STAGING_EVENTS_MANIFEST_TEMPLATE.format(**values),
+            'COPY_STAGING_EVENTS_PARTITION':
+                COPY_STAGING_EVENTS_PARTITION_TEMPLATE.format(**values),
+            'UNLOAD_QUERY': UNLOAD_QUERY_TEMPLATE.format(**values),
+            'COPY_TABLE_QUERIES': [events, songs],
+            'COPY_TABLE_STEPS': [('staging_events', events, ()),
+                                 ('staging_songs', songs, ())]}
+
+
+def __getattr__(name):
+    """Renders the COPY statements on the first access to one of them.
+
+    The rendered values are cached as module globals, so this
+    function is not called again for them.
+    """
+    if name not in LAZY_QUERIES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    globals().update(render_copy_queries())
+    return globals()[name]
@@ -0,0 +1,170 @@
+"""Defines the streaming readers of compressed and large json objects.
+
+The readers wrap the S3 HTTP body stream, decompress it on the fly by
+the key suffix and parse it incrementally, so only one read chunk and
+the current record are kept in memory, whatever the object size. The
+gzip and bzip2 codecs are built in, zstd needs the zstandard package
+and the incremental parsing of a single json document needs ijson.
+"""
+
+# sys libs
+import bz2
+import gzip
+import json
+
+# optional zstd codec
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# optional incremental json parser
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# bytes read from the body stream at a time
+CHUNK_BYTES = 64 * 1024
+# key suffixes of the json objects
+JSON_SUFFIXES = ('.json', '.jsonl')
+# key suffix of each compression codec
+COMPRESSIONS = {'.gz': 'gzip', '.bz2': 'bzip2', '.zst': 'zstd'}
+
+
+def compression(key):
+    """Finds the compression codec of an object key.
+
+    Args:
+        key: The S3 object key. E.g. log_data/2018-11-01-events.json.gz
+
+    Returns:
+        The codec name or None for an uncompressed object.
+    """
+    for suffix, codec in COMPRESSIONS.items():
+        if key.endswith(suffix):
+            return codec
+    return None
+
+
+def is_json(key):
+    """True if the key is a json object, compressed or not."""
+    for suffix in COMPRESSIONS:
+        if key.endswith(suffix):
+            key = key[:-len(suffix)]
+            break
+    return key.endswith(JSON_SUFFIXES)
+
+
+def open_stream(body, key):
+    """Wraps a binary stream with the decompressor of the key suffix.
+
+    Args:
+        body: A binary file-like object with a read method,
+            e.g. the get_object StreamingBody.
+        key: The S3 object key.
+
+    Returns:
+        A binary file-like object of the decompressed content.
+
+    Raises:
+        RuntimeError: If the object is zstd compressed and the
+            zstandard package is not installed.
+    """
+    codec = compression(key)
+    if codec == 'gzip':
+        return gzip.GzipFile(fileobj=body, mode='rb')
+    if codec == 'bzip2':
+        return bz2.BZ2File(body, mode='rb')
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError(f'zstandard is required to read {key}')
+        return zstandard.ZstdDecompressor().stream_reader(
+            body, read_across_frames=True)
+    return body
+
+
+def iter_lines(stream, chunk_bytes=CHUNK_BYTES):
+    """Reads the lines of a binary stream chunk by chunk.
+
+    Args:
+        stream: A binary file-like object.
+        chunk_bytes: The bytes read at a time.
+
+    Yields:
+        Each non empty line as bytes, without the line break.
+    """
+    rest = b''
+    while True:
+        chunk = stream.read(chunk_bytes)
+        if not chunk:
+            break
+
+        lines = (rest + chunk).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield line
+
+    if rest.strip():
+        yield rest
+
+
+def iter_json_lines(stream, chunk_bytes=CHUNK_BYTES):
+    """Parses a json lines stream one record at a time.
+
+    Args:
+        stream: A binary file-like object.
+        chunk_bytes: The bytes read at a time.
+
+    Yields:
+        A dict record per line.
+    """
+    for line in iter_lines(stream, chunk_bytes):
+        yield json.loads(line)
+
+
+def iter_items(stream, prefix='item'):
+    """Parses the items of a single json document.
+
+    The prefix is the ijson path of the items, e.g. 'jsonpaths.item'
+    for the list of a JSONPaths file. Without ijson the document is
+    parsed at once and the items are read from it.
+
+    Args:
+        stream: A binary file-like object.
+        prefix: The dot separated path of the items,
+            where 'item' is each element of a list.
+
+    Yields:
+        Each item found at the prefix.
+    """
+    if ijson is not None:
+        yield from ijson.items(stream, prefix, use_float=True)
+        return
+
+    values = [json.load(stream)]
+    for name in filter(None, prefix.split('.')):
+        if name == 'item':
+            values = [item for value in values for item in value]
+        else:
+            values = [value[name] for value in values]
+
+    yield from values
+
+
+def load_document(stream):
+    """Parses a whole json document from a binary stream.
+
+    With ijson the decoded text is never held in memory besides the
+    parsed object.
+
+    Args:
+        stream: A binary file-like object.
+
+    Returns:
+        The parsed json value.
+    """
+    if ijson is not None:
+        return next(ijson.items(stream, '', use_float=True))
+    return json.load(stream)
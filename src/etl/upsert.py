@@ -0,0 +1,131 @@
+"""Defines the DimensionUpsert class to merge the staged dimension rows.
+
+A plain INSERT ... SELECT DISTINCT emits one users row per level seen
+in the staging data and rewrites the whole table on every load. The
+upsert keeps the latest staged row per key, drops the rows whose MD5
+row hash equals the dimension row, and replaces only the new and the
+changed rows, so Redshift rewrites only the affected blocks.
+"""
+
+# sys libs
+import argparse
+from timeit import default_timer as timer
+# SQL libs
+from connection import Connection
+from sql_queries import UPSERT_TABLE_QUERIES
+
+
+class DimensionUpsert:
+    """This class defines the users, songs and artists upsert stage.
+
+    All tables are merged in one transaction, so a failure leaves
+    the dimension tables untouched.
+
+    Code usage example after loading the staging tables:
+
+    connection = Connection()
+    changed = DimensionUpsert(connection).run()
+
+    Usage example as python script with redshift connection:
+
+    python -m upsert --redshift
+    """
+
+    def __init__(self, connection):
+        """Creates the DimensionUpsert object and sets the connection.
+
+        Args:
+            connection: The connection adapter wrapper.
+        """
+        self.connection = connection
+
+    def upsert(self, table):
+        """Merges the staged rows of one dimension table.
+
+        The transaction is left pending.
+
+        Args:
+            table: The dimension table name. E.g. users
+
+        Returns:
+            The number of new or changed rows.
+        """
+        staging, count, merge = UPSERT_TABLE_QUERIES[table]
+
+        for query in staging:
+            self.connection.execute(query)
+
+        changed = self.connection.query(count)[0][0]
+
+        for query in merge:
+            self.connection.execute(query)
+
+        return changed
+
+    def run(self, commit=True):
+        """Merges all dimension tables.
+
+        Args:
+            commit: If True commits the transaction, otherwise leaves
+                it pending for the caller to commit with other changes.
+
+        Returns:
+            A dict of table name to the number of new or changed rows.
+        """
+        changed = {}
+        try:
+            for table in UPSERT_TABLE_QUERIES:
+                changed[table] = self.upsert(table)
+
+            if commit:
+                self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+
+        return changed
+
+
+def main(redshift):
+    """The upsert.py script entry point.
+
+    Args:
+        redshift: If True uses the Redshift connector API,
+            otherwise use the default Psycopg2 adapter.
+    """
+    # sets the connection
+    connection = Connection(redshift=redshift)
+
+    # run the upsert
+    start = timer()
+    changed = DimensionUpsert(connection).run()
+    # the cached query results of the previous loads are stale
+    connection.bump_generation()
+    upsert_time = timer() - start
+    connection.close()
+
+    # STATS: print the row and time statistics
+    print('-----------------------------------------------------')
+    print('Upsert Statistics')
+    print('-----------------------------------------------------')
+    for table, rows in changed.items():
+        print(f'{table} new or changed rows: {rows}')
+    print(f'Upsert time: {round(upsert_time, 2)} seconds')
+
+
+if __name__ == '__main__':
+    # create the command line parser
+    parser = argparse.ArgumentParser(
+        description='AWS Redshift Dimension Upsert')
+
+    # set the command line arguments
+    parser.add_argument('--redshift',
+                        help='Set the redshift connector - default: pyscopg2',
+                        type=bool,
+                        default=False)
+
+    # parse the command line arguments
+    args = parser.parse_args()
+
+    # run the upsert
+    main(args.redshift)
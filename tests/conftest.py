@@ -0,0 +1,7 @@
+"""Puts the flat etl modules on the import path of the tests."""
+
+# sys libs
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'etl'))
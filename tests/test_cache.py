@@ -0,0 +1,52 @@
+"""Tests the DiskCache LRU bookkeeping."""
+
+# sys libs
+import os
+# data libs
+from cache import DiskCache
+
+
+def test_evicts_least_recently_used(tmp_path):
+    """A read entry outlives an older unread one when the cap is met."""
+    cache = DiskCache(str(tmp_path), max_bytes=8)
+    cache.put_bytes('a', b'1234')
+    cache.put_bytes('b', b'1234')
+    assert cache.get_path('a') is not None
+
+    cache.put_bytes('c', b'1234')
+
+    assert list(cache.entries) == ['a', 'c']
+    assert not os.path.exists(cache.path('b'))
+    assert cache.stats()['bytes'] == 8
+
+
+def test_skips_oversized_entries(tmp_path):
+    """An entry larger than the cap replaces nothing and is not stored."""
+    cache = DiskCache(str(tmp_path), max_bytes=4)
+    cache.put_bytes('a', b'12')
+
+    assert cache.put_bytes('a', b'12345') is None
+    assert cache.get_path('a') is None
+
+
+def test_missing_file_is_a_miss(tmp_path):
+    """A file removed behind the index is a miss and leaves the index."""
+    cache = DiskCache(str(tmp_path))
+    cache.put_bytes('a', b'1234')
+    os.remove(cache.path('a'))
+
+    assert cache.get_path('a') is None
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (0, 1)
+    assert (stats['entries'], stats['bytes']) == (0, 0)
+
+
+def test_rebuilds_the_index_on_restart(tmp_path):
+    """The cached files are indexed again by a new cache object."""
+    DiskCache(str(tmp_path)).put_bytes('a', b'1234')
+
+    cache = DiskCache(str(tmp_path))
+
+    assert cache.get_path('a') == cache.path('a')
+    assert cache.stats()['bytes'] == 4
@@ -0,0 +1,124 @@
+"""Tests the Checkpoint resume and retry logic."""
+
+# sys libs
+import contextlib
+# SQL libs
+from checkpoint import Checkpoint
+from scheduler import Step
+from sql_queries import SELECT_ETL_CHECKPOINT, SELECT_ETL_CHECKPOINT_STEP
+from sql_queries import DELETE_ETL_CHECKPOINT
+
+
+class DroppedConnection(Exception):
+    """A transient error of the connection stand-in."""
+
+
+class CheckpointConnection:
+    """A connection stand-in recording the executed statements."""
+
+    transient_errors = (DroppedConnection,)
+
+    def __init__(self, rows=(), drops=0):
+        self.rows = list(rows)
+        self.committed = {}
+        self.drops = drops
+        self.statements = []
+        self.reconnects = 0
+        self.metrics = None
+        self.retries = 0
+        self.attempts = []
+
+    def query(self, query, params=None):
+        """Returns the recorded checkpoints."""
+        if query == SELECT_ETL_CHECKPOINT_STEP:
+            name, = params
+            return [(self.committed[name],)] if name in self.committed \
+                else []
+        assert query == SELECT_ETL_CHECKPOINT
+        return self.rows
+
+    def execute(self, query, params=None, commit=False):
+        """Records a statement, failing while drops are left."""
+        self.attempts.append((query, self.retries))
+        if self.drops:
+            self.drops -= 1
+            raise DroppedConnection('server closed the connection')
+        self.statements.append(query)
+
+    @property
+    def cursor(self):
+        """A cursor stand-in without a row count."""
+        return self
+
+    rowcount = -1
+
+    def reconnect(self):
+        """Counts the reconnections."""
+        self.reconnects += 1
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Groups nothing, the statements are only recorded."""
+        yield
+
+
+def test_resume_keeps_the_completed_steps():
+    """A resumed run reads the completed steps instead of clearing them."""
+    connection = CheckpointConnection(rows=[('songs', 10)])
+    checkpoint = Checkpoint(connection, resume=True)
+
+    assert checkpoint.start() == {'songs': 10}
+    assert checkpoint.done('songs')
+    assert not checkpoint.done('users')
+    assert not connection.statements
+
+
+def test_new_run_clears_the_completed_steps():
+    """A run that does not resume starts from an empty checkpoint."""
+    connection = CheckpointConnection(rows=[('songs', 10)])
+    checkpoint = Checkpoint(connection)
+
+    assert checkpoint.start() == {}
+    assert not checkpoint.done('songs')
+    assert connection.statements == [DELETE_ETL_CHECKPOINT]
+
+
+def test_execute_records_the_step():
+    """A step runs with its checkpoint and is marked as done."""
+    connection = CheckpointConnection()
+    checkpoint = Checkpoint(connection)
+
+    checkpoint.execute(connection, Step('songs', 'INSERT INTO songs', ()))
+
+    assert connection.statements[0] == 'INSERT INTO songs'
+    assert len(connection.statements) == 2
+    assert checkpoint.done('songs')
+
+
+def test_retries_a_dropped_connection():
+    """A transient error reconnects and runs the step again."""
+    connection = CheckpointConnection(drops=1)
+    checkpoint = Checkpoint(connection, delay=0)
+
+    checkpoint.execute(connection, Step('songs', 'INSERT INTO songs', ()))
+
+    assert connection.reconnects == 1
+    assert connection.statements[0] == 'INSERT INTO songs'
+    assert connection.attempts[:2] == [('INSERT INTO songs', 0),
+                                       ('INSERT INTO songs', 1)]
+    assert connection.retries == 0
+    assert checkpoint.done('songs')
+
+
+def test_skips_a_step_committed_before_the_drop():
+    """A step found in etl_checkpoint after a drop is not run again."""
+    connection = CheckpointConnection(drops=1)
+    connection.committed['songs'] = 10
+    checkpoint = Checkpoint(connection, delay=0)
+
+    count = checkpoint.execute(connection,
+                               Step('songs', 'INSERT INTO songs', ()))
+
+    assert count == 10
+    assert not connection.statements
+    assert checkpoint.done('songs')
@@ -0,0 +1,58 @@
+"""Tests the FileCompactor grouping of the small files."""
+
+# sys libs
+import pytest
+# AWS libs
+from index import IndexEntry
+from compaction import FileCompactor, file_count, split_entries
+
+
+def entries(*sizes):
+    """IndexEntry objects of the given sizes in key order."""
+    return [IndexEntry(f'song_data/{index:03d}.json', size, '"etag"', None)
+            for index, size in enumerate(sizes)]
+
+
+def test_file_count_is_a_multiple_of_slices():
+    """The compacted file count rounds up to a multiple of slices."""
+    assert file_count(0, 4, 100) == 4
+    assert file_count(400, 4, 100) == 4
+    assert file_count(401, 4, 100) == 8
+
+
+@pytest.mark.parametrize('sizes, count', [
+    ((1000, 1, 1, 1), 4),
+    ((1, 1, 1, 1000), 4),
+    ((1,) * 10, 4),
+    ((5, 1, 1, 1, 1, 1, 9, 2), 3),
+    ((0, 0, 0), 2),
+])
+def test_split_entries_returns_count_groups(sizes, count):
+    """Uneven sizes still fill exactly count contiguous groups."""
+    files = entries(*sizes)
+
+    groups = split_entries(files, count)
+
+    assert len(groups) == count
+    assert all(groups)
+    assert [entry for group in groups for entry in group] == files
+
+
+def test_split_entries_balances_the_bytes():
+    """Even sizes are split evenly."""
+    groups = split_entries(entries(*(10,) * 8), 4)
+
+    assert [len(group) for group in groups] == [2, 2, 2, 2]
+
+
+def test_split_entries_caps_the_count_by_the_files():
+    """There are never more groups than files."""
+    assert len(split_entries(entries(1, 2), 4)) == 2
+
+
+def test_plan_keeps_a_multiple_of_slices():
+    """Few files are grouped into a multiple of slices."""
+    compactor = FileCompactor(loader=None, target_bytes=1)
+
+    assert len(compactor.plan(entries(*(5,) * 10), slices=4)) == 8
+    assert len(compactor.plan(entries(1, 1), slices=4)) == 2
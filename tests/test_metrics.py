@@ -0,0 +1,31 @@
+"""Tests the statement labels and the MetricsRecorder exports."""
+
+# metrics libs
+from metrics import MetricsRecorder, statement_label
+
+
+def test_statement_label():
+    """The labels keep the verb and the target table."""
+    assert statement_label('COPY staging_events FROM') == \
+        'copy staging_events'
+    assert statement_label('\nINSERT INTO users\n(SELECT') == 'insert users'
+    assert statement_label('DROP TABLE IF EXISTS time;') == 'drop time'
+    assert statement_label('SELECT * FROM songs;') == 'select'
+    assert statement_label('   ') == 'empty'
+
+
+def test_prometheus_counts_failed_and_retried_attempts():
+    """Each attempt is counted, with its failures and retries."""
+    metrics = MetricsRecorder('etl', run_id='run')
+    metrics.record('insert songs', 1.0, error='OperationalError')
+    metrics.record('insert songs', 2.0, rows=10, retries=1)
+    metrics.record('copy staging_events', 3.0, rows=5, bytes_=100)
+
+    lines = metrics.prometheus().splitlines()
+
+    base = 'pipeline="etl",statement="insert songs"'
+    assert f'etl_statement_count{{{base}}} 2' in lines
+    assert f'etl_statement_failures{{{base}}} 1' in lines
+    assert f'etl_statement_retries{{{base}}} 1' in lines
+    assert f'etl_statement_rows{{{base}}} 10' in lines
+    assert metrics.report()['statements'][0]['error'] == 'OperationalError'
@@ -0,0 +1,114 @@
+"""Tests the SchemaMigration plan against simulated catalogs."""
+
+# SQL libs
+from migrate import SchemaMigration, type_key
+from sql_queries import SELECT_TABLE_COLUMNS, SELECT_TABLE_KEYS
+
+USERS = """
+CREATE TABLE users (
+user_id             INT                 NOT NULL    sortkey,
+level               TEXT                                   ,
+PRIMARY KEY (user_id)
+) diststyle all;
+"""
+
+SONGS = """
+CREATE TABLE songs (
+song_id             TEXT                NOT NULL           ,
+duration            DECIMAL(9,2)                           ,
+PRIMARY KEY (song_id)
+);
+"""
+
+
+class CatalogConnection:
+    """A connection stand-in answering the catalog queries."""
+
+    def __init__(self, columns, keys=(), is_redshift=True):
+        self.results = {SELECT_TABLE_COLUMNS: list(columns),
+                        SELECT_TABLE_KEYS: list(keys)}
+        self.is_redshift = is_redshift
+
+    def query(self, query):
+        """Returns the rows of a catalog query."""
+        return self.results[query]
+
+
+def plan(columns, keys=(), queries=(USERS,)):
+    """Plans the migration of the declared tables over a catalog."""
+    connection = CatalogConnection(columns, keys)
+    return SchemaMigration(connection, list(queries)).plan()
+
+
+def test_creates_the_missing_tables():
+    """A table absent from the catalog is created from its DDL."""
+    changes = plan([])
+
+    assert [(change.table, change.action) for change in changes] == \
+        [('users', 'create')]
+    assert changes[0].queries == [USERS]
+
+
+def test_unchanged_table_plans_nothing():
+    """Matching columns and keys are left as they are."""
+    columns = [('users', 'user_id', 'integer', 32, 0),
+               ('users', 'level', 'character varying', None, None)]
+    keys = [('users', 'user_id', False, True),
+            ('users', 'level', False, False)]
+
+    assert not plan(columns, keys)
+
+
+def test_adds_and_drops_nullable_columns():
+    """A new nullable column and an undeclared one are altered in place."""
+    columns = [('users', 'user_id', 'integer', 32, 0),
+               ('users', 'gender', 'character varying', None, None)]
+    keys = [('users', 'user_id', False, True)]
+
+    changes = plan(columns, keys)
+
+    assert [change.action for change in changes] == ['alter']
+    assert changes[0].queries == [
+        'ALTER TABLE users ADD COLUMN level TEXT;',
+        'ALTER TABLE users DROP COLUMN gender;']
+
+
+def test_rebuilds_on_a_type_change():
+    """A changed DECIMAL scale copies the rows into a new table."""
+    columns = [('songs', 'song_id', 'character varying', None, None),
+               ('songs', 'duration', 'numeric', 9, 4)]
+
+    changes = plan(columns, queries=[SONGS])
+
+    assert [change.action for change in changes] == ['rebuild']
+    assert changes[0].queries[0].startswith(
+        '\nCREATE TABLE songs_migrate (')
+    assert 'CAST (duration AS DECIMAL(9,2))' in changes[0].queries[1]
+    assert changes[0].queries[-1] == \
+        'ALTER TABLE songs_migrate RENAME TO songs;'
+
+
+def test_rebuilds_on_a_declared_key_change():
+    """A sort key moved off a declared sortkey column needs a rebuild."""
+    columns = [('users', 'user_id', 'integer', 32, 0),
+               ('users', 'level', 'character varying', None, None)]
+    keys = [('users', 'user_id', False, False),
+            ('users', 'level', False, True)]
+
+    assert [change.action for change in plan(columns, keys)] == ['rebuild']
+
+
+def test_ignores_the_auto_keys_of_tables_declaring_none():
+    """Redshift AUTO keys do not rebuild a table declaring no keys."""
+    columns = [('songs', 'song_id', 'character varying', None, None),
+               ('songs', 'duration', 'numeric', 9, 2)]
+    keys = [('songs', 'song_id', True, True)]
+
+    assert not plan(columns, keys, queries=[SONGS])
+
+
+def test_type_key_families():
+    """Declared and catalog type names map to the same key."""
+    assert type_key('DOUBLE PRECISION') == type_key('float8')
+    assert type_key('TEXT') == type_key('character varying')
+    assert type_key('DECIMAL', 13) == ('numeric', 13, 0)
@@ -0,0 +1,148 @@
+"""Tests the CopyPlanner partitioning, dry run and load statements."""
+
+# sys libs
+import json
+import contextlib
+import configparser
+from datetime import date
+# AWS libs
+import boto3
+import pytest
+from moto import mock_aws
+# data libs
+import sql_queries
+from index import IndexEntry
+from planner import CopyPlanner, month_prefixes, partition_by_month
+from planner import partition_by_size, epoch_ms
+from s3 import S3Loader
+from sql_queries import DELETE_STAGING_EVENTS_ALL
+
+BUCKET = 'sparkify'
+
+
+def entry(key, size=1):
+    """An IndexEntry of a log file."""
+    return IndexEntry(key, size, '"etag"', None)
+
+
+class LoadConnection:
+    """A connection stand-in recording the executed statements."""
+
+    metrics = None
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, query, commit=False, params=None):
+        """Records a statement."""
+        self.statements.append(query)
+
+    def execute_batch(self, queries, commit=True):
+        """Records the statements of a batch."""
+        self.statements.extend(queries)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Groups nothing, the statements are only recorded."""
+        yield
+
+
+@pytest.fixture(name='config')
+def fixture_config(monkeypatch):
+    """A dwh.cfg stand-in with the AWS and S3 sections."""
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    config = configparser.ConfigParser()
+    config.read_dict({'AWS': {'REGION': 'us-west-2', 'KEY': 'testing',
+                              'SECRET': 'testing'},
+                      'S3': {'LOG_DATA': f's3://{BUCKET}/log_data',
+                             'STAGING': f's3://{BUCKET}/staging'}})
+    return config
+
+
+def test_month_prefixes_cross_the_year():
+    """A window over a new year lists the months of both years."""
+    assert month_prefixes('log_data/', date(2018, 12, 30),
+                          date(2019, 1, 2)) == ['log_data/2018/12/',
+                                                'log_data/2019/01/']
+
+
+def test_partition_by_month_groups_the_undated_files():
+    """The files without a date in their name share one partition."""
+    partitions = partition_by_month([
+        entry('log_data/2018/11/2018-11-02-events.json'),
+        entry('log_data/extra.json'),
+        entry('log_data/2018/10/2018-10-31-events.json')])
+
+    assert [partition.name for partition in partitions] == \
+        ['2018_10', '2018_11', 'undated']
+
+
+def test_partition_by_size_balances_the_bins():
+    """The bins differ by at most the size of one file."""
+    entries = [entry(f'log_data/{index}.json', size)
+               for index, size in enumerate([9, 7, 5, 3, 2, 1])]
+
+    partitions = partition_by_size(entries, 3)
+
+    sizes = [sum(item.size for item in partition.entries)
+             for partition in partitions]
+    assert sorted(sizes) == [9, 9, 9]
+    assert len(partition_by_size(entries[:2], 3)) == 2
+
+
+def test_dry_run_needs_no_connection(config, tmp_path):
+    """A dry run plans and writes the manifests without a connection."""
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-west-2')
+        client.create_bucket(
+            Bucket=BUCKET,
+            CreateBucketConfiguration={'LocationConstraint': 'us-west-2'})
+        for day in (4, 5, 9):
+            client.put_object(
+                Bucket=BUCKET,
+                Key=f'log_data/2018/11/2018-11-{day:02d}-events.json',
+                Body=b'{}\n')
+
+        planner = CopyPlanner(None, S3Loader(config), config)
+        planned = planner.run(start=date(2018, 11, 5), end=date(2018, 11, 9),
+                              directory=str(tmp_path), dry_run=True)
+
+    assert [len(partition.entries) for partition in planned] == [1]
+    with open(tmp_path / 'log_data-2018_11.manifest',
+              encoding='utf-8') as file:
+        manifest = json.load(file)
+    assert [item['url'] for item in manifest['entries']] == \
+        [f's3://{BUCKET}/log_data/2018/11/2018-11-05-events.json']
+
+
+def test_load_replaces_the_window_or_the_whole_table(config, monkeypatch):
+    """A windowed load deletes its days, a full load every row."""
+    # the rendered COPY statements need the dwh.cfg credentials
+    monkeypatch.setitem(vars(sql_queries), 'COPY_STAGING_EVENTS_PARTITION',
+                        'COPY {table} FROM {manifest};')
+    partitions = partition_by_month([
+        entry('log_data/2018/11/2018-11-05-events.json'),
+        entry('log_data/extra.json')])
+
+    with mock_aws():
+        connection = LoadConnection()
+        planner = CopyPlanner(connection, S3Loader(config), config)
+        planner.load(partitions[:1], ['m0'], start=date(2018, 11, 5),
+                     end=date(2018, 11, 6))
+        windowed = connection.statements
+
+        connection = LoadConnection()
+        planner.connection = connection
+        planner.load(partitions, ['m0', 'm1'])
+        full = connection.statements
+
+    delete = [query for query in windowed if query.startswith('\nDELETE')]
+    assert len(delete) == 1
+    assert f'ts >= {epoch_ms(date(2018, 11, 5))}' in delete[0]
+    assert f'ts < {epoch_ms(date(2018, 11, 6))}' in delete[0]
+
+    inserts = [index for index, query in enumerate(full)
+               if 'INSERT INTO staging_events' in query]
+    assert full.index(DELETE_STAGING_EVENTS_ALL) < min(inserts)
+    assert len(inserts) == 2
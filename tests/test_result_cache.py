@@ -0,0 +1,93 @@
+"""Tests the QueryCache generation checks and SQL normalization."""
+
+# sys libs
+import pytest
+# data libs
+from result_cache import QueryCache, normalize_sql
+from sql_queries import SELECT_ETL_GENERATION
+
+
+class Cursor:
+    """A cursor stand-in returning one result."""
+
+    description = [('level',), ('plays',)]
+
+    @staticmethod
+    def fetchall():
+        """Returns the result rows."""
+        return [('free', 2), ('paid', 3)]
+
+
+class GenerationConnection:
+    """A connection stand-in with a settable load generation."""
+
+    def __init__(self, generation=1):
+        self.generation = generation
+        self.cursor = Cursor()
+        self.reads = 0
+        self.selects = 0
+        self.rollbacks = 0
+        self.error = None
+
+    def query(self, query, params=None):
+        """Returns the load generation."""
+        assert query == SELECT_ETL_GENERATION
+        self.reads += 1
+        return [(self.generation,)]
+
+    def execute(self, query, commit=False, params=None):
+        """Runs a cached SELECT, failing if an error is set."""
+        self.selects += 1
+        if self.error is not None:
+            raise self.error
+
+    def rollback(self):
+        """Counts the ended transactions."""
+        self.rollbacks += 1
+
+
+QUERY = 'SELECT level, COUNT(*) FROM songplays GROUP BY 1;'
+
+
+def test_normalize_sql_keeps_the_literals():
+    """Case, whitespace and comments do not change the key."""
+    query = "SELECT  *\n-- all\nFROM Users WHERE level = 'Paid';"
+    assert normalize_sql(query) == "select * from users where level = 'Paid'"
+
+
+def test_hit_trusts_the_generation_for_refresh_seconds(tmp_path):
+    """A hit within the refresh period does not read the cluster."""
+    connection = GenerationConnection()
+    cache = QueryCache(str(tmp_path), connection)
+
+    first = cache.query(QUERY)
+    second = cache.query(QUERY)
+
+    assert second.equals(first)
+    assert (connection.reads, connection.selects) == (1, 1)
+
+
+def test_new_generation_drops_the_entries(tmp_path):
+    """A new load generation reads the result again."""
+    connection = GenerationConnection()
+    cache = QueryCache(str(tmp_path), connection, refresh=0)
+    cache.query(QUERY)
+
+    connection.generation = 2
+    cache.query(QUERY)
+
+    assert connection.selects == 2
+    assert all(name.startswith('2-') for name in cache.entries)
+
+
+def test_failed_query_rolls_back(tmp_path):
+    """A failing SELECT does not leave the transaction aborted."""
+    connection = GenerationConnection()
+    connection.error = RuntimeError('relation does not exist')
+    cache = QueryCache(str(tmp_path), connection)
+
+    with pytest.raises(RuntimeError):
+        cache.query(QUERY)
+
+    assert connection.rollbacks == 2
+    assert not cache.entries
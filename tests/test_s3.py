@@ -0,0 +1,78 @@
+"""Tests the S3Loader reads of json objects from the ObjectCache."""
+
+# sys libs
+import bz2
+import gzip
+import mmap
+import configparser
+# AWS libs
+import boto3
+import pytest
+from moto import mock_aws
+# data libs
+import stream
+from cache import ObjectCache
+from s3 import S3Loader
+
+BUCKET = 'sparkify'
+LINES = b'{"song_id": "S1", "duration": 1.5}\n' \
+        b'{"song_id": "S2", "duration": 2.5}\n'
+CODECS = {'': bytes, '.gz': gzip.compress, '.bz2': bz2.compress}
+
+
+@pytest.fixture(name='config')
+def fixture_config(monkeypatch):
+    """A dwh.cfg stand-in with the AWS section."""
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    config = configparser.ConfigParser()
+    config.read_dict({'AWS': {'REGION': 'us-west-2', 'KEY': 'testing',
+                              'SECRET': 'testing'},
+                      'S3': {}})
+    return config
+
+
+@pytest.mark.parametrize('suffix', sorted(CODECS))
+def test_load_data_cache_hit(config, tmp_path, monkeypatch, suffix):
+    """An object is read again from its memory-mapped entry.
+
+    Only the compressed entries are copied for the decompressors.
+    """
+    bodies = []
+
+    def open_stream(body, key):
+        bodies.append(body)
+        return stream_open(body, key)
+
+    stream_open = stream.open_stream
+    monkeypatch.setattr(stream, 'open_stream', open_stream)
+
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-west-2')
+        client.create_bucket(
+            Bucket=BUCKET,
+            CreateBucketConfiguration={'LocationConstraint': 'us-west-2'})
+        client.put_object(Bucket=BUCKET, Key=f'song_data/a.json{suffix}',
+                          Body=CODECS[suffix](LINES))
+
+        cache = ObjectCache(str(tmp_path))
+        loader = S3Loader(config, cache=cache)
+        path = f's3://{BUCKET}/song_data'
+
+        miss = loader.load_data(path)
+        hit = loader.load_data(path)
+
+    assert cache.stats()['hits'] == 1
+    assert list(hit['song_id']) == ['S1', 'S2']
+    assert hit.equals(miss)
+    assert isinstance(bodies[1], mmap.mmap) == (not suffix)
+
+
+@pytest.mark.parametrize('chunk_rows', [0, -1])
+def test_iter_frames_rejects_non_positive_chunks(config, chunk_rows):
+    """A chunk size that can never be reached is rejected on the call."""
+    with mock_aws():
+        loader = S3Loader(config)
+        with pytest.raises(ValueError):
+            loader.iter_frames(f's3://{BUCKET}/song_data',
+                               chunk_rows=chunk_rows)
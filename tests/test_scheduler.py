@@ -0,0 +1,27 @@
+"""Tests the DagScheduler step graph validation."""
+
+# sys libs
+import pytest
+# SQL libs
+from scheduler import Step, validate
+
+
+def test_accepts_a_dag_with_external_sources():
+    """Tables no step writes are treated as already loaded."""
+    validate([Step('songplays', '', ('staging_events', 'songs')),
+              Step('songs', '', ('staging_songs',)),
+              Step('time', '', ('songplays',))])
+
+
+def test_rejects_duplicated_names():
+    """Two steps cannot write the same table."""
+    with pytest.raises(ValueError, match='duplicated'):
+        validate([Step('songs', '', ()), Step('songs', '', ())])
+
+
+def test_rejects_a_cycle():
+    """A cycle is reported with the steps left in it."""
+    with pytest.raises(ValueError, match=r"\['artists', 'songs'\]"):
+        validate([Step('users', '', ()),
+                  Step('songs', '', ('artists',)),
+                  Step('artists', '', ('songs', 'users'))])
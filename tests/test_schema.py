@@ -0,0 +1,60 @@
+"""Tests the Schema DDL parsing, casts and categorical concat."""
+
+# data libs
+import pandas as pd
+# SQL libs
+from schema import Schema, parse_columns, sql_dtype
+
+DDL = """
+CREATE TABLE staging (
+sessionId           SMALLINT,
+registration        DECIMAL(13,0),
+length              FLOAT,
+level               TEXT,
+ts                  BIGINT
+);
+"""
+
+
+def test_parse_columns():
+    """The columns keep their declared order, precision and scale."""
+    assert parse_columns(DDL) == [('sessionId', 'SMALLINT', None, None),
+                                  ('registration', 'DECIMAL', 13, 0),
+                                  ('length', 'FLOAT', None, None),
+                                  ('level', 'TEXT', None, None),
+                                  ('ts', 'BIGINT', None, None)]
+
+
+def test_sql_dtype():
+    """The DECIMAL columns map to the smallest fitting dtype."""
+    assert sql_dtype('DECIMAL', 2) == 'Int16'
+    assert sql_dtype('DECIMAL', 9) == 'Int32'
+    assert sql_dtype('DECIMAL', 13, 0) == 'Int64'
+    assert sql_dtype('DECIMAL', 9, 2) == 'float64'
+    assert sql_dtype('VARCHAR') == 'object'
+
+
+def test_apply_matches_the_columns_ignoring_case():
+    """The json keys are cast whatever their case."""
+    schema = Schema.from_ddl(DDL, categories=('level',))
+    data = pd.DataFrame({'sessionid': [1, None], 'level': ['free', 'paid'],
+                         'other': ['a', 'b']})
+
+    schema.apply(data)
+
+    assert str(data['sessionid'].dtype) == 'Int16'
+    assert str(data['level'].dtype) == 'category'
+    assert data['other'].dtype != 'category'
+
+
+def test_concat_unifies_the_categories():
+    """Frames with different categories concatenate as a categorical."""
+    schema = Schema.from_ddl(DDL, categories=('level',))
+    frames = [schema.apply(pd.DataFrame({'level': ['free']})),
+              schema.apply(pd.DataFrame({'level': ['paid', 'free']}))]
+
+    data = schema.concat(frames)
+
+    assert str(data['level'].dtype) == 'category'
+    assert list(data['level']) == ['free', 'paid', 'free']
+    assert set(data['level'].cat.categories) == {'free', 'paid'}